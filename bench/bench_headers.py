@@ -0,0 +1,81 @@
+'''
+Measures header ingest and lookup throughput
+Usage:
+    python bench/bench_headers.py
+'''
+import os
+import tempfile
+import time
+
+from zeta.db import connection, flatfile, headers
+
+import chaingen
+
+
+def bench_batch_store_header(count: int) -> float:
+    '''
+    Stores a chain of `count` headers in a single batch_store_header call
+    Returns:
+        (float): headers per second
+    '''
+    chain = chaingen.make_chain(count + 1)
+    with tempfile.TemporaryDirectory() as d:
+        connection.init_conn(path=d, db_name='bench', chain_name='regtest')
+
+        # NB: the first header anchors the chain at a known height
+        base = headers.parse_header(chain[0].hex())
+        base['height'] = 1
+        headers.store_header(base)
+
+        batch = [h.hex() for h in chain[1:]]
+        start = time.perf_counter()
+        assert headers.batch_store_header(batch)
+        elapsed = time.perf_counter() - start
+
+        assert headers.find_highest()[0]['height'] == count + 1
+        connection.CONN.close()
+    return count / elapsed
+
+
+def bench_find_by_height(count: int, flat: bool) -> float:
+    '''
+    Looks up every height of a `count` header chain
+    Args:
+        flat (bool): whether to mirror the chain to the flat file
+    Returns:
+        (float): lookups per second
+    '''
+    chain = chaingen.make_chain(count + 1)
+    with tempfile.TemporaryDirectory() as d:
+        connection.init_conn(path=d, db_name='bench', chain_name='regtest')
+        base = headers.parse_header(chain[0].hex())
+        base['height'] = 1
+        headers.store_header(base)
+        assert headers.batch_store_header([h.hex() for h in chain[1:]])
+        if flat:
+            flatfile.open_file(os.path.join(d, 'bench.headers'),
+                               connection.CONN)
+
+        start = time.perf_counter()
+        for height in range(1, count + 2):
+            headers.find_by_height(height)
+        elapsed = time.perf_counter() - start
+
+        flatfile.close()
+        connection.CONN.close()
+    return (count + 1) / elapsed
+
+
+def main() -> None:
+    for count in [2016, 20000]:
+        rate = bench_batch_store_header(count)
+        print('batch_store_header: {:>6} headers {:>10.0f} headers/sec'
+              .format(count, rate))
+    for flat in [False, True]:
+        rate = bench_find_by_height(20000, flat)
+        print('find_by_height ({}): {:>10.0f} lookups/sec'
+              .format('flat file' if flat else 'sqlite', rate))
+
+
+if __name__ == '__main__':
+    main()
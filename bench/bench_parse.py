@@ -0,0 +1,43 @@
+'''
+Compares header batch parsers
+Usage:
+    python bench/bench_parse.py
+'''
+import time
+
+from zeta.db import arrays, headers
+
+import chaingen
+
+
+def bench(name, parse, blob, count, repeat=5) -> None:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(blob)
+        best = min(best, time.perf_counter() - start)
+    print('{:<36} {:>6} headers {:>10.0f} headers/sec'.format(
+        name, count, count / best))
+
+
+def main() -> None:
+    for count in [2016, 20000]:
+        chain = chaingen.make_chain(count)
+        blob = b''.join(chain)
+        electrum_hex = blob.hex()
+
+        bench('parse_header per 80 byte hex slice',
+              lambda b: [headers.parse_header(b[i:i + 160])
+                         for i in range(0, len(b), 160)],
+              electrum_hex, count)
+        bench('headers.parse_header_blob',
+              headers.parse_header_blob, blob, count)
+        bench('arrays.parse_header_blob',
+              arrays.parse_header_blob, blob, count)
+        bench('arrays.HeaderBatch + check_linkage',
+              lambda b: arrays.HeaderBatch(b).check_linkage(),
+              blob, count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''
+Measures prevout ingest, finder and balance latency, and file size on a
+large table
+Usage:
+    python bench/bench_prevouts.py [count]
+'''
+import os
+import sys
+import time
+import random
+import tempfile
+
+from riemann.encoding import addresses as addr
+
+from zeta.db import balances, connection, prevouts
+from zeta.zeta_types import Prevout
+
+from typing import Callable, List
+
+ADDRESSES = 1000
+BATCH_SIZE = 10000
+LOOKUPS = 1000
+
+
+def _tx_id(i: int) -> str:
+    return i.to_bytes(32, 'big')[::-1].hex()
+
+
+def make_prevouts(count: int, address_list: List[str]) -> List[Prevout]:
+    '''
+    Makes `count` prevouts, 2 per tx, spread over address_list
+    Every other tx's outputs are spent by another tx
+    '''
+    return [{
+        'outpoint': {'tx_id': _tx_id(i // 2), 'index': i % 2},
+        'value': 1000 + i % 100000,
+        'spent_at': 554702 if i // 2 % 2 else -2,
+        'spent_by': _tx_id(2 ** 128 + i // 2) if i // 2 % 2 else '',
+        'address': address_list[i % len(address_list)]}
+        for i in range(count)]
+
+
+def _ms(run: Callable[[], object], repeat: int = 1) -> float:
+    '''
+    Returns:
+        (float): milliseconds per run
+    '''
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    address_list = [addr.make_p2pkh_address(i.to_bytes(33, 'big'))
+                    for i in range(ADDRESSES)]
+    prevout_list = make_prevouts(count, address_list)
+    rng = random.Random(0)
+    sample = rng.sample(range(count), LOOKUPS)
+
+    with tempfile.TemporaryDirectory() as d:
+        connection.init_conn(path=d, db_name='bench', chain_name='regtest')
+
+        start = time.perf_counter()
+        for i in range(0, count, BATCH_SIZE):
+            assert prevouts.batch_store_prevout(
+                prevout_list[i:i + BATCH_SIZE])
+        connection.commit(durable=True)
+        elapsed = time.perf_counter() - start
+        print('{:<34} {:>10.0f} prevouts/sec'.format(
+            'batch_store_prevout', count / elapsed))
+
+        connection.CONN.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size = os.path.getsize(connection.DB_PATH)
+        print('{:<34} {:>10.1f} MiB'.format('file size', size / 2 ** 20))
+
+        spent = [p for p in prevout_list[:LOOKUPS * 4] if p['spent_by']]
+        results = [
+            ('find_by_address', _ms(
+                lambda: [prevouts.find_by_address(a)
+                         for a in address_list[:20]]) / 20),
+            ('find_by_tx_id', _ms(
+                lambda: [prevouts.find_by_tx_id(
+                    prevout_list[i]['outpoint']['tx_id'])
+                    for i in sample]) / LOOKUPS),
+            ('find_by_outpoint', _ms(
+                lambda: [prevouts.find_by_outpoint(
+                    prevout_list[i]['outpoint'])
+                    for i in sample]) / LOOKUPS),
+            ('find_by_child', _ms(
+                lambda: [prevouts.find_by_child(p['spent_by'])
+                         for p in spent]) / len(spent)),
+            ('find_by_value_range', _ms(
+                lambda: prevouts.find_by_value_range(5000, 5999), 10)),
+            ('check_for_known_outpoints', _ms(
+                lambda: prevouts.check_for_known_outpoints(
+                    [prevout_list[i]['outpoint'] for i in sample[:500]]),
+                10)),
+            ('find_all_unspents', _ms(prevouts.find_all_unspents)),
+            ('iter_by_address', _ms(
+                lambda: list(prevouts.iter_by_address(
+                    address_list[0], page_size=100)), 10)),
+            ('balances.find_by_address', _ms(
+                lambda: [balances.find_by_address(a)
+                         for a in address_list]) / ADDRESSES),
+            ('balances.find_total', _ms(balances.find_total, 10))]
+        for name, ms in results:
+            print('{:<34} {:>10.3f} ms/call'.format(name, ms))
+        connection.CONN.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+'''
+Measures how many rows per second each finder decodes
+Usage:
+    python bench/bench_rows.py
+'''
+import time
+import tempfile
+
+from unittest import mock
+
+from zeta.db import addresses, connection, headers, keys, prevouts
+
+import chaingen
+
+from typing import Callable, List
+
+ADDRESS = '1GniSeeH9Ui1ZK4eyoaopNP1TnQLEgQiFW'
+
+# NB: a 2-of-3 multisig redeem script, so every row has pubkeys to parse
+PUBKEY = '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'
+SCRIPT = bytes.fromhex(
+    '5221' + PUBKEY[:-2] + '88'
+    + '21' + PUBKEY[:-2] + '99'
+    + '21' + PUBKEY + '53ae')
+
+
+def _rate(rows: int, run: Callable[[], int], repeat: int = 3) -> float:
+    '''
+    Returns:
+        (float): rows per second, best of `repeat` runs
+    '''
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        assert run() == rows
+        best = max(best, rows / (time.perf_counter() - start))
+    return best
+
+
+def bench_headers(count: int) -> float:
+    '''
+    Finds each of a `count` header chain by hash, with the cache disabled
+    '''
+    chain = chaingen.make_chain(count + 1)
+    base = headers.parse_header(chain[0].hex())
+    base['height'] = 1
+    headers.store_header(base)
+    assert headers.batch_store_header([h.hex() for h in chain[1:]])
+    hashes = [chaingen.hash256(h)[::-1].hex() for h in chain]
+
+    def run() -> int:
+        return sum(headers.find_by_hash(h) is not None for h in hashes)
+
+    # NB: a plain function, as a Mock's bookkeeping would dominate the time
+    with mock.patch('zeta.db.cache.get_by_hash', lambda key: None):
+        return _rate(count + 1, run)
+
+
+def bench_prevouts(count: int) -> float:
+    '''
+    Finds `count` prevouts that share an address
+    '''
+    assert addresses.store_address(ADDRESS)
+    assert prevouts.batch_store_prevout([{
+        'outpoint': {'tx_id': i.to_bytes(32, 'big').hex(), 'index': 0},
+        'value': 1000,
+        'spent_at': -2,
+        'spent_by': '',
+        'address': ADDRESS} for i in range(count)])
+    return _rate(count, lambda: len(prevouts.find_by_address(ADDRESS)))
+
+
+def _store_multisigs(count: int) -> List[str]:
+    '''
+    Stores `count` addresses that share SCRIPT, and a key for each
+    '''
+    names = ['addr{}'.format(i) for i in range(count)]
+    connection.CONN.executemany(
+        '''
+        INSERT INTO addresses (address, script) VALUES (:address, :script)
+        ''',
+        [{'address': a, 'script': SCRIPT} for a in names])
+    connection.CONN.executemany(
+        '''
+        INSERT INTO pubkey_to_script VALUES (:pubkey, :script)
+        ''',
+        [{'pubkey': PUBKEY, 'script': SCRIPT}] * count)
+    connection.CONN.executemany(
+        '''
+        INSERT INTO keys (pubkey, privkey, address) VALUES (?, ?, ?)
+        ''',
+        [(PUBKEY + str(i), b'\x00' * 48, a) for i, a in enumerate(names)])
+    connection.CONN.executemany(
+        '''
+        INSERT INTO pubkey_to_script VALUES (:pubkey, :script)
+        ''',
+        [{'pubkey': PUBKEY + str(i), 'script': SCRIPT}
+         for i in range(count)])
+    connection.commit(durable=True)
+    return names
+
+
+def bench_addresses(count: int) -> float:
+    '''
+    Finds `count` multisig addresses by script
+    '''
+    _store_multisigs(count)
+    return _rate(count, lambda: len(addresses.find_by_script(SCRIPT)))
+
+
+def bench_keys(count: int) -> float:
+    '''
+    Finds `count` keys by script
+    '''
+    _store_multisigs(count)
+    return _rate(count, lambda: len(keys.find_by_script(SCRIPT)))
+
+
+def _with_db(run: Callable[[int], float], count: int) -> float:
+    with tempfile.TemporaryDirectory() as d:
+        connection.init_conn(path=d, db_name='bench', chain_name='regtest')
+        try:
+            return run(count)
+        finally:
+            connection.CONN.close()
+
+
+def main() -> None:
+    for name, run, count in [
+            ('headers.find_by_hash', bench_headers, 5000),
+            ('prevouts.find_by_address', bench_prevouts, 50000),
+            ('addresses.find_by_script', bench_addresses, 20000),
+            ('keys.find_by_script', bench_keys, 20000)]:
+        rate = _with_db(run, count)
+        print('{:<26} {:>10.0f} rows/sec'.format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+Measures insert throughput under SQLite's default rollback journal, and
+under zeta's storage profile (WAL, synchronous=NORMAL, ...)
+with and without group commit
+Usage:
+    python bench/bench_storage.py
+'''
+import time
+import asyncio
+import tempfile
+
+from zeta.db import connection, headers, prevouts
+
+import chaingen
+
+from typing import Callable, List, Optional, Tuple
+
+# NB: SQLite's own defaults, as used before the storage profile existed
+ROLLBACK_PROFILE = [
+    ('journal_mode', 'DELETE'),
+    ('synchronous', 'FULL'),
+    ('mmap_size', '0'),
+    ('cache_size', '-2000'),
+    ('temp_store', 'DEFAULT')]
+
+ADDRESS = '1GniSeeH9Ui1ZK4eyoaopNP1TnQLEgQiFW'
+
+
+def _with_db(
+        profile: Optional[List[Tuple[str, str]]],
+        run: Callable[[], float]) -> float:
+    with tempfile.TemporaryDirectory() as d:
+        connection.init_conn(path=d, db_name='bench', chain_name='regtest')
+        if profile is not None:
+            connection.apply_profile(connection.CONN, profile)
+        try:
+            return run()
+        finally:
+            connection.CONN.close()
+
+
+def bench_store_header(
+        count: int,
+        profile: Optional[List[Tuple[str, str]]]) -> float:
+    '''
+    Stores a chain of `count` headers one store_header call at a time
+    Returns:
+        (float): headers per second
+    '''
+    chain = chaingen.make_chain(count + 1)
+
+    def run() -> float:
+        base = headers.parse_header(chain[0].hex())
+        base['height'] = 1
+        headers.store_header(base)
+
+        start = time.perf_counter()
+        for h in chain[1:]:
+            assert headers.store_header(h.hex())
+        return count / (time.perf_counter() - start)
+
+    return _with_db(profile, run)
+
+
+def bench_store_prevout(
+        count: int,
+        profile: Optional[List[Tuple[str, str]]]) -> float:
+    '''
+    Stores `count` prevouts one store_prevout call at a time
+    Returns:
+        (float): prevouts per second
+    '''
+    def run() -> float:
+        start = time.perf_counter()
+        for i in range(count):
+            assert prevouts.store_prevout({
+                'outpoint': {
+                    'tx_id': i.to_bytes(32, 'big').hex(),
+                    'index': 0},
+                'value': 1000,
+                'spent_at': -2,
+                'spent_by': '',
+                'address': ADDRESS})
+        return count / (time.perf_counter() - start)
+
+    return _with_db(profile, run)
+
+
+def bench_store_prevout_grouped(
+        count: int,
+        profile: Optional[List[Tuple[str, str]]]) -> float:
+    '''
+    As bench_store_prevout, but inside an event loop, so commits are grouped
+    Returns:
+        (float): prevouts per second, including the final flush
+    '''
+    async def stores() -> float:
+        start = time.perf_counter()
+        for i in range(count):
+            assert prevouts.store_prevout({
+                'outpoint': {
+                    'tx_id': i.to_bytes(32, 'big').hex(),
+                    'index': 0},
+                'value': 1000,
+                'spent_at': -2,
+                'spent_by': '',
+                'address': ADDRESS})
+        connection.flush()
+        return count / (time.perf_counter() - start)
+
+    def run() -> float:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(stores())
+        finally:
+            loop.close()
+
+    return _with_db(profile, run)
+
+
+def main() -> None:
+    for name, profile in [('rollback', ROLLBACK_PROFILE),
+                          ('profile', None)]:
+        rate = bench_store_header(2000, profile)
+        print('store_header  ({:>8}): {:>10.0f} headers/sec'
+              .format(name, rate))
+        rate = bench_store_prevout(2000, profile)
+        print('store_prevout ({:>8}): {:>10.0f} prevouts/sec'
+              .format(name, rate))
+        rate = bench_store_prevout_grouped(2000, profile)
+        print('store_prevout ({:>8}, grouped): {:>10.0f} prevouts/sec'
+              .format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Generates synthetic header chains for benchmarks
+Headers use regtest's minimum difficulty, so mining takes ~2 tries each
+'''
+import hashlib
+
+from typing import List
+
+# NB: 0x207fffff, little-endian. target ~2**255
+EASY_NBITS = bytes.fromhex('ffff7f20')
+
+
+def hash256(b: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(b).digest()).digest()
+
+
+def make_header(
+        prev_block_le: bytes,
+        timestamp: int,
+        nbits: bytes = EASY_NBITS,
+        version: int = 0x20000000) -> bytes:
+    '''
+    Makes a header that passes its own PoW check
+    Args:
+        prev_block_le (bytes): the parent hash, little-endian
+        timestamp       (int): the header timestamp
+        nbits         (bytes): the 4 byte nbits
+        version         (int): the header version
+    Returns:
+        (bytes): the 80 byte header
+    '''
+    exponent = nbits[3]
+    target = int.from_bytes(nbits[:3], 'little') * 256 ** (exponent - 3)
+    prefix = (version.to_bytes(4, 'little')
+              + prev_block_le
+              + hash256(prev_block_le)  # NB: any 32 bytes will do
+              + timestamp.to_bytes(4, 'little')
+              + nbits)
+    nonce = 0
+    while True:
+        header = prefix + nonce.to_bytes(4, 'little')
+        if int.from_bytes(hash256(header), 'little') <= target:
+            return header
+        nonce += 1
+
+
+def make_chain(
+        count: int,
+        prev_block_le: bytes = b'\x00' * 32,
+        start_time: int = 1500000000,
+        spacing: int = 600) -> List[bytes]:
+    '''
+    Makes a chain of linked headers
+    Args:
+        count           (int): number of headers
+        prev_block_le (bytes): the parent of the first header, little-endian
+        start_time      (int): timestamp of the first header
+        spacing         (int): seconds between headers
+    Returns:
+        (list(bytes)): the 80 byte headers, parent-first
+    '''
+    chain: List[bytes] = []
+    prev = prev_block_le
+    for i in range(count):
+        header = make_header(prev, start_time + i * spacing)
+        chain.append(header)
+        prev = hash256(header)
+    return chain
@@ -12,6 +12,9 @@ setup(
         'riemann-tx==1.1.6',
         'ecdsa',
         'pycryptodomex'],
+    extras_require={
+        'numpy': ['numpy'],
+        'arrow': ['numpy', 'pyarrow']},
     tests_require=[
         'tox',
         'mypy',
@@ -1,14 +1,20 @@
 import sqlite3
 
+from functools import lru_cache
+
 from riemann import utils as rutils
 from riemann.encoding import addresses as addr
 from riemann.script import serialization as script_ser
 
 from zeta import crypto
-from zeta.db import connection
+from zeta.db import balances, connection
 
 from zeta.zeta_types import AddressEntry
-from typing import cast, List, Union, Optional
+from typing import cast, List, Tuple, Union, Optional
+
+# NB: many addresses share few scripts, e.g. one multisig across chains,
+#     so parsed scripts are cached instead of deserialized on every read
+SCRIPT_CACHE_SIZE = 4096
 
 
 def address_from_row(row: sqlite3.Row) -> AddressEntry:
@@ -23,6 +29,17 @@ def address_from_row(row: sqlite3.Row) -> AddressEntry:
     return a
 
 
+def address_from_tuple(row: Tuple[str, bytes]) -> AddressEntry:
+    '''
+    As address_from_row, for a row of (address, script) from a tuple cursor
+    '''
+    return {
+        'address': row[0],
+        'script': row[1],
+        'script_pubkeys': pubkeys_from_script(row[1])
+    }
+
+
 def validate_address(address: AddressEntry) -> bool:
     '''
     Validates the address data structure
@@ -48,12 +65,16 @@ def pubkeys_from_script(script: bytes) -> List[str]:
     '''
     guess-parses pubkeys from a serialized bitcoin script
     '''
-    res: List[str] = []
+    if script == b'':
+        return []
+    return list(_parse_pubkeys(script))
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def _parse_pubkeys(script: bytes) -> Tuple[str, ...]:
+    # NB: a tuple, so callers can't modify the cached result
     s = script_ser.deserialize(script)
-    for token in s.split():
-        if crypto.is_pubkey(token):
-            res.append(token)
-    return res
+    return tuple(token for token in s.split() if crypto.is_pubkey(token))
 
 
 def store_address(address: Union[str, AddressEntry]) -> bool:
@@ -77,13 +98,22 @@ def store_address(address: Union[str, AddressEntry]) -> bool:
 
     c = connection.get_cursor()
     try:
+        # NB: addresses we only knew from prevouts join the wallet's total
+        untracked = c.execute(
+            '''
+            SELECT id FROM addresses
+            WHERE address = :address AND script IS NULL
+            ''',
+            a).fetchone()
         c.execute(
             '''
-            INSERT OR REPLACE INTO addresses VALUES (
-                :address,
-                :script)
+            INSERT INTO addresses (address, script)
+            VALUES (:address, :script)
+            ON CONFLICT(address) DO UPDATE SET script = excluded.script
             ''',
             a)
+        if untracked is not None:
+            balances.track(c, untracked[0])
 
         # NB: we track what pubkeys show up in what scripts so we can search
         for pubkey in a['script_pubkeys']:
@@ -107,7 +137,7 @@ def find_associated_pubkeys(script: bytes) -> List[str]:
     looks up pubkeys associated with a script
     somewhat redundant with pubkeys_from_script
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
         res = c.execute(
             '''
@@ -115,7 +145,7 @@ def find_associated_pubkeys(script: bytes) -> List[str]:
             WHERE script = :script
             ''',
             {'script': script})
-        return [r['pubkey'] for r in res]
+        return [r[0] for r in res]
     finally:
         c.close()
 
@@ -124,18 +154,18 @@ def find_by_address(address: str) -> Optional[AddressEntry]:
     '''
     Finds an AddressEntry for the address if it exists, returns None otherwise
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
         res = c.execute(
             '''
-            SELECT * from addresses
-            WHERE address = :address
+            SELECT address, script FROM addresses
+            WHERE address = :address AND script IS NOT NULL
             ''',
             {'address': address})
         for a in res:
             # little hacky. returns first entry
             # we know there can only be one
-            return address_from_row(a)
+            return address_from_tuple(a)
         return None
     finally:
         c.close()
@@ -145,11 +175,11 @@ def find_by_script(script: bytes) -> List[AddressEntry]:
     '''
     Finds all AddressEntries with the corresponding Script
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
-        res = [address_from_row(r) for r in c.execute(
+        res = [address_from_tuple(r) for r in c.execute(
             '''
-            SELECT * FROM addresses
+            SELECT address, script FROM addresses
             WHERE script = :script
             ''',
             {'script': script})]
@@ -162,11 +192,11 @@ def find_by_pubkey(pubkey: str) -> List[AddressEntry]:
     '''
     Finds all AddressEntries whose script includes the specified pubkey
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
-        res = [address_from_row(r) for r in c.execute(
+        res = [address_from_tuple(r) for r in c.execute(
             '''
-            SELECT * FROM addresses
+            SELECT address, script FROM addresses
             WHERE script IN
                 (SELECT script FROM pubkey_to_script
                  WHERE pubkey = :pubkey)
@@ -181,11 +211,12 @@ def find_all_addresses() -> List[str]:
     '''
     Finds all addresses that we're tracking
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
-        return [r['address'] for r in c.execute(
+        return [r[0] for r in c.execute(
             '''
             SELECT address FROM addresses
+            WHERE script IS NOT NULL
             '''
         )]
     finally:
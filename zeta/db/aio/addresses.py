@@ -0,0 +1,31 @@
+from zeta.db import addresses
+from zeta.db.aio.runner import run
+
+from zeta.zeta_types import AddressEntry
+from typing import List, Optional, Union
+
+# NB: async versions of zeta.db.addresses. Each call runs on the DB thread
+
+
+async def store_address(address: Union[str, AddressEntry]) -> bool:
+    return await run(addresses.store_address, address)
+
+
+async def find_associated_pubkeys(script: bytes) -> List[str]:
+    return await run(addresses.find_associated_pubkeys, script)
+
+
+async def find_by_address(address: str) -> Optional[AddressEntry]:
+    return await run(addresses.find_by_address, address)
+
+
+async def find_by_script(script: bytes) -> List[AddressEntry]:
+    return await run(addresses.find_by_script, script)
+
+
+async def find_by_pubkey(pubkey: str) -> List[AddressEntry]:
+    return await run(addresses.find_by_pubkey, pubkey)
+
+
+async def find_all_addresses() -> List[str]:
+    return await run(addresses.find_all_addresses)
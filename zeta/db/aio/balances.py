@@ -0,0 +1,14 @@
+from zeta.db import balances
+from zeta.db.aio.runner import run
+
+from zeta.zeta_types import Balance
+
+# NB: async versions of zeta.db.balances. Each call runs on the DB thread
+
+
+async def find_by_address(address: str) -> Balance:
+    return await run(balances.find_by_address, address)
+
+
+async def find_total() -> Balance:
+    return await run(balances.find_total)
@@ -0,0 +1,45 @@
+from zeta.db import headers
+from zeta.db.aio.runner import run
+
+from zeta.zeta_types import Header
+from typing import List, Optional, Union
+
+# NB: async versions of zeta.db.headers. Each call runs on the DB thread
+
+
+async def store_header(header: Union[Header, str]) -> bool:
+    return await run(headers.store_header, header)
+
+
+async def batch_store_header(h: List[Union[Header, str]]) -> bool:
+    return await run(headers.batch_store_header, h)
+
+
+async def find_by_height(height: int) -> List[Header]:
+    return await run(headers.find_by_height, height)
+
+
+async def find_by_hash(hash: str) -> Optional[Header]:
+    return await run(headers.find_by_hash, hash)
+
+
+async def median_time_past(hash: str) -> Optional[int]:
+    return await run(headers.median_time_past, hash)
+
+
+async def find_highest() -> List[Header]:
+    return await run(headers.find_highest)
+
+
+async def find_heaviest() -> List[Header]:
+    return await run(headers.find_heaviest)
+
+
+async def find_ancestor(hash: str, height: int) -> Optional[Header]:
+    return await run(headers.find_ancestor, hash, height)
+
+
+async def find_by_prev_block(
+        prev_block: str,
+        floating_only: bool = False) -> List[Header]:
+    return await run(headers.find_by_prev_block, prev_block, floating_only)
@@ -0,0 +1,42 @@
+from zeta.db import keys
+from zeta.db.aio.runner import run
+
+from zeta.zeta_types import KeyEntry
+from typing import List, Optional
+
+# NB: async versions of zeta.db.keys. Each call runs on the DB thread
+
+
+async def store_key(
+        key_entry: KeyEntry,
+        secret_phrase: Optional[str]) -> bool:
+    return await run(keys.store_key, key_entry, secret_phrase)
+
+
+async def find_one() -> Optional[KeyEntry]:
+    return await run(keys.find_one)
+
+
+async def find_by_address(
+        address: str,
+        secret_phrase: Optional[str] = None,
+        get_priv: bool = False) -> Optional[KeyEntry]:
+    return await run(keys.find_by_address, address, secret_phrase, get_priv)
+
+
+async def find_by_pubkey(
+        pubkey: str,
+        secret_phrase: Optional[str] = None,
+        get_priv: bool = False) -> List[KeyEntry]:
+    return await run(keys.find_by_pubkey, pubkey, secret_phrase, get_priv)
+
+
+async def find_by_script(
+        script: bytes,
+        secret_phrase: Optional[str] = None,
+        get_priv: bool = False) -> List[KeyEntry]:
+    return await run(keys.find_by_script, script, secret_phrase, get_priv)
+
+
+async def count_keys() -> int:
+    return await run(keys.count_keys)
@@ -0,0 +1,138 @@
+from zeta.db import prevouts
+from zeta.db.aio.runner import run
+
+from zeta.zeta_types import Outpoint, Prevout, PrevoutPage
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+# NB: async versions of zeta.db.prevouts. Each call runs on the DB thread
+
+
+async def store_prevout(prevout: Prevout) -> bool:
+    return await run(prevouts.store_prevout, prevout)
+
+
+async def batch_store_prevout(prevout_list: List[Prevout]) -> bool:
+    return await run(prevouts.batch_store_prevout, prevout_list)
+
+
+async def find_by_address(address: str) -> List[Prevout]:
+    return await run(prevouts.find_by_address, address)
+
+
+async def find_unspents_by_address(address: str) -> List[Prevout]:
+    return await run(prevouts.find_unspents_by_address, address)
+
+
+async def find_by_tx_id(tx_id: str) -> List[Prevout]:
+    return await run(prevouts.find_by_tx_id, tx_id)
+
+
+async def find_by_outpoint(outpoint: Outpoint) -> Optional[Prevout]:
+    return await run(prevouts.find_by_outpoint, outpoint)
+
+
+async def find_all_unspents() -> List[Prevout]:
+    return await run(prevouts.find_all_unspents)
+
+
+async def find_by_child(child_tx_id: str) -> List[Prevout]:
+    return await run(prevouts.find_by_child, child_tx_id)
+
+
+async def find_by_value_range(
+        lower_value: int,
+        upper_value: int,
+        unspents_only: bool = True) -> List[Prevout]:
+    return await run(
+        prevouts.find_by_value_range, lower_value, upper_value, unspents_only)
+
+
+async def find_spent_by_mempool_tx() -> List[Prevout]:
+    return await run(prevouts.find_spent_by_mempool_tx)
+
+
+async def check_for_known_outpoints(
+        outpoint_list: List[Outpoint]) -> List[Outpoint]:
+    return await run(prevouts.check_for_known_outpoints, outpoint_list)
+
+
+async def find_all() -> List[Prevout]:
+    return await run(prevouts.find_all)
+
+
+async def page_all(
+        after: Optional[str] = None,
+        limit: int = prevouts.PAGE_SIZE) -> PrevoutPage:
+    return await run(prevouts.page_all, after, limit)
+
+
+async def page_all_unspents(
+        after: Optional[str] = None,
+        limit: int = prevouts.PAGE_SIZE) -> PrevoutPage:
+    return await run(prevouts.page_all_unspents, after, limit)
+
+
+async def page_by_value_range(
+        lower_value: int,
+        upper_value: int,
+        unspents_only: bool = True,
+        after: Optional[str] = None,
+        limit: int = prevouts.PAGE_SIZE) -> PrevoutPage:
+    return await run(
+        prevouts.page_by_value_range, lower_value, upper_value,
+        unspents_only, after, limit)
+
+
+async def page_by_address(
+        address: str,
+        after: Optional[str] = None,
+        limit: int = prevouts.PAGE_SIZE) -> PrevoutPage:
+    return await run(prevouts.page_by_address, address, after, limit)
+
+
+async def _iter_pages(
+        page: Callable[..., PrevoutPage],
+        *args: Any,
+        page_size: int = prevouts.PAGE_SIZE) -> AsyncIterator[Prevout]:
+    '''
+    Yields the prevouts from each page in turn. Each page is one request
+    to the DB thread, so writes queued meanwhile run between pages
+    '''
+    after: Optional[str] = None
+    while True:
+        res = await run(page, *args, after, page_size)
+        for prevout in res['prevouts']:
+            yield prevout
+        after = res['next']
+        if after is None:
+            return
+
+
+def iter_all(page_size: int = prevouts.PAGE_SIZE) -> AsyncIterator[Prevout]:
+    '''
+    Usage:
+        async for prevout in aio.prevouts.iter_all():
+            ...
+    '''
+    return _iter_pages(prevouts.page_all, page_size=page_size)
+
+
+def iter_all_unspents(
+        page_size: int = prevouts.PAGE_SIZE) -> AsyncIterator[Prevout]:
+    return _iter_pages(prevouts.page_all_unspents, page_size=page_size)
+
+
+def iter_by_value_range(
+        lower_value: int,
+        upper_value: int,
+        unspents_only: bool = True,
+        page_size: int = prevouts.PAGE_SIZE) -> AsyncIterator[Prevout]:
+    return _iter_pages(
+        prevouts.page_by_value_range, lower_value, upper_value,
+        unspents_only, page_size=page_size)
+
+
+def iter_by_address(
+        address: str,
+        page_size: int = prevouts.PAGE_SIZE) -> AsyncIterator[Prevout]:
+    return _iter_pages(prevouts.page_by_address, address, page_size=page_size)
@@ -0,0 +1,115 @@
+import os
+import queue
+import asyncio
+import threading
+
+from concurrent.futures import Future
+
+from zeta.db import connection
+
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+# NB: requests already waiting when the DB thread wakes up run together,
+#     and their writes are committed once. This caps how many
+BATCH_SIZE = int(os.environ.get('ZETA_DB_BATCH_SIZE', 256))
+
+_Request = Tuple['Future[Any]', Callable[..., Any], Tuple[Any, ...]]
+
+_QUEUE: 'queue.SimpleQueue[Optional[_Request]]' = queue.SimpleQueue()
+_THREAD: Optional[threading.Thread] = None
+
+
+def running() -> bool:
+    return _THREAD is not None and _THREAD.is_alive()
+
+
+def start() -> None:
+    '''
+    Starts the DB thread. From then on, it is the only thread that uses
+    connection.CONN. Other threads read through read-only connections
+    '''
+    global _THREAD
+    if running():
+        return
+    _THREAD = threading.Thread(target=_work, name='zeta-db', daemon=True)
+    _THREAD.start()
+
+
+def stop() -> None:
+    '''
+    Runs every queued request, commits, and stops the DB thread
+    The calling thread goes back to using connection.CONN
+    '''
+    global _THREAD
+    if _THREAD is None:
+        return
+    _QUEUE.put(None)
+    _THREAD.join()
+    _THREAD = None
+    connection.claim_writer()
+
+
+async def run(fn: Callable[..., T], *args: Any) -> T:
+    '''
+    Runs a DB function on the DB thread, after every call queued before it
+    Runs inline if the DB thread isn't running
+
+    Usage:
+        header = await runner.run(headers.find_by_hash, hash)
+
+    Args:
+        fn (function): the DB function
+        args        : its arguments
+    Returns:
+        the function's result, once its writes are committed
+    '''
+    if not running():
+        return fn(*args)
+    fut: 'Future[T]' = Future()
+    _QUEUE.put((fut, fn, args))
+    return await asyncio.wrap_future(fut)
+
+
+def _work() -> None:
+    '''
+    The DB thread. Runs requests in order, a batch at a time
+    '''
+    connection.claim_writer()
+    while True:
+        batch = [_QUEUE.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+
+        results: List[Tuple['Future[Any]', Any, Optional[BaseException]]] = []
+        try:
+            with connection.batch_commits():
+                for request in batch:
+                    if request is None:
+                        continue
+                    fut, fn, args = request
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        results.append((fut, fn(*args), None))
+                    except Exception as e:
+                        results.append((fut, None, e))
+        except Exception as e:
+            # NB: the commit failed and batch_commits rolled it back, so none
+            #     of the batch's writes stuck
+            results = [(fut, None, e) for fut, _, _ in results]
+
+        # NB: results go out after the commit, so awaited writes are durable
+        #     as far as the storage profile allows
+        for fut, res, err in results:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+        if None in batch:
+            return
@@ -0,0 +1,142 @@
+import hashlib
+
+from zeta import work
+from zeta.zeta_types import Header
+
+from typing import Any, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # pragma: nocover
+    np = None  # type: ignore
+
+HEADER_DTYPE: Any = None
+if np is not None:
+    # NB: exactly 80 bytes, so a blob of headers views as an array
+    HEADER_DTYPE = np.dtype([
+        ('version', '<u4'),
+        ('prev_block', 'u1', (32,)),  # little-endian, as serialized
+        ('merkle_root', 'u1', (32,)),
+        ('timestamp', '<u4'),
+        ('nbits', 'u1', (4,)),
+        ('nonce', 'u1', (4,))])
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError(
+            'numpy is required for header arrays. '
+            'pip install riemann-zeta[numpy]')
+
+
+class HeaderBatch():
+    '''
+    A columnar view of concatenated 80 byte headers
+    The header fields are a numpy structured array over the original bytes
+    Hashes are an (n, 32) uint8 array, little-endian like prev_block
+    '''
+
+    def __init__(self, blob: bytes):
+        '''
+        Args:
+            blob (bytes): concatenated 80 byte headers
+        '''
+        _require_numpy()
+        if len(blob) % 80 != 0:
+            raise ValueError('Invalid header received')
+        self.blob = blob
+        self.array = np.frombuffer(blob, dtype=HEADER_DTYPE)
+        self.hashes = _hash_headers(blob)
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def check_linkage(self, prev_hash: Optional[str] = None) -> bool:
+        '''
+        Checks that each header builds on the previous one
+        Args:
+            prev_hash (str): the 0000-first hash the batch should build on
+        Returns:
+            (bool): True if linked
+        '''
+        if len(self) == 0:
+            return True
+        if (prev_hash is not None
+                and self.array['prev_block'][0].tobytes()
+                != bytes.fromhex(prev_hash)[::-1]):
+            return False
+        return bool(np.all(self.array['prev_block'][1:] == self.hashes[:-1]))
+
+    def to_headers(self) -> List[Header]:
+        '''
+        Expands the batch to header dicts, same as headers.parse_header
+        Hex encoding is done once per column, then sliced per header
+        Returns:
+            list(dict): the parsed headers, with height and work set to 0
+        '''
+        n = len(self)
+        hashes = _hex_column(self.hashes[:, ::-1], 64)
+        prev_blocks = _hex_column(self.array['prev_block'][:, ::-1], 64)
+        merkle_roots = _hex_column(self.array['merkle_root'], 64)
+        nbits = _hex_column(self.array['nbits'], 8)
+        nonces = _hex_column(self.array['nonce'], 8)
+        hexes = _hex_column(self.blob, 160)
+        versions = self.array['version'].tolist()
+        timestamps = self.array['timestamp'].tolist()
+
+        return [{
+            'hash': hashes[i],
+            'version': versions[i],
+            'prev_block': prev_blocks[i],
+            'merkle_root': merkle_roots[i],
+            'timestamp': timestamps[i],
+            'nbits': nbits[i],
+            'nonce': nonces[i],
+            'difficulty': work.parse_difficulty(bytes.fromhex(nbits[i])),
+            'hex': hexes[i],
+            'height': 0,
+            'accumulated_work': 0
+        } for i in range(n)]
+
+
+def _hash_headers(blob: bytes) -> Any:
+    '''
+    Double-sha256s each 80 byte header in a blob
+    Args:
+        blob (bytes): concatenated 80 byte headers
+    Returns:
+        (np.ndarray): (n, 32) uint8 hashes, little-endian
+    '''
+    sha256 = hashlib.sha256
+    view = memoryview(blob)
+    digests = b''.join(
+        sha256(sha256(view[i:i + 80]).digest()).digest()
+        for i in range(0, len(blob), 80))
+    return np.frombuffer(digests, dtype=np.uint8).reshape(-1, 32)
+
+
+def _hex_column(column: Any, width: int) -> List[str]:
+    '''
+    Hex encodes a fixed-width column in one pass, then splits it
+    Args:
+        column (np.ndarray or bytes): the column data
+        width             (int): hex chars per entry
+    Returns:
+        (list(str)): one hex string per entry
+    '''
+    if isinstance(column, bytes):
+        h = column.hex()
+    else:
+        h = np.ascontiguousarray(column).tobytes().hex()
+    return [h[i:i + width] for i in range(0, len(h), width)]
+
+
+def parse_header_blob(blob: bytes) -> List[Header]:
+    '''
+    Parses concatenated headers. Same output as headers.parse_header_blob
+    Args:
+        blob (bytes): concatenated 80 byte headers
+    Returns:
+        list(dict): the parsed headers
+    '''
+    return HeaderBatch(blob).to_headers()
@@ -0,0 +1,138 @@
+import sqlite3
+
+from zeta.db import connection
+from zeta.zeta_types import Balance
+
+from typing import Dict, List, Optional, Tuple
+
+
+def contribution(value: int, spent_at: int) -> Tuple[int, int, int, int]:
+    '''
+    What one prevout adds to its address's balance
+    Args:
+        value    (int): the prevout's value
+        spent_at (int): the prevout's spent_at. -2 unspent, -1 mempool
+    Returns:
+        (tuple): confirmed, mempool_spent, unspent_count, total_value
+    '''
+    return (
+        value if spent_at < 0 else 0,
+        value if spent_at == -1 else 0,
+        1 if spent_at == -2 else 0,
+        value)
+
+
+def apply_deltas(
+        c: sqlite3.Cursor,
+        deltas: Dict[int, List[int]]) -> None:
+    '''
+    Adds changes to address balances. Call it in the prevouts' transaction
+    Args:
+        c      (sqlite3.Cursor): a cursor in the transaction
+        deltas           (dict): address id to the summed contribution changes
+    '''
+    c.executemany(
+        '''
+        INSERT INTO address_balances VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(address_id) DO UPDATE SET
+            confirmed = confirmed + excluded.confirmed,
+            mempool_spent = mempool_spent + excluded.mempool_spent,
+            unspent_count = unspent_count + excluded.unspent_count,
+            total_value = total_value + excluded.total_value
+        ''',
+        [(address_id, *d) for address_id, d in deltas.items()
+         if any(d)])
+    # NB: only the tracked addresses' changes go into the wallet's total
+    c.executemany(
+        '''
+        UPDATE tracked_balance SET
+            confirmed = confirmed + ?,
+            mempool_spent = mempool_spent + ?,
+            unspent_count = unspent_count + ?,
+            total_value = total_value + ?
+        WHERE EXISTS (
+            SELECT 1 FROM addresses
+            WHERE id = ? AND script IS NOT NULL)
+        ''',
+        [(*d, address_id) for address_id, d in deltas.items()
+         if any(d)])
+
+
+def track(c: sqlite3.Cursor, address_id: int) -> None:
+    '''
+    Adds an address's balance to the wallet's total, once we start tracking
+    it. Call it in the transaction that sets its script
+    Args:
+        c      (sqlite3.Cursor): a cursor in the transaction
+        address_id        (int): the newly tracked address
+    '''
+    c.execute(
+        '''
+        UPDATE tracked_balance SET
+            (confirmed, mempool_spent, unspent_count, total_value) = (
+                SELECT tracked_balance.confirmed + b.confirmed,
+                       tracked_balance.mempool_spent + b.mempool_spent,
+                       tracked_balance.unspent_count + b.unspent_count,
+                       tracked_balance.total_value + b.total_value
+                FROM address_balances b
+                WHERE b.address_id = :address_id)
+        WHERE EXISTS (
+            SELECT 1 FROM address_balances
+            WHERE address_id = :address_id)
+        ''',
+        {'address_id': address_id})
+
+
+def balance_from_tuple(row: Tuple[Optional[int], ...]) -> Balance:
+    '''
+    Makes a Balance from (confirmed, mempool_spent, unspent_count,
+    total_value). NULLs, from summing no rows, are 0
+    '''
+    return {
+        'confirmed': row[0] or 0,
+        'mempool_spent': row[1] or 0,
+        'unspent_count': row[2] or 0,
+        'total_value': row[3] or 0}
+
+
+def find_by_address(address: str) -> Balance:
+    '''
+    Finds an address's balance
+    Addresses without prevouts have a balance of 0
+    Args:
+        address (str): the address
+    Returns:
+        (Balance): the sums of the address's prevouts
+    '''
+    c = connection.get_tuple_cursor()
+    try:
+        row = c.execute(
+            '''
+            SELECT confirmed, mempool_spent, unspent_count, total_value
+            FROM address_balances
+            WHERE address_id = (
+                SELECT id FROM addresses WHERE address = :address)
+            ''',
+            {'address': address}).fetchone()
+        return balance_from_tuple(row or (0, 0, 0, 0))
+    finally:
+        c.close()
+
+
+def find_total() -> Balance:
+    '''
+    Finds the wallet's balance, summed over the addresses we're tracking
+    The sums are kept up to date as prevouts are stored, so this reads one
+    row
+    Returns:
+        (Balance): the sums of the tracked addresses' prevouts
+    '''
+    c = connection.get_tuple_cursor()
+    try:
+        return balance_from_tuple(c.execute(
+            '''
+            SELECT confirmed, mempool_spent, unspent_count, total_value
+            FROM tracked_balance
+            ''').fetchone() or (0, 0, 0, 0))
+    finally:
+        c.close()
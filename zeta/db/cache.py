@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+from zeta.zeta_types import Header
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+# number of entries in each header cache. 0 disables caching
+CACHE_SIZE = int(os.environ.get('ZETA_HEADER_CACHE_SIZE', 4096))
+
+
+class LRUCache():
+    '''
+    A fixed-size mapping that evicts the least recently used entry
+    Counts hits and misses
+    Thread-safe, as lookups from the read pool reorder entries
+    '''
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_CONN: Optional[sqlite3.Connection] = None
+BY_HASH = LRUCache(CACHE_SIZE)  # 0000-first hash -> header
+BY_HEIGHT = LRUCache(CACHE_SIZE)  # height -> list of headers
+
+
+def ensure(conn: sqlite3.Connection) -> None:
+    '''
+    Empties the caches if the connection has been replaced
+    Args:
+        conn (sqlite3.Connection): the DB connection in use
+    '''
+    global _CONN
+    if conn is not _CONN:
+        clear()
+        _CONN = conn
+
+
+def clear() -> None:
+    BY_HASH.clear()
+    BY_HEIGHT.clear()
+
+
+def get_by_hash(hash: str) -> Optional[Header]:
+    '''
+    Returns:
+        (dict): a copy of the cached header, or None
+    '''
+    header = BY_HASH.get(hash)
+    if header is None:
+        return None
+    return header.copy()
+
+
+def put_by_hash(header: Header) -> None:
+    BY_HASH.put(header['hash'], header.copy())
+
+
+def get_by_height(height: int) -> Optional[List[Header]]:
+    '''
+    Returns:
+        (list(dict)): copies of the cached headers, or None
+    '''
+    res = BY_HEIGHT.get(height)
+    if res is None:
+        return None
+    return [h.copy() for h in res]
+
+
+def put_by_height(height: int, headers: List[Header]) -> None:
+    BY_HEIGHT.put(height, [h.copy() for h in headers])
+
+
+def invalidate(hashes: Iterable[str], heights: Iterable[int]) -> None:
+    '''
+    Drops entries made stale by a write
+    Args:
+        hashes  (list(str)): 0000-first hashes of the written headers
+        heights (list(int)): every height a written header was or is at
+    '''
+    for hash in hashes:
+        BY_HASH.pop(hash)
+    for height in heights:
+        BY_HEIGHT.pop(height)
+
+
+def stats() -> Dict[str, int]:
+    '''
+    Returns:
+        (dict): hit and miss counts, and current sizes, for each cache
+    '''
+    return {
+        'by_hash_hits': BY_HASH.hits,
+        'by_hash_misses': BY_HASH.misses,
+        'by_hash_size': len(BY_HASH),
+        'by_height_hits': BY_HEIGHT.hits,
+        'by_height_misses': BY_HEIGHT.misses,
+        'by_height_size': len(BY_HEIGHT)
+    }
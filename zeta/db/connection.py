@@ -1,8 +1,21 @@
 import os
 import sys
+import asyncio
 import sqlite3
+import functools
+import threading
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+from zeta import work
+from zeta.db import cache, flatfile, index, orphans
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from typing import cast, TypeVar
+
+T = TypeVar('T')
 
 # TODO: Clean all this up and make better
 
@@ -27,7 +40,69 @@ DB_NAME: str
 CHAIN_NAME: str
 
 DB_PATH: str
-CONN: sqlite3.Connection
+# NB: bound here, not only in init_conn, so every function sees the name
+CONN = cast(sqlite3.Connection, None)
+
+# NB: PRAGMAs applied to each new connection, in order. page_size and
+#     auto_vacuum must come before journal_mode, as switching to WAL writes
+#     the DB header, which fixes them until the next VACUUM
+#     Override any of them with ZETA_DB_<NAME>, e.g. ZETA_DB_SYNCHRONOUS=FULL
+PRAGMA_DEFAULTS: List[Tuple[str, str]] = [
+    ('page_size', '4096'),
+    ('auto_vacuum', 'INCREMENTAL'),
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', str(256 * 1024 * 1024)),
+    ('cache_size', str(-64 * 1024)),  # NB: negative is KiB, so 64 MiB
+    ('temp_store', 'MEMORY')]
+
+_PRAGMA_CHOICES: Dict[str, Tuple[str, ...]] = {
+    'auto_vacuum': ('NONE', 'FULL', 'INCREMENTAL'),
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY')}
+
+
+def storage_profile() -> List[Tuple[str, str]]:
+    '''
+    Returns:
+        (list(str, str)): the PRAGMA names and values to apply, with any
+                          environment overrides
+    '''
+    return [(name, os.environ.get('ZETA_DB_{}'.format(name.upper()), value))
+            for name, value in PRAGMA_DEFAULTS]
+
+
+def apply_profile(
+        conn: sqlite3.Connection,
+        profile: Optional[List[Tuple[str, str]]] = None) -> Dict[str, str]:
+    '''
+    Applies storage PRAGMAs to a connection
+    Args:
+        conn (sqlite3.Connection): the connection to tune
+        profile (list(str, str)): PRAGMA names and values.
+                                  defaults to storage_profile()
+    Returns:
+        (dict): the value SQLite reports for each PRAGMA afterwards. This can
+                differ from the request, e.g. in-memory DBs can't use WAL,
+                and omit PRAGMAs they don't support, like mmap_size
+    '''
+    if profile is None:
+        profile = storage_profile()
+
+    res: Dict[str, str] = {}
+    for name, value in profile:
+        # NB: PRAGMA does not accept bound parameters, so validate values
+        choices = _PRAGMA_CHOICES.get(name)
+        if choices is not None and value.upper() not in choices:
+            raise ValueError('Invalid {}: {}'.format(name, value))
+        if choices is None:
+            value = str(int(value))
+        conn.execute('PRAGMA {} = {}'.format(name, value))
+        row = conn.execute('PRAGMA {}'.format(name)).fetchone()
+        if row is not None:
+            res[name] = str(row[0])
+    return res
 
 
 def init_conn(
@@ -57,77 +132,340 @@ def init_conn(
     DB_PATH = os.path.join(PATH, '{}_{}.db'.format(DB_NAME, CHAIN_NAME))
     ensure_directory(PATH)
 
-    CONN = sqlite3.connect(DB_PATH)
+    # NB: the zeta.db.aio DB thread takes over CONN once started. Only one
+    #     thread writes at a time, see claim_writer
+    CONN = sqlite3.connect(DB_PATH, check_same_thread=False)
     CONN.row_factory = sqlite3.Row
+    apply_profile(CONN)
+    _enable_readers(DB_PATH)
 
     # make sure the tables exist
     ensure_directory(PATH)
-    ensure_tables()
+    if not ensure_tables():
+        raise RuntimeError(
+            'Could not migrate {} to schema version {}'.format(
+                DB_PATH, SCHEMA_VERSION))
+
+    # build the in-memory chain index
+    index.load(CONN)
+
+    # optionally mirror the main chain to a memory-mapped flat file
+    if os.environ.get('ZETA_FLAT_FILE', '0') == '1':
+        flatfile.open_file(
+            os.path.join(PATH, '{}_{}.headers'.format(DB_NAME, CHAIN_NAME)),
+            CONN)
+
+
+# NB: inside a running event loop, commits are grouped. The transaction
+#     stays open until COMMIT_BATCH commits are pending, or COMMIT_DELAY
+#     seconds have passed, so a burst of writes costs one fsync
+#     0 commits immediately
+COMMIT_DELAY = int(os.environ.get('ZETA_COMMIT_DELAY_MS', 50)) / 1000
+COMMIT_BATCH = int(os.environ.get('ZETA_COMMIT_BATCH', 1000))
+
+_PENDING = 0  # commits deferred since the last flush
+_BATCH_THREAD: Optional[int] = None  # thread inside batch_commits
+_FLUSH_HANDLE: Optional[asyncio.TimerHandle] = None
+_FLUSH_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def commit(durable: bool = False) -> None:
+    '''
+    Commits the current transaction, now or at the next flush
+    Commits immediately if no event loop is running
+    Args:
+        durable (bool): commit now, along with everything pending
+    '''
+    global _PENDING
+    global _FLUSH_HANDLE
+    global _FLUSH_LOOP
+
+    if not durable and _BATCH_THREAD == threading.get_ident():
+        _PENDING += 1
+        return
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        durable = True
+    if durable or COMMIT_DELAY <= 0:
+        flush()
+        return
+
+    _PENDING += 1
+    if _PENDING >= COMMIT_BATCH:
+        flush()
+    # NB: a flush scheduled on another loop may never run
+    elif _FLUSH_HANDLE is None or _FLUSH_LOOP is not loop:
+        _FLUSH_HANDLE = loop.call_later(COMMIT_DELAY, flush)
+        _FLUSH_LOOP = loop
+
+
+def flush() -> None:
+    '''
+    Commits all pending writes now
+    '''
+    global _PENDING
+    global _FLUSH_HANDLE
+
+    if _FLUSH_HANDLE is not None:
+        _FLUSH_HANDLE.cancel()
+        _FLUSH_HANDLE = None
+    _PENDING = 0
+    CONN.commit()
+
+
+@contextmanager
+def batch_commits() -> Iterator[None]:
+    '''
+    Defers this thread's commits until the block ends, then commits once
+    Durable commits inside the block still commit immediately
+
+    Usage:
+        with connection.batch_commits():
+            for prevout in prevout_list:
+                prevouts.store_prevout(prevout)
+    '''
+    global _BATCH_THREAD
+    global _PENDING
+    _BATCH_THREAD = threading.get_ident()
+    try:
+        yield
+    finally:
+        _BATCH_THREAD = None
+        try:
+            flush()
+        except Exception:
+            # NB: a failed COMMIT leaves the transaction open, and the next
+            #     flush would commit the writes we report as failed
+            _PENDING = 0
+            CONN.rollback()
+            _reset_mirrors()
+            raise
+
+
+def _reset_mirrors() -> None:
+    '''
+    Drops the in-memory state built from writes that were rolled back
+    The index and the orphan pool are rebuilt from the DB when next used
+    '''
+    index.clear()
+    cache.clear()
+    orphans.clear()
+
+
+def pending() -> int:
+    '''
+    Returns:
+        (int): the number of commits waiting for the next flush
+    '''
+    return _PENDING
+
+
+# NB: CONN is the only writer, and belongs to the thread that opened it.
+#     Other threads get their own read-only connection, so long queries can
+#     run in the read pool without blocking the writer. WAL lets them read
+#     the last commit while a write is in progress
+READ_WORKERS = int(os.environ.get('ZETA_READ_WORKERS', 4))
+
+# NB: only these apply to read-only connections. The rest change the file
+_READ_PRAGMAS = ('mmap_size', 'cache_size', 'temp_store')
+
+_READ_URI: Optional[str] = None
+_WRITER_THREAD: Optional[int] = None
+_LOCAL = threading.local()
+_READERS: List[sqlite3.Connection] = []
+_READERS_LOCK = threading.Lock()
+_READ_POOL: Optional[ThreadPoolExecutor] = None
+
+
+def _enable_readers(db_path: str) -> None:
+    '''
+    Lets threads other than this one read the DB file at db_path
+    '''
+    global _READ_URI
+    global _WRITER_THREAD
+    close_readers()
+    _READ_URI = 'file:{}?mode=ro'.format(pathname2url(db_path))
+    _WRITER_THREAD = threading.get_ident()
+
+
+def close_readers() -> None:
+    '''
+    Shuts down the read pool and closes every read-only connection
+    '''
+    global _READ_URI
+    global _READ_POOL
+    _READ_URI = None
+    if _READ_POOL is not None:
+        _READ_POOL.shutdown()
+        _READ_POOL = None
+    with _READERS_LOCK:
+        for conn in _READERS:
+            conn.close()
+        _READERS.clear()
+
+
+def reader() -> sqlite3.Connection:
+    '''
+    Returns this thread's read-only connection, opening it if needed
+    Falls back to CONN on the writer's thread, or if readers aren't enabled,
+    e.g. for an in-memory DB
+    Returns:
+        (sqlite3.Connection): a connection this thread can read from
+    '''
+    uri = _READ_URI
+    if uri is None or is_writer():
+        return CONN
+
+    conn = getattr(_LOCAL, 'conn', None)
+    if conn is None or _LOCAL.uri != uri:
+        # NB: check_same_thread is off only so close_readers can close it.
+        #     It is still only used by this thread
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        apply_profile(conn, [p for p in storage_profile()
+                             if p[0] in _READ_PRAGMAS])
+        conn.execute('PRAGMA query_only = 1')
+        with _READERS_LOCK:
+            _READERS.append(conn)
+        _LOCAL.conn = conn
+        _LOCAL.uri = uri
+    return conn
+
+
+def claim_writer() -> None:
+    '''
+    Makes this thread the one that uses CONN
+    Other threads read through their own read-only connections
+    '''
+    global _WRITER_THREAD
+    _WRITER_THREAD = threading.get_ident()
 
 
-def commit():
-    return CONN.commit()
+def is_writer() -> bool:
+    '''
+    Returns:
+        (bool): True if this thread reads and writes through CONN
+    '''
+    return _READ_URI is None or threading.get_ident() == _WRITER_THREAD
 
 
 def get_cursor() -> sqlite3.Cursor:
-    return CONN.cursor()
+    '''
+    Returns:
+        (sqlite3.Cursor): a cursor on CONN, or on this thread's read-only
+                          connection outside the writer's thread
+    '''
+    return reader().cursor()
+
+
+def get_tuple_cursor() -> sqlite3.Cursor:
+    '''
+    As get_cursor, but rows are plain tuples instead of sqlite3.Row
+    Finders select their columns by name and unpack them by position,
+    which skips building a Row for every result
+    Returns:
+        (sqlite3.Cursor): a cursor that returns tuples
+    '''
+    c = reader().cursor()
+    c.row_factory = None
+    return c
+
+
+def _read_pool() -> ThreadPoolExecutor:
+    global _READ_POOL
+    if _READ_POOL is None:
+        _READ_POOL = ThreadPoolExecutor(
+            max_workers=max(READ_WORKERS, 1),
+            thread_name_prefix='zeta-read')
+    return _READ_POOL
+
+
+async def run_read(fn: Callable[..., T], *args: Any) -> T:
+    '''
+    Runs a query function in the read pool, without blocking the event loop
+    The function must read through get_cursor(). It sees the last commit,
+    so writes waiting for a group commit are not visible yet
+    Runs inline if readers aren't enabled
+
+    Usage:
+        unspents = await connection.run_read(prevouts.find_all_unspents)
+
+    Args:
+        fn (function): the query function
+        args        : its arguments
+    Returns:
+        the function's result
+    '''
+    if _READ_URI is None or READ_WORKERS <= 0:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _read_pool(), functools.partial(fn, *args))
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Cursor]:
+    '''
+    Runs a block of writes in one explicit transaction
+    Commits if the block succeeds, rolls back its writes if it raises
+    Uses a savepoint, so it is safe to use inside an open transaction
+
+    Usage:
+        with connection.transaction() as c:
+            c.executemany(...)
+    '''
+    c = get_cursor()
+    # NB: a savepoint outside a transaction commits when released. BEGIN
+    #     first, so commit() decides when the writes are committed
+    if not CONN.in_transaction:
+        c.execute('BEGIN')
+    c.execute('SAVEPOINT zeta_transaction')
+    try:
+        yield c
+        c.execute('RELEASE zeta_transaction')
+        commit()
+    except Exception:
+        c.execute('ROLLBACK TO zeta_transaction')
+        c.execute('RELEASE zeta_transaction')
+        raise
+    finally:
+        c.close()
 
 
 def ensure_tables() -> bool:
     '''
+    Brings the schema up to date by running any migrations the DB has not
+    seen yet. The DB's schema version is tracked in PRAGMA user_version
 
     Returns:
         (bool): true if table exists/was created, false if there's an exception
     '''
     c = get_cursor()
     try:
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS headers(
-                hash TEXT PRIMARY KEY,
-                version INTEGER,
-                prev_block TEXT,
-                merkle_root TEXT,
-                timestamp INTEGER,
-                nbits TEXT,
-                nonce TEXT,
-                difficulty INTEGER,
-                hex TEXT,
-                height INTEGER,
-                accumulated_work INTEGER)
-            ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS addresses(
-                address TEXT PRIMARY KEY,
-                script BLOB NOT NULL DEFAULT (x''))
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS pubkey_to_script(
-                pubkey TEXT,
-                script BLOB,
-                FOREIGN KEY(script) REFERENCES addresses(script))
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS keys(
-                pubkey TEXT PRIMARY KEY,
-                privkey BLOB,
-                derivation TEXT NOT NULL DEFAULT '',
-                chain TEXT NOT NULL DEFAULT 'btc',
-                address TEXT,
-                FOREIGN KEY(address) REFERENCES addresses(address))
-            ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS prevouts(
-                outpoint TEXT PRIMARY KEY,
-                tx_id TEXT,
-                idx INTEGER,
-                value INTEGER,
-                spent_at INTEGER NOT NULL DEFAULT -2,
-                spent_by TEXT NOT NULL DEFAULT '',
-                address TEXT,
-                FOREIGN KEY(address) REFERENCES addresses(address))
-            ''')  # default -2 for not yet spent. electrum uses -1 for mempool
-
-        commit()
+        version = schema_version(c)
+        if version == 0:
+            # NB: only takes effect before the first table is created.
+            #     lets zeta.db.retention free pages without a full VACUUM
+            c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if version < len(MIGRATIONS):
+            flush()
+        for i in range(version, len(MIGRATIONS)):
+            # NB: sqlite3 doesn't open transactions for DDL, so each
+            #     migration and its version bump are committed together
+            #     explicitly. A failed migration leaves the DB as it was
+            c.execute('BEGIN')
+            try:
+                MIGRATIONS[i](c)
+                # NB: PRAGMA does not accept bound parameters
+                c.execute('PRAGMA user_version = {}'.format(i + 1))
+            except Exception:
+                # NB: some errors have rolled back already
+                if c.connection.in_transaction:
+                    c.execute('ROLLBACK')
+                raise
+            c.execute('COMMIT')
         return True
     except Exception:
         return False
@@ -135,6 +473,347 @@ def ensure_tables() -> bool:
         c.close()
 
 
+def schema_version(c: Optional[sqlite3.Cursor] = None) -> int:
+    '''
+    Reads the schema version of the DB
+    Args:
+        c (sqlite3.Cursor): optional cursor to use
+    Returns:
+        (int): the number of migrations that have been run
+    '''
+    cursor = c if c is not None else get_cursor()
+    return cursor.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _migrate_v1(c: sqlite3.Cursor) -> None:
+    '''
+    Creates the base tables
+    DBs created before schema versioning are at version 0 with these tables
+    already in place, so everything here must be idempotent
+    '''
+    _ensure_headers_table(c)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS addresses(
+            address TEXT PRIMARY KEY,
+            script BLOB NOT NULL DEFAULT (x''))
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS pubkey_to_script(
+            pubkey TEXT,
+            script BLOB,
+            FOREIGN KEY(script) REFERENCES addresses(script))
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS keys(
+            pubkey TEXT PRIMARY KEY,
+            privkey BLOB,
+            derivation TEXT NOT NULL DEFAULT '',
+            chain TEXT NOT NULL DEFAULT 'btc',
+            address TEXT,
+            FOREIGN KEY(address) REFERENCES addresses(address))
+        ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS prevouts(
+            outpoint TEXT PRIMARY KEY,
+            tx_id TEXT,
+            idx INTEGER,
+            value INTEGER,
+            spent_at INTEGER NOT NULL DEFAULT -2,
+            spent_by TEXT NOT NULL DEFAULT '',
+            address TEXT,
+            FOREIGN KEY(address) REFERENCES addresses(address))
+        ''')  # default -2 for not yet spent. electrum uses -1 for mempool
+
+
+def _ensure_headers_table(c: sqlite3.Cursor) -> None:
+    '''
+    Creates the headers table. Headers are stored as the raw 80 bytes
+    keyed by the 32 byte hash. All other fields are derived when read
+    If a legacy hex-formatted headers table exists, it is migrated
+    Args:
+        c (sqlite3.Cursor): the cursor to use
+    '''
+    columns = [r[1] for r in c.execute('PRAGMA table_info(headers)')]
+    legacy = 'hex' in columns
+    if legacy:
+        c.execute('ALTER TABLE headers RENAME TO headers_legacy')
+
+    # NB: hash is the big-endian (0000-first) hash as bytes
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS headers(
+            hash BLOB PRIMARY KEY,
+            header BLOB NOT NULL,
+            height INTEGER,
+            accumulated_work INTEGER)
+        WITHOUT ROWID
+        ''')
+
+    if legacy:
+        rows = c.execute('''
+            SELECT hash, hex, height, accumulated_work FROM headers_legacy
+            ''').fetchall()
+        c.executemany(
+            '''
+            INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?)
+            ''',
+            ((bytes.fromhex(r[0]), bytes.fromhex(r[1]), r[2], r[3])
+             for r in rows))
+        c.execute('DROP TABLE headers_legacy')
+
+
+def _migrate_v2(c: sqlite3.Cursor) -> None:
+    '''
+    Adds secondary indexes on the headers table
+    '''
+    _create_header_indexes(c)
+
+
+def _create_header_indexes(c: sqlite3.Cursor) -> None:
+    '''
+    Creates the headers indexes
+    prev_block is bytes 4:36 of the header (substr is 1-indexed)
+    headers_floating is a partial index of headers with no known parent
+    '''
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS headers_height
+        ON headers(height)
+        ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS headers_accumulated_work
+        ON headers(accumulated_work)
+        ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS headers_prev_block
+        ON headers(substr(header, 5, 32))
+        ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS headers_floating
+        ON headers(substr(header, 5, 32))
+        WHERE height = 0
+        ''')
+
+
+def _migrate_v3(c: sqlite3.Cursor) -> None:
+    '''
+    Recomputes accumulated work as chainwork (2**256 / (target + 1) per
+    header) and stores it as a 32 byte big-endian BLOB. Chainwork overflows
+    SQLite's 64-bit INTEGER. Fixed-width big-endian BLOBs still sort
+    numerically, so max() and the index work as before
+    '''
+    c.execute('''
+        CREATE TABLE headers_v3(
+            hash BLOB PRIMARY KEY,
+            header BLOB NOT NULL,
+            height INTEGER,
+            accumulated_work BLOB NOT NULL DEFAULT (zeroblob(32)))
+        WITHOUT ROWID
+        ''')
+
+    rows = c.execute('''
+        SELECT hash, header, height FROM headers
+        ORDER BY height
+        ''').fetchall()
+
+    def recompute() -> Iterator[Tuple[bytes, bytes, int, bytes]]:
+        # NB: headers whose parent we don't have (e.g. checkpoints) have 0
+        known: Dict[bytes, int] = {}
+        for hash, header, height in rows:
+            acc = 0
+            if height != 0:
+                parent_work = known.get(header[4:36][::-1])
+                if parent_work is not None:
+                    acc = parent_work + work.work_from_nbits(header[72:76])
+                known[hash] = acc
+            yield (hash, header, height, acc.to_bytes(32, 'big'))
+
+    c.executemany(
+        '''
+        INSERT INTO headers_v3 VALUES (?, ?, ?, ?)
+        ''',
+        recompute())
+    c.execute('DROP TABLE headers')
+    c.execute('ALTER TABLE headers_v3 RENAME TO headers')
+    _create_header_indexes(c)
+
+
+def _migrate_v4(c: sqlite3.Cursor) -> None:
+    '''
+    Adds the main chain table, height -> hash of the active chain
+    It starts empty, and is filled in by the chain sync
+    '''
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS main_chain(
+            height INTEGER PRIMARY KEY,
+            hash BLOB NOT NULL UNIQUE)
+        ''')
+
+
+def _migrate_v5(c: sqlite3.Cursor) -> None:
+    '''
+    Rebuilds addresses with an integer id, and prevouts keyed by the 36 byte
+    outpoint, with address ids instead of address strings
+    tx_id and idx are dropped, as they are the outpoint's 2 halves
+    spent_by becomes 32 bytes, NULL if unspent
+    Prevouts need an address now, so DBs with address-less prevouts fail the
+    migration rather than lose them
+    '''
+    missing = c.execute('''
+        SELECT count(*) FROM prevouts
+        WHERE address IS NULL
+        ''').fetchone()[0]
+    if missing != 0:
+        raise ValueError(
+            'Cannot migrate {} prevouts without an address'.format(missing))
+
+    # NB: script is NULL for addresses we only know from prevouts. They
+    #     aren't tracked
+    c.execute('''
+        CREATE TABLE addresses_v5(
+            id INTEGER PRIMARY KEY,
+            address TEXT NOT NULL UNIQUE,
+            script BLOB)
+        ''')
+    c.execute('''
+        INSERT INTO addresses_v5 (address, script)
+        SELECT address, script FROM addresses
+        ORDER BY rowid
+        ''')
+    # NB: prevouts could be stored for untracked addresses. Now they need ids
+    c.execute('''
+        INSERT OR IGNORE INTO addresses_v5 (address)
+        SELECT DISTINCT address FROM prevouts
+        ''')
+    c.execute('DROP TABLE addresses')
+    c.execute('ALTER TABLE addresses_v5 RENAME TO addresses')
+
+    _create_prevouts_table(c, 'prevouts_v5')
+    ids = dict(c.execute('''
+        SELECT address, id FROM addresses
+        ''').fetchall())
+
+    # NB: streamed from the cursor, so memory doesn't grow with the table
+    c.connection.cursor().executemany(
+        '''
+        INSERT OR REPLACE INTO prevouts_v5 VALUES (?, ?, ?, ?, ?)
+        ''',
+        ((bytes.fromhex(r[0]), r[1], r[2],
+          bytes.fromhex(r[3]) if r[3] else None, ids[r[4]])
+         for r in c.execute('''
+            SELECT outpoint, value, spent_at, spent_by, address FROM prevouts
+            ''')))
+    c.execute('DROP TABLE prevouts')
+    c.execute('ALTER TABLE prevouts_v5 RENAME TO prevouts')
+    _create_prevouts_indexes(c)
+
+
+def _create_prevouts_table(c: sqlite3.Cursor, name: str) -> None:
+    '''
+    Creates the prevouts table
+    The outpoint is as serialized, the tx_id little-endian then the index
+    as a 4 byte little-endian int, so a tx's outputs are adjacent
+    spent_by is the spending tx_id in block explorer byte order
+    '''
+    c.execute('''
+        CREATE TABLE {name}(
+            outpoint BLOB PRIMARY KEY,
+            value INTEGER NOT NULL,
+            spent_at INTEGER NOT NULL DEFAULT -2,
+            spent_by BLOB,
+            address_id INTEGER NOT NULL,
+            FOREIGN KEY(address_id) REFERENCES addresses(id))
+        WITHOUT ROWID
+        '''.format(name=name))  # default -2 for not yet spent. -1 is mempool
+
+
+def _create_prevouts_indexes(c: sqlite3.Cursor) -> None:
+    '''
+    Creates the prevouts indexes
+    prevouts_address and prevouts_spent hold every column, so the finders
+    that use them never read the table. prevouts_address is also in
+    outpoint order for each address, for paging
+    '''
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS prevouts_address
+        ON prevouts(address_id, outpoint, spent_at, value, spent_by)
+        ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS prevouts_spent
+        ON prevouts(spent_at, value, address_id, spent_by)
+        ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS prevouts_spent_by
+        ON prevouts(spent_by)
+        WHERE spent_by IS NOT NULL
+        ''')
+
+
+def _migrate_v6(c: sqlite3.Cursor) -> None:
+    '''
+    Adds address_balances, the per-address sums that balances.contribution
+    describes, and fills it from the stored prevouts
+    '''
+    c.execute('''
+        CREATE TABLE address_balances(
+            address_id INTEGER PRIMARY KEY,
+            confirmed INTEGER NOT NULL DEFAULT 0,
+            mempool_spent INTEGER NOT NULL DEFAULT 0,
+            unspent_count INTEGER NOT NULL DEFAULT 0,
+            total_value INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(address_id) REFERENCES addresses(id))
+        ''')
+    c.execute('''
+        INSERT INTO address_balances
+        SELECT
+            address_id,
+            sum(CASE WHEN spent_at < 0 THEN value ELSE 0 END),
+            sum(CASE WHEN spent_at = -1 THEN value ELSE 0 END),
+            sum(spent_at = -2),
+            sum(value)
+        FROM prevouts
+        GROUP BY address_id
+        ''')
+
+
+def _migrate_v7(c: sqlite3.Cursor) -> None:
+    '''
+    Adds tracked_balance, one row summing the balances of the tracked
+    addresses, and fills it from address_balances
+    '''
+    c.execute('''
+        CREATE TABLE tracked_balance(
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            confirmed INTEGER NOT NULL DEFAULT 0,
+            mempool_spent INTEGER NOT NULL DEFAULT 0,
+            unspent_count INTEGER NOT NULL DEFAULT 0,
+            total_value INTEGER NOT NULL DEFAULT 0)
+        ''')
+    c.execute('''
+        INSERT INTO tracked_balance
+        SELECT
+            0,
+            coalesce(sum(b.confirmed), 0),
+            coalesce(sum(b.mempool_spent), 0),
+            coalesce(sum(b.unspent_count), 0),
+            coalesce(sum(b.total_value), 0)
+        FROM address_balances b
+        JOIN addresses a ON a.id = b.address_id
+        WHERE a.script IS NOT NULL
+        ''')
+
+
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
 def print_tables() -> None:  # pragma: nocover
     c = get_cursor()
     res = c.execute('''
@@ -0,0 +1,214 @@
+from zeta.db import arrays, connection
+
+from typing import Any, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: nocover
+    np = None  # type: ignore
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: nocover
+    pa = None  # type: ignore
+
+# NB: rows are read with fetchmany, so memory is bounded by the chunk size
+CHUNK_SIZE = 65536
+
+# NB: BIP173 caps bech32 strings at 90 characters, longer than base58
+ADDRESS_WIDTH = 90
+
+HEADER_EXPORT_DTYPE: Any = None
+PREVOUT_EXPORT_DTYPE: Any = None
+if np is not None:
+    # NB: hashes and work are big-endian, as stored. The header fields are
+    #     as serialized, see arrays.HEADER_DTYPE
+    HEADER_EXPORT_DTYPE = np.dtype(
+        [('hash', 'u1', (32,)),
+         ('height', '<i8'),
+         ('accumulated_work', 'u1', (32,))]
+        + [(name, arrays.HEADER_DTYPE.fields[name][0])
+           for name in arrays.HEADER_DTYPE.names])
+
+    # NB: tx_id and spent_by are in block explorer byte order, like their
+    #     hex elsewhere. spent_by is zeroes if unspent
+    PREVOUT_EXPORT_DTYPE = np.dtype([
+        ('tx_id', 'u1', (32,)),
+        ('idx', '<u4'),
+        ('value', '<i8'),
+        ('spent_at', '<i8'),
+        ('spent_by', 'u1', (32,)),
+        ('address', 'S{}'.format(ADDRESS_WIDTH))])
+
+_NO_TX_ID = b'\x00' * 32
+_MAX_HEIGHT = 2 ** 63 - 1
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError(
+            'numpy is required for exports. '
+            'pip install riemann-zeta[numpy]')
+
+
+def _require_arrow() -> None:
+    _require_numpy()
+    if pa is None:
+        raise ImportError(
+            'pyarrow is required for Arrow exports. '
+            'pip install riemann-zeta[arrow]')
+
+
+def _fixed_width(blob: bytes, width: int) -> Any:
+    '''
+    Views concatenated fixed-width values as an (n, width) uint8 array
+    '''
+    return np.frombuffer(blob, dtype=np.uint8).reshape(-1, width)
+
+
+def _stream(query: str, params: Any, chunk_size: int) -> Iterator[List[Any]]:
+    '''
+    Runs a query and yields its rows as lists of at most chunk_size tuples
+    '''
+    c = connection.get_tuple_cursor()
+    try:
+        c.execute(query, params)
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if len(rows) == 0:
+                return
+            yield rows
+    finally:
+        c.close()
+
+
+def _header_array(rows: List[Tuple[bytes, bytes, int, bytes]]) -> Any:
+    '''
+    Packs (hash, header, height, accumulated_work) rows into an array
+    '''
+    res = np.empty(len(rows), dtype=HEADER_EXPORT_DTYPE)
+    res['hash'] = _fixed_width(b''.join(r[0] for r in rows), 32)
+    res['height'] = [r[2] for r in rows]
+    res['accumulated_work'] = _fixed_width(b''.join(r[3] for r in rows), 32)
+    raw = np.frombuffer(
+        b''.join(r[1] for r in rows), dtype=arrays.HEADER_DTYPE)
+    for name in arrays.HEADER_DTYPE.names:
+        res[name] = raw[name]
+    return res
+
+
+def _prevout_array(
+        rows: List[Tuple[bytes, int, int, Optional[bytes], str]]) -> Any:
+    '''
+    Packs (outpoint, value, spent_at, spent_by, address) rows into an array
+    '''
+    res = np.empty(len(rows), dtype=PREVOUT_EXPORT_DTYPE)
+    outpoints = _fixed_width(b''.join(r[0] for r in rows), 36)
+    # NB: the outpoint's tx_id is little-endian
+    res['tx_id'] = outpoints[:, 31::-1]
+    res['idx'] = np.ascontiguousarray(outpoints[:, 32:]).view('<u4')[:, 0]
+    res['value'] = [r[1] for r in rows]
+    res['spent_at'] = [r[2] for r in rows]
+    res['spent_by'] = _fixed_width(
+        b''.join(r[3] or _NO_TX_ID for r in rows), 32)
+    res['address'] = [r[4] for r in rows]
+    return res
+
+
+def _record_batch(array: Any) -> Any:
+    '''
+    Converts an export array to an Arrow record batch with the same columns
+    Byte columns become fixed size binary, and addresses become strings
+    '''
+    columns = []
+    for name in array.dtype.names:
+        column = array[name]
+        if column.ndim == 2:
+            width = column.shape[1]
+            buf = pa.py_buffer(np.ascontiguousarray(column).tobytes())
+            columns.append(pa.Array.from_buffers(
+                pa.binary(width), len(column), [None, buf]))
+        elif column.dtype.kind == 'S':
+            columns.append(pa.array(column.astype(str), type=pa.string()))
+        else:
+            columns.append(pa.array(column))
+    return pa.RecordBatch.from_arrays(columns, names=list(array.dtype.names))
+
+
+def iter_header_arrays(
+        lower_height: int = 0,
+        upper_height: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    '''
+    Streams headers as numpy structured arrays, ordered by height
+    Floating headers have height 0
+    Args:
+        lower_height (int): the lowest height to export
+        upper_height (int): the highest height to export, None for the tip
+        chunk_size   (int): the most headers per array
+    Returns:
+        (iterator(np.ndarray)): arrays of HEADER_EXPORT_DTYPE
+    '''
+    _require_numpy()
+    chunks = _stream(
+        '''
+        SELECT hash, header, height, accumulated_work FROM headers
+        WHERE height >= :lower AND height <= :upper
+        ORDER BY height
+        ''',
+        {'lower': lower_height,
+         'upper': _MAX_HEIGHT if upper_height is None else upper_height},
+        chunk_size)
+    return (_header_array(rows) for rows in chunks)
+
+
+def iter_header_batches(
+        lower_height: int = 0,
+        upper_height: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    '''
+    As iter_header_arrays, but yields Arrow record batches
+    Returns:
+        (iterator(pa.RecordBatch)): batches with the header export columns
+    '''
+    _require_arrow()
+    chunks = iter_header_arrays(lower_height, upper_height, chunk_size)
+    return (_record_batch(a) for a in chunks)
+
+
+def iter_prevout_arrays(
+        address: Optional[str] = None,
+        chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    '''
+    Streams prevouts as numpy structured arrays, in outpoint order
+    Args:
+        address    (str): only export this address's prevouts, None for all
+        chunk_size (int): the most prevouts per array
+    Returns:
+        (iterator(np.ndarray)): arrays of PREVOUT_EXPORT_DTYPE
+    '''
+    _require_numpy()
+    chunks = _stream(
+        '''
+        SELECT p.outpoint, p.value, p.spent_at, p.spent_by, a.address
+        FROM prevouts p
+        JOIN addresses a ON a.id = p.address_id
+        {where}
+        ORDER BY p.outpoint
+        '''.format(where=('' if address is None
+                          else 'WHERE a.address = :address')),
+        {'address': address},
+        chunk_size)
+    return (_prevout_array(rows) for rows in chunks)
+
+
+def iter_prevout_batches(
+        address: Optional[str] = None,
+        chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    '''
+    As iter_prevout_arrays, but yields Arrow record batches
+    Returns:
+        (iterator(pa.RecordBatch)): batches with the prevout export columns
+    '''
+    _require_arrow()
+    return (_record_batch(a) for a in iter_prevout_arrays(address, chunk_size))
@@ -0,0 +1,262 @@
+import os
+import mmap
+import struct
+import sqlite3
+import threading
+
+from riemann import utils as rutils
+
+from zeta.db import index
+
+from typing import BinaryIO, Dict, List, Optional
+
+# NB: The flat file holds the raw 80 byte headers of the main chain, in
+#     height order, after a 16 byte preamble:
+#         magic        8 bytes  b'ZETAFLAT'
+#         base_height  8 bytes  uint64 LE, height of the first header
+#     The header at height h is at PREAMBLE.size + (h - base_height) * 80
+#     SQLite stays the source of truth. The flat file is rebuilt from the
+#     chain index whenever they disagree
+MAGIC = b'ZETAFLAT'
+PREAMBLE = struct.Struct('<8sQ')
+
+# NB: sync remaps and resizes the file. Hold this to read or change it
+_LOCK = threading.RLock()
+_CONN: Optional[sqlite3.Connection] = None
+_FILE: Optional[BinaryIO] = None
+_MMAP: Optional[mmap.mmap] = None
+_BASE_HEIGHT = 0
+_COUNT = 0
+_TIP_HASH: Optional[bytes] = None
+
+
+def open_file(path: str, conn: sqlite3.Connection) -> None:
+    '''
+    Opens (or creates) the flat file and brings it in line with the index
+    Args:
+        path                 (str): the flat file path
+        conn (sqlite3.Connection): the DB connection the file mirrors
+    '''
+    global _CONN, _FILE, _BASE_HEIGHT, _COUNT
+
+    with _LOCK:
+        close()
+        if not os.path.exists(path):
+            with open(path, 'wb') as new_file:
+                new_file.write(PREAMBLE.pack(MAGIC, 0))
+
+        f = open(path, 'r+b')
+        magic, base_height = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        size = f.seek(0, os.SEEK_END)
+        if magic != MAGIC:
+            f.close()
+            raise ValueError('Invalid header flat file: {}'.format(path))
+
+        # NB: drops any partially written header
+        count = (size - PREAMBLE.size) // 80
+        f.truncate(PREAMBLE.size + count * 80)
+        f.seek(0, os.SEEK_END)
+
+        _FILE = f
+        _CONN = conn
+        _BASE_HEIGHT = base_height
+        _COUNT = count
+        _set_tip_hash()
+
+        index.ensure(conn)
+        sync()
+
+
+def close() -> None:
+    global _CONN, _FILE, _COUNT, _TIP_HASH
+    with _LOCK:
+        _unmap()
+        if _FILE is not None:
+            _FILE.close()
+        _CONN = None
+        _FILE = None
+        _COUNT = 0
+        _TIP_HASH = None
+
+
+def active(conn: sqlite3.Connection) -> bool:
+    '''
+    Returns:
+        (bool): True if the flat file is open and mirrors this connection
+    '''
+    return _FILE is not None and conn is _CONN
+
+
+def base_height() -> int:
+    return _BASE_HEIGHT
+
+
+def tip_height() -> Optional[int]:
+    '''
+    Returns:
+        (int): the height of the last header in the file, None if empty
+    '''
+    if _COUNT == 0:
+        return None
+    return _BASE_HEIGHT + _COUNT - 1
+
+
+def tip_hash() -> Optional[bytes]:
+    '''
+    Returns:
+        (bytes): the big-endian hash of the last header, None if empty
+    '''
+    return _TIP_HASH
+
+
+def get(height: int) -> Optional[bytes]:
+    '''
+    Reads a main chain header by height
+    The header is copied out of the mapping. A view into it would stop the
+    next sync from remapping the file
+    Args:
+        height (int): the block height
+    Returns:
+        (bytes): the raw 80 byte header, None if not in the file
+    '''
+    with _LOCK:
+        offset = height - _BASE_HEIGHT
+        if _FILE is None or offset < 0 or offset >= _COUNT:
+            return None
+        start = PREAMBLE.size + offset * 80
+        return _map()[start:start + 80]
+
+
+def sync(raw_headers: Optional[Dict[bytes, bytes]] = None) -> None:
+    '''
+    Brings the file in line with the index's heaviest chain
+    Walks back from the heaviest tip to the last header the file agrees with,
+    truncates after it, then appends the new headers. Usually this is a
+    plain append of the headers just stored
+    Args:
+        raw_headers (dict): big-endian hash -> raw header, for headers the
+                            caller has on hand. Others are read from the DB
+    '''
+    with _LOCK:
+        if _FILE is None:
+            return
+
+        tips = index.heaviest()
+        if len(tips) == 0 or _CONN is None:
+            _truncate(0)
+            return
+        # NB: on a tie, stay on the chain we already have
+        tip = _TIP_HASH if _TIP_HASH in tips else tips[0]
+        node: Optional[index.Node] = index.get(tip)
+        if node is None or node.height == 0:
+            return
+
+        if _COUNT > 0 and node.height < _BASE_HEIGHT + _COUNT - 1:
+            _truncate(node.height - _BASE_HEIGHT + 1)
+
+        path: List[index.Node] = []
+        while node is not None and node.height >= _BASE_HEIGHT + _COUNT:
+            path.append(node)
+            node = node.parent
+        while (node is not None
+                and node.height >= _BASE_HEIGHT
+                and _hash_at(node.height) != node.hash):
+            path.append(node)
+            node = node.parent
+
+        if node is None or node.height < _BASE_HEIGHT:
+            # NB: the chain no longer builds on the file's first header,
+            #     e.g. an earlier checkpoint was stored. Rebuild from its root
+            while node is not None:
+                path.append(node)
+                node = node.parent
+            _rebase(path[-1].height)
+        else:
+            _truncate(node.height - _BASE_HEIGHT + 1)
+
+        _append(path[::-1], raw_headers or {})
+
+
+def _map() -> mmap.mmap:
+    global _MMAP
+    if _MMAP is None:
+        assert _FILE is not None
+        _MMAP = mmap.mmap(_FILE.fileno(), 0, access=mmap.ACCESS_READ)
+    return _MMAP
+
+
+def _unmap() -> None:
+    '''
+    Drops the current mapping. Must be called before the file changes size
+    '''
+    global _MMAP
+    if _MMAP is not None:
+        _MMAP.close()
+        _MMAP = None
+
+
+def _hash_at(height: int) -> Optional[bytes]:
+    if height == _BASE_HEIGHT + _COUNT - 1:
+        return _TIP_HASH
+    raw = get(height)
+    if raw is None:
+        return None
+    return rutils.hash256(raw)[::-1]
+
+
+def _set_tip_hash() -> None:
+    global _TIP_HASH
+    _TIP_HASH = None
+    raw = get(_BASE_HEIGHT + _COUNT - 1)
+    if raw is not None:
+        _TIP_HASH = rutils.hash256(raw)[::-1]
+
+
+def _truncate(count: int) -> None:
+    global _COUNT
+    assert _FILE is not None
+    if count >= _COUNT:
+        return
+    _unmap()
+    _FILE.truncate(PREAMBLE.size + count * 80)
+    _FILE.seek(0, os.SEEK_END)
+    _FILE.flush()
+    _COUNT = count
+    _set_tip_hash()
+
+
+def _rebase(height: int) -> None:
+    global _BASE_HEIGHT
+    assert _FILE is not None
+    _truncate(0)
+    _FILE.seek(0)
+    _FILE.write(PREAMBLE.pack(MAGIC, height))
+    _FILE.seek(0, os.SEEK_END)
+    _FILE.flush()
+    _BASE_HEIGHT = height
+
+
+def _append(nodes: List[index.Node], raw_headers: Dict[bytes, bytes]) -> None:
+    global _COUNT, _TIP_HASH
+    assert _FILE is not None and _CONN is not None
+    if len(nodes) == 0:
+        return
+
+    raws: List[bytes] = []
+    for node in nodes:
+        raw = raw_headers.get(node.hash)
+        if raw is None:
+            raw = _CONN.execute(
+                '''
+                SELECT header FROM headers
+                WHERE hash = :hash
+                ''',
+                {'hash': node.hash}).fetchone()[0]
+        raws.append(raw)
+
+    _unmap()
+    _FILE.seek(0, os.SEEK_END)
+    _FILE.write(b''.join(raws))
+    _FILE.flush()
+    _COUNT += len(nodes)
+    _TIP_HASH = nodes[-1].hash
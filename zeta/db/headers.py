@@ -1,19 +1,49 @@
-import math
 import sqlite3
 
 from riemann import utils as rutils
 
-from zeta.db import connection
+from zeta import work
+from zeta.db import cache, connection, flatfile, index, orphans, retarget
+from zeta.db import timestamps
 
 from zeta.zeta_types import Header
-from typing import cast, List, Optional, Tuple, Union
+from typing import Any, cast, Dict, List, Optional, Tuple, Union
 
 
 def header_from_row(row: sqlite3.Row) -> Header:
     '''
     Does what it says on the tin
     '''
-    return cast(Header, dict((k, row[k]) for k in row.keys()))
+    return header_from_tuple(
+        (row['hash'], row['header'], row['height'], row['accumulated_work']))
+
+
+def header_from_tuple(row: Tuple[bytes, bytes, int, bytes]) -> Header:
+    '''
+    Expands the raw header bytes into a header dict
+    Takes a row of (hash, header, height, accumulated_work) from a tuple
+    cursor
+    '''
+    h = _unpack_header(row[1], row[0].hex())
+    h['height'] = row[2]
+    h['accumulated_work'] = int.from_bytes(row[3], 'big')
+    return h
+
+
+def header_to_row(header: Header) -> Dict[str, Any]:
+    '''
+    Packs a header dict into the DB row format
+    Args:
+        header (dict): the parsed header
+    Returns:
+        (dict): the row, with hash and header as bytes
+    '''
+    return {
+        'hash': bytes.fromhex(header['hash']),
+        'header': bytes.fromhex(header['hex']),
+        'height': header['height'],
+        'accumulated_work': header['accumulated_work'].to_bytes(32, 'big')
+    }
 
 
 def check_work(header: Header) -> bool:
@@ -36,8 +66,7 @@ def make_target(nbits: bytes) -> int:
     Returns:
         (int): the target threshold
     '''
-    exponent = rutils.be2i(nbits[-1:]) - 3
-    return math.floor(rutils.le2i(nbits[:-1]) * 0x100 ** (exponent))
+    return work.make_target(nbits)
 
 
 def parse_difficulty(nbits: bytes) -> int:
@@ -48,7 +77,7 @@ def parse_difficulty(nbits: bytes) -> int:
     Returns:
         (int): the difficulty (no decimals)
     '''
-    return make_target(b'\xff\xff\x00\x1d') // make_target(nbits)
+    return work.parse_difficulty(nbits)
 
 
 def parse_header(header: str) -> Header:
@@ -72,17 +101,48 @@ def parse_header(header: str) -> Header:
     if len(header) != 160:
         raise ValueError('Invalid header received')
     as_bytes = bytes.fromhex(header)
+    return _unpack_header(as_bytes, rutils.hash256(as_bytes)[::-1].hex())
+
+
+def parse_header_blob(blob: bytes) -> List[Header]:
+    '''
+    Parses concatenated headers, like electrum's getheaders response
+    This is a top-level function so it can run in a process pool
+    Args:
+        blob (bytes): concatenated 80 byte headers
+    Returns:
+        list(dict): the parsed headers
+    '''
+    if len(blob) % 80 != 0:
+        raise ValueError('Invalid header received')
+    res: List[Header] = []
+    for i in range(0, len(blob), 80):
+        as_bytes = blob[i:i + 80]
+        res.append(
+            _unpack_header(as_bytes, rutils.hash256(as_bytes)[::-1].hex()))
+    return res
+
+
+def _unpack_header(as_bytes: bytes, hash: str) -> Header:
+    '''
+    Expands the raw 80 header bytes into a header dict
+    Args:
+        as_bytes (bytes): the 80 byte header
+        hash       (str): the header hash 0000-first
+    Returns:
+        (dict): the parsed header with height and work set to 0
+    '''
     nbits = as_bytes[72:76]
     return {
-        'hash': rutils.hash256(bytes.fromhex(header))[::-1].hex(),
-        'version': rutils.le2i(as_bytes[0:4]),
+        'hash': hash,
+        'version': int.from_bytes(as_bytes[0:4], 'little'),
         'prev_block': as_bytes[4:36][::-1].hex(),
         'merkle_root': as_bytes[36:68].hex(),
-        'timestamp': rutils.le2i(as_bytes[68:72]),
+        'timestamp': int.from_bytes(as_bytes[68:72], 'little'),
         'nbits': nbits.hex(),
         'nonce': as_bytes[76:80].hex(),
-        'difficulty': parse_difficulty(nbits),
-        'hex': header,
+        'difficulty': work.parse_difficulty(nbits),
+        'hex': as_bytes.hex(),
         'height': 0,
         'accumulated_work': 0
     }
@@ -91,86 +151,290 @@ def parse_header(header: str) -> Header:
 def batch_store_header(h: List[Union[Header, str]]) -> bool:
     '''
     Stores a batch of headers in the database
+    Writes all headers with one statement in one transaction
+    Headers are linked to parents earlier in the batch, so the batch
+    should be ordered parent-first, as electrum sends them
     Args:
         header list(str or dict): parsed or unparsed header
     Returns:
         (bool): true if succesful, false if error
     '''
-    # TODO: Refactor and improve
-    c = connection.get_cursor()
-
     headers: List[Header] = []
 
-    for i in range(len(h)):
-        if isinstance(h[i], str):
-            headers.append(parse_header(h[i]))  # type: ignore
+    for item in h:
+        if isinstance(item, str):
+            header = parse_header(item)
         else:
-            headers.append(cast(Header, h[i]))
-        headers[i]['height'] = 0
-        headers[i]['accumulated_work'] = 0
+            header = cast(Header, item)
+        header['height'] = 0
+        header['accumulated_work'] = 0
+        headers.append(header)
 
     headers = list(filter(check_work, headers))
 
-    # NB: this block finds the last header for which we know a parent
-    #     it discards headers earlier in the batch
-    #     this pretty much assumes batches are ordered
-    for i in range(len(headers)):
-        parent = find_by_hash(
-            cast(str, headers[i]['prev_block']))  # type: ignore
-        if parent:
-            headers[i]['height'] = parent['height'] + 1  # type: ignore
-            headers[i]['accumulated_work'] = (
-                parent['accumulated_work']  # type: ignore
-                + headers[0]['difficulty'])  # type: ignore
-            headers = headers[i:]
-            break
-
-    # NB: this block checks if the header has a parent in the current batch
-    #     it populates the height and accumulated work fields if so
-    for header in headers:
-        if header['height'] == 0:
-            results = list(filter(  # type: ignore
-                lambda k: k['hash'] == header['prev_block'],
-                headers))
-            # only populate the fields if the parent has a height
-            if len(results) != 0 and results[0]['height'] > 0:  # type: ignore
-                header['height'] = results[0]['height'] + 1  # type: ignore
-                header['accumulated_work'] = (
-                    results[0]['accumulated_work']  # type: ignore
-                    + header['difficulty'])  # type: ignore
-
+    # NB: link each header to its parent, either earlier in the batch or in
+    #     the index. Track the first header that connects. If any header
+    #     has the wrong difficulty or timestamp, reject the batch before
+    #     writing anything
+    nodes: Dict[str, index.Node] = {}
+    first_connected: Optional[int] = None
+    for i, header in enumerate(headers):
+        parent = nodes.get(header['prev_block'])
+        if parent is None:
+            parent = _find_parent(header)
+        if parent is not None:
+            if not _check_header(header, parent):
+                return False
+            header['height'] = parent.height + 1
+            header['accumulated_work'] = work.accumulate(
+                parent.work, header)
+            nodes[header['hash']] = _make_node(header, parent)
+            if first_connected is None:
+                first_connected = i
+
+    # NB: this discards headers earlier in the batch than the first header
+    #     for which we know a parent. This pretty much assumes batches are
+    #     ordered
+    if first_connected is not None:
+        headers = headers[first_connected:]
+
+    connected, rejected = _connect_orphans(headers, nodes)
     try:
-        for header in headers:
-            c.execute(
-                '''
-                INSERT OR REPLACE INTO headers VALUES (
-                    :hash,
-                    :version,
-                    :prev_block,
-                    :merkle_root,
-                    :timestamp,
-                    :nbits,
-                    :nonce,
-                    :difficulty,
-                    :hex,
-                    :height,
-                    :accumulated_work)
-                ''',
-                (header))
-        connection.commit()
+        _write_headers(headers + connected, rejected)
         return True
     except Exception:
+        _restore_orphans(connected + rejected)
         return False
-    finally:
-        c.close()
+
+
+def _write_headers(
+        headers: List[Header],
+        rejected: List[Header]) -> None:
+    '''
+    Writes headers with one statement in one transaction, then updates the
+    index, the orphan pool, and the flat file
+    Args:
+        headers  (list(dict)): the headers, parent-first
+        rejected (list(dict)): floating headers to delete, as they failed
+                               their checks once their parent arrived
+    '''
+    index.ensure(connection.CONN)
+    _ensure_orphans()
+    with connection.transaction() as c:
+        c.executemany(
+            '''
+            INSERT OR REPLACE INTO headers VALUES (
+                :hash,
+                :header,
+                :height,
+                :accumulated_work)
+            ''',
+            (header_to_row(header) for header in headers))
+        # NB: the pool's cap also bounds the floating headers in the DB and
+        #     the index, so what it evicts is deleted with this write
+        evicted = _update_orphans(headers)
+        evicted.extend(header['hash'] for header in rejected)
+        c.executemany(
+            '''
+            DELETE FROM headers
+            WHERE hash = ? AND height = 0
+            ''',
+            [(bytes.fromhex(hash),) for hash in evicted])
+    _invalidate_cache(headers)
+    cache.invalidate(evicted, [0])
+    for header in headers:
+        _index_header(header)
+    for hash in evicted:
+        node = index.get(bytes.fromhex(hash))
+        if node is not None and node.height == 0:
+            index.remove(node.hash)
+    _sync_flatfile(headers)
+
+
+def _update_orphans(headers: List[Header]) -> List[str]:
+    '''
+    Adds the floating headers to the orphan pool, and takes the rest out
+    Args:
+        headers (list(dict)): the headers being written
+    Returns:
+        (list(str)): 0000-first hashes of the orphans the pool evicted
+    '''
+    evicted: List[str] = []
+    for header in headers:
+        if header['height'] == 0:
+            evicted.extend(orphans.add(header))
+        else:
+            orphans.discard(header['hash'])
+    return [hash for hash in evicted if not orphans.contains(hash)]
+
+
+def _invalidate_cache(headers: List[Header]) -> None:
+    '''
+    Drops cached lookups for headers that were just written
+    Must run before the index is updated, so we see their old heights
+    '''
+    cache.ensure(connection.CONN)
+    hashes = []
+    heights = set()
+    for header in headers:
+        key = bytes.fromhex(header['hash'])
+        hashes.append(key.hex())
+        heights.add(header['height'])
+        node = index.get(key)
+        if node is not None:
+            heights.add(node.height)
+    cache.invalidate(hashes, heights)
+
+
+def _ensure_orphans() -> None:
+    '''
+    Fills the orphan pool from the DB's floating headers, if the pool
+    doesn't belong to the current connection yet
+    '''
+    if orphans.active(connection.CONN):
+        return
+    orphans.reset(connection.CONN)
+    c = connection.CONN.cursor()
+    c.row_factory = None
+    for row in c.execute(
+            '''
+            SELECT hash, header, height, accumulated_work FROM headers
+            WHERE height = 0
+            '''):
+        orphans.add(header_from_tuple(row))
+
+
+def _connect_orphans(
+        parents: List[Header],
+        nodes: Dict[str, index.Node]) -> Tuple[List[Header], List[Header]]:
+    '''
+    Takes the orphans that build on any of these headers out of the pool,
+    along with their descendants, and sets their height and work
+    Orphans with the wrong difficulty or timestamp are dropped from the pool
+    Args:
+        parents   (list(dict)): headers that were just connected
+        nodes           (dict): hash -> unsaved index nodes for the parents
+    Returns:
+        (list(dict)): the newly connected orphans, parent-first
+        (list(dict)): the dropped orphans, still floating in the DB
+    '''
+    _ensure_orphans()
+    connected: List[Header] = []
+    rejected: List[Header] = []
+    seen = set(p['hash'] for p in parents)
+    queue = [p for p in parents if p['height'] != 0]
+    while len(queue) != 0:
+        parent = queue.pop()
+        for child in orphans.take_children(parent['hash']):
+            if child['hash'] in seen:
+                continue
+            parent_node = nodes.get(parent['hash'])
+            if parent_node is None:
+                parent_node = _make_node(parent, None)
+                nodes[parent['hash']] = parent_node
+            if not _check_header(child, parent_node):
+                rejected.append(child)
+                continue
+            seen.add(child['hash'])
+            child['height'] = parent['height'] + 1
+            child['accumulated_work'] = work.accumulate(
+                parent['accumulated_work'], child)
+            nodes[child['hash']] = _make_node(child, parent_node)
+            connected.append(child)
+            queue.append(child)
+    return connected, rejected
+
+
+def _restore_orphans(connected: List[Header]) -> None:
+    '''
+    Puts orphans back in the pool after a failed write
+    '''
+    for header in connected:
+        header['height'] = 0
+        header['accumulated_work'] = 0
+        orphans.add(header)
+
+
+def _make_node(header: Header, parent: Optional[index.Node]) -> index.Node:
+    '''
+    Makes an index node for a header that isn't stored yet
+    It can be used to check the difficulty of its children
+    '''
+    if parent is None:
+        parent = _find_parent(header)
+        if parent is not None and parent.height != header['height'] - 1:
+            parent = None
+    return index.Node(
+        bytes.fromhex(header['hash']),
+        header['height'],
+        header['accumulated_work'],
+        parent,
+        bytes.fromhex(header['nbits']),
+        header['timestamp'])
+
+
+def _check_header(header: Header, parent: index.Node) -> bool:
+    '''
+    Checks a header's difficulty and timestamp against its ancestors
+    Difficulty rules depend on the network of the current DB,
+    see connection.init_conn
+    '''
+    return (timestamps.check_timestamp(header['timestamp'], parent)
+            and retarget.check_nbits(
+                bytes.fromhex(header['nbits']),
+                header['timestamp'],
+                parent,
+                getattr(connection, 'CHAIN_NAME', None)))
+
+
+def _find_parent(header: Header) -> Optional[index.Node]:
+    '''
+    Looks up the parent of a header in the chain index
+    Floating parents (height 0) are treated as unknown
+    Args:
+        header (dict): the child header
+    Returns:
+        (index.Node): the parent's index node, None if unknown
+    '''
+    index.ensure(connection.CONN)
+    try:
+        parent = index.get(bytes.fromhex(header['prev_block']))
+    except (ValueError, TypeError):
+        return None
+    if parent is None or parent.height == 0:
+        return None
+    return parent
+
+
+def _index_header(header: Header) -> None:
+    '''
+    Adds a stored header to the chain index
+    '''
+    index.add(
+        bytes.fromhex(header['hash']),
+        bytes.fromhex(header['prev_block']),
+        header['height'],
+        header['accumulated_work'],
+        bytes.fromhex(header['nbits']),
+        header['timestamp'])
+
+
+def _sync_flatfile(headers: List[Header]) -> None:
+    '''
+    Keeps the main chain flat file in line with the index, if it is open
+    Args:
+        headers (list(dict)): the headers just stored
+    '''
+    if flatfile.active(connection.CONN):
+        flatfile.sync({
+            bytes.fromhex(h['hash']): bytes.fromhex(h['hex'])
+            for h in headers})
 
 
 def parent_height_and_work(header: Header) -> Tuple[int, int]:
-    parent = find_by_hash(header['prev_block'])
-    if parent:
-        parent_work = parent['accumulated_work']
-        parent_height = parent['height']
-        return parent_height, parent_work
+    parent = _find_parent(header)
+    if parent is not None:
+        return parent.height, parent.work
     else:
         return 0, 0
 
@@ -189,40 +453,26 @@ def store_header(header: Union[Header, str]) -> bool:
     if not check_work(header):
         return False
 
+    nodes: Dict[str, index.Node] = {}
     if header['height'] == 0:
-        parent_height, parent_work = parent_height_and_work(header)
-        if parent_height != 0:
-            header['height'] = parent_height + 1  # type: ignore
-            header['accumulated_work'] = (
-                parent_work + header['difficulty'])  # type: ignore
+        parent = _find_parent(header)
+        if parent is not None:
+            if not _check_header(header, parent):
+                return False
+            header['height'] = parent.height + 1
+            header['accumulated_work'] = work.accumulate(
+                parent.work, header)
+            nodes[header['hash']] = _make_node(header, parent)
         else:
-            header['height'] = 0
             header['accumulated_work'] = 0
 
-    c = connection.get_cursor()
+    connected, rejected = _connect_orphans([header], nodes)
     try:
-        c.execute(
-            '''
-            INSERT OR REPLACE INTO headers VALUES (
-                :hash,
-                :version,
-                :prev_block,
-                :merkle_root,
-                :timestamp,
-                :nbits,
-                :nonce,
-                :difficulty,
-                :hex,
-                :height,
-                :accumulated_work)
-            ''',
-            (header))
-        connection.commit()
+        _write_headers([header] + connected, rejected)
         return True
     except Exception:
+        _restore_orphans(connected + rejected)
         return False
-    finally:
-        c.close()
 
 
 def find_by_height(height: int) -> List[Header]:
@@ -243,17 +493,59 @@ def find_by_height(height: int) -> List[Header]:
             hex         (str): the full header as hex
             height      (int): the block height
     '''
-    c = connection.get_cursor()
-    try:
-        res = [header_from_row(r) for r in c.execute(
-            '''
-            SELECT * FROM headers
-            WHERE height = :height
-            ''',
-            {'height': height})]
-        return res
-    finally:
-        c.close()
+    cache.ensure(connection.CONN)
+    cached = cache.get_by_height(height)
+    if cached is not None:
+        return cached
+
+    # NB: if the main chain header is the only one at this height, read it
+    #     from the flat file instead of SQLite
+    header = _find_in_flatfile(height)
+    if header is not None:
+        res = [header]
+    else:
+        c = connection.get_tuple_cursor()
+        try:
+            res = [header_from_tuple(r) for r in c.execute(
+                '''
+                SELECT hash, header, height, accumulated_work FROM headers
+                WHERE height = :height
+                ''',
+                {'height': height})]
+        finally:
+            c.close()
+    # NB: readers may not see pending writes, so only the writer caches
+    if connection.is_writer():
+        cache.put_by_height(height, res)
+    return res
+
+
+def _find_in_flatfile(height: int) -> Optional[Header]:
+    '''
+    Reads the main chain header at a height from the flat file
+    Returns:
+        (dict): the header, None if the flat file can't answer alone
+    '''
+    # NB: the file can be ahead of the last commit, so other threads use
+    #     SQLite, as they only see committed headers
+    if not connection.is_writer() or not flatfile.active(connection.CONN):
+        return None
+    index.ensure(connection.CONN)
+    if index.count_at_height(height) != 1:
+        return None
+    # NB: the file holds the chain ending at its tip, so the index already
+    #     knows the hash at each height
+    tip = flatfile.tip_hash()
+    node = index.ancestor(tip, height) if tip is not None else None
+    if node is None or node.height != height:
+        return None
+    raw = flatfile.get(height)
+    if raw is None:
+        return None
+    header = _unpack_header(raw, node.hash.hex())
+    header['height'] = node.height
+    header['accumulated_work'] = node.work
+    return header
 
 
 def find_by_hash(hash: str) -> Optional[Header]:
@@ -274,45 +566,152 @@ def find_by_hash(hash: str) -> Optional[Header]:
             hex         (str): the full header as hex
             height      (int): the block height
     '''
-    c = connection.get_cursor()
     try:
-        res = [header_from_row(r) for r in c.execute(
+        key = bytes.fromhex(hash)
+    except ValueError:
+        return None
+
+    # NB: the index knows every stored hash, so misses never touch disk
+    index.ensure(connection.CONN)
+    if index.get(key) is None:
+        return None
+
+    cache.ensure(connection.CONN)
+    cached = cache.get_by_hash(key.hex())
+    if cached is not None:
+        return cached
+
+    c = connection.get_tuple_cursor()
+    try:
+        res = [header_from_tuple(r) for r in c.execute(
             '''
-            SELECT * FROM headers
+            SELECT hash, header, height, accumulated_work FROM headers
             WHERE hash = :hash
             ''',
-            {'hash': hash})]
+            {'hash': key})]
         if len(res) != 0:
+            if connection.is_writer():
+                cache.put_by_hash(res[0])
             return res[0]
         return None
     finally:
         c.close()
 
 
+def median_time_past(hash: str) -> Optional[int]:
+    '''
+    Calculates a header's median time past, as in BIP113
+    This is the median timestamp of the header and its 10 ancestors
+    Args:
+        hash (str): 0000-first header hash
+    Returns:
+        (int): the median time past, None if the header is unknown
+    '''
+    try:
+        key = bytes.fromhex(hash)
+    except ValueError:
+        return None
+    index.ensure(connection.CONN)
+    node = index.get(key)
+    if node is None:
+        return None
+    return timestamps.median_time_past(node)
+
+
 def find_highest() -> List[Header]:
-    c = connection.get_cursor()
+    '''
+    Finds the headers at the highest known height. Can return more than 1
+    The tip is tracked by the chain index, so this does not scan
+    Returns:
+        list(dict): the highest headers
+    '''
+    index.ensure(connection.CONN)
+    return _find_by_keys(index.highest())
+
+
+def find_heaviest() -> List[Header]:
+    '''
+    Finds the headers with the most accumulated work. Can return more than 1
+    The tip is tracked by the chain index, so this does not scan
+    Returns:
+        list(dict): the heaviest headers
+    '''
+    index.ensure(connection.CONN)
+    return _find_by_keys(index.heaviest())
+
+
+def find_ancestor(hash: str, height: int) -> Optional[Header]:
+    '''
+    Finds the ancestor of a header at a certain height
+    Walks the chain index, so this is O(log n) in-memory
+    Args:
+        hash    (str): 0000-first hash of the descendant
+        height  (int): the height of the ancestor
+    Returns:
+        (dict): the ancestor header, None if unknown
+    '''
     try:
-        res = [header_from_row(r) for r in c.execute(
-            '''
-            SELECT * FROM headers
-            WHERE height = (SELECT max(height) FROM headers)
-            '''
-        )]
+        key = bytes.fromhex(hash)
+    except ValueError:
+        return None
+    index.ensure(connection.CONN)
+    node = index.ancestor(key, height)
+    if node is None:
+        return None
+    return find_by_hash(node.hash.hex())
+
+
+def _find_by_keys(keys: List[bytes]) -> List[Header]:
+    '''
+    Finds headers by primary key
+    Args:
+        keys (list(bytes)): big-endian header hashes
+    Returns:
+        list(dict): the headers found, in the order requested
+    '''
+    c = connection.get_tuple_cursor()
+    try:
+        res: List[Header] = []
+        for key in keys:
+            row = c.execute(
+                '''
+                SELECT hash, header, height, accumulated_work FROM headers
+                WHERE hash = :hash
+                ''',
+                {'hash': key}).fetchone()
+            if row is not None:
+                res.append(header_from_tuple(row))
         return res
     finally:
         c.close()
 
 
-def find_heaviest() -> List[Header]:
-    c = connection.get_cursor()
+def find_by_prev_block(
+        prev_block: str,
+        floating_only: bool = False) -> List[Header]:
+    '''
+    Finds the children of a header. Can return more than 1
+    Args:
+        prev_block       (str): 0000-first hash of the parent
+        floating_only   (bool): only return children with no known height
+    Returns:
+        list(dict): the child headers
+    '''
+    # NB: the header stores prev_block little-endian at bytes 4:36
     try:
-        res = [header_from_row(r) for r in c.execute(
-            '''
-            SELECT * FROM headers
-            WHERE accumulated_work =
-                (SELECT max(accumulated_work) FROM headers)
+        key = bytes.fromhex(prev_block)[::-1]
+    except ValueError:
+        return []
+
+    c = connection.get_tuple_cursor()
+    try:
+        res = [header_from_tuple(r) for r in c.execute(
             '''
-        )]
+            SELECT hash, header, height, accumulated_work FROM headers
+            WHERE substr(header, 5, 32) = :prev_block
+            {floating}
+            '''.format(floating=('AND height = 0' if floating_only else '')),
+            {'prev_block': key})]
         return res
     finally:
         c.close()
@@ -0,0 +1,328 @@
+import sqlite3
+import threading
+
+from typing import Callable, Dict, List, Optional
+
+
+class Node():
+    '''
+    A compact in-memory entry for a stored header
+    hash is the big-endian (0000-first) hash as bytes
+    skip points to an ancestor further back, for fast ancestor lookup
+    bits and time are the header's nbits and timestamp, for retargeting
+    '''
+    __slots__ = ('hash', 'height', 'work', 'parent', 'skip', 'bits', 'time')
+
+    def __init__(
+            self,
+            hash: bytes,
+            height: int,
+            work: int,
+            parent: Optional['Node'] = None,
+            bits: Optional[bytes] = None,
+            time: Optional[int] = None):
+        self.hash = hash
+        self.height = height
+        self.work = work
+        self.parent = parent
+        self.bits = bits
+        self.time = time
+        self.skip: Optional[Node] = None
+        if parent is not None:
+            self.skip = parent.get_ancestor(_skip_height(height))
+
+    def get_ancestor(self, height: int) -> Optional['Node']:
+        '''
+        Finds the ancestor of this node at a certain height
+        Follows skip pointers where possible. O(log n) in the chain length
+        Args:
+            height (int): the height of the ancestor
+        Returns:
+            (Node): the ancestor, or None if we don't know it
+        '''
+        if height > self.height or height < 0:
+            return None
+
+        walk: Optional[Node] = self
+        while walk is not None and walk.height > height:
+            height_skip = _skip_height(walk.height)
+            height_skip_prev = _skip_height(walk.height - 1)
+            # NB: same heuristic as Bitcoin Core's CBlockIndex::GetAncestor
+            #     only take the skip if it doesn't overshoot a better skip
+            if (walk.skip is not None
+                    and (height_skip == height
+                         or (height_skip > height
+                             and not (height_skip_prev < height_skip - 2
+                                      and height_skip_prev >= height)))):
+                walk = walk.skip
+            else:
+                walk = walk.parent
+        return walk
+
+
+def _invert_lowest_one(n: int) -> int:
+    return n & (n - 1)
+
+
+def _skip_height(height: int) -> int:
+    '''
+    Determines the height a node's skip pointer should point to
+    Any number strictly lower than height is acceptable,
+    but this gives O(log n) ancestor lookups
+    '''
+    if height < 2:
+        return 0
+    # NB: odd heights skip a bit further, so walks from adjacent heights
+    #     don't follow the same path
+    if height & 1:
+        return _invert_lowest_one(_invert_lowest_one(height - 1)) + 1
+    return _invert_lowest_one(height)
+
+
+# NB: the DB thread changes the index while read pool threads query it.
+#     Reentrant, as load and add call other locked functions
+_LOCK = threading.RLock()
+_CONN: Optional[sqlite3.Connection] = None
+_NODES: Dict[bytes, Node] = {}
+_HIGHEST: Dict[bytes, Node] = {}
+_HEAVIEST: Dict[bytes, Node] = {}
+_HEIGHTS: Dict[int, int] = {}  # height -> number of headers at that height
+_BITS: Dict[bytes, bytes] = {}  # NB: nbits repeat, so nodes share them
+
+
+def load(conn: sqlite3.Connection) -> None:
+    '''
+    Builds the index from the headers table of a connection
+    Args:
+        conn (sqlite3.Connection): the DB connection to index
+    '''
+    global _CONN
+
+    with _LOCK:
+        clear()
+        c = conn.cursor()
+        try:
+            # NB: ordering by height ensures parents are added before children
+            rows = c.execute(
+                '''
+                SELECT hash, substr(header, 5, 32), height, accumulated_work,
+                       substr(header, 69, 8)
+                FROM headers
+                ORDER BY height
+                ''')
+            for row in rows:
+                add(row[0], row[1][::-1], row[2],
+                    int.from_bytes(row[3], 'big'),
+                    row[4][4:], int.from_bytes(row[4][:4], 'little'))
+        finally:
+            c.close()
+        _CONN = conn
+
+
+def ensure(conn: sqlite3.Connection) -> None:
+    '''
+    Makes sure the index reflects the given connection
+    Rebuilds it if the connection has been replaced
+    Args:
+        conn (sqlite3.Connection): the DB connection in use
+    '''
+    with _LOCK:
+        if conn is not _CONN:
+            load(conn)
+
+
+def clear() -> None:
+    global _CONN
+    with _LOCK:
+        _CONN = None
+        _NODES.clear()
+        _HIGHEST.clear()
+        _HEAVIEST.clear()
+        _HEIGHTS.clear()
+        _BITS.clear()
+
+
+def add(
+        hash: bytes,
+        prev_block: bytes,
+        height: int,
+        work: int,
+        bits: Optional[bytes] = None,
+        time: Optional[int] = None) -> Node:
+    '''
+    Adds a stored header to the index, or updates it if already present
+    Args:
+        hash       (bytes): the big-endian header hash
+        prev_block (bytes): the big-endian parent hash
+        height       (int): the header's height (0 if floating)
+        work         (int): the header's accumulated work
+        bits       (bytes): the header's nbits
+        time         (int): the header's timestamp
+    Returns:
+        (Node): the index node
+    '''
+    with _LOCK:
+        if bits is not None:
+            bits = _BITS.setdefault(bits, bits)
+        parent = _NODES.get(prev_block) if height != 0 else None
+        if parent is not None and parent.height != height - 1:
+            parent = None
+
+        # NB: read the current tips before a tip node gets modified in place
+        best_height = _best_value(_HIGHEST, _height)
+        best_work = _best_value(_HEAVIEST, _work)
+
+        node = _NODES.get(hash)
+        if node is None:
+            node = Node(hash, height, work, parent, bits, time)
+            _NODES[hash] = node
+        else:
+            _HEIGHTS[node.height] -= 1
+            if _HEIGHTS[node.height] == 0:
+                del _HEIGHTS[node.height]
+            node.height = height
+            node.work = work
+            node.parent = parent
+            node.bits = bits
+            node.time = time
+            node.skip = None
+            if parent is not None:
+                node.skip = parent.get_ancestor(_skip_height(height))
+        _HEIGHTS[height] = _HEIGHTS.get(height, 0) + 1
+
+        _update_best(_HIGHEST, node, _height, best_height)
+        _update_best(_HEAVIEST, node, _work, best_work)
+        return node
+
+
+def remove(hash: bytes) -> None:
+    '''
+    Drops a pruned header from the index
+    Descendants keep their parent and skip pointers, so ancestor walks still
+    work until the index is next rebuilt from the DB
+    Args:
+        hash (bytes): the big-endian header hash
+    '''
+    with _LOCK:
+        node = _NODES.pop(hash, None)
+        if node is None:
+            return
+        _HEIGHTS[node.height] -= 1
+        if _HEIGHTS[node.height] == 0:
+            del _HEIGHTS[node.height]
+        for best, key in ((_HIGHEST, _height), (_HEAVIEST, _work)):
+            if hash in best:
+                del best[hash]
+                if len(best) == 0:
+                    _rescan(best, key)
+
+
+def _height(node: Node) -> int:
+    return node.height
+
+
+def _work(node: Node) -> int:
+    return node.work
+
+
+def _best_value(
+        best: Dict[bytes, Node],
+        key: Callable[[Node], int]) -> Optional[int]:
+    if len(best) == 0:
+        return None
+    return key(next(iter(best.values())))
+
+
+def _update_best(
+        best: Dict[bytes, Node],
+        node: Node,
+        key: Callable[[Node], int],
+        current: Optional[int]) -> None:
+    '''
+    Updates one of the tip sets after a node was added or changed
+    Args:
+        best    (dict): the tip set, all entries share the same key value
+        node    (Node): the changed node
+        key     (func): the value to maximize
+        current  (int): the tip set's value before the change
+    '''
+    if current is None or key(node) > current:
+        best.clear()
+        best[node.hash] = node
+    elif key(node) == current:
+        best[node.hash] = node
+    elif node.hash in best:
+        # NB: a tip was overwritten with a lower value. This is rare, so we
+        #     just rescan the index
+        del best[node.hash]
+        if len(best) == 0:
+            _rescan(best, key)
+
+
+def _rescan(best: Dict[bytes, Node], key: Callable[[Node], int]) -> None:
+    if len(_NODES) == 0:
+        return
+    target = max(key(n) for n in _NODES.values())
+    best.update((n.hash, n) for n in _NODES.values() if key(n) == target)
+
+
+def get(hash: bytes) -> Optional[Node]:
+    with _LOCK:
+        return _NODES.get(hash)
+
+
+def ancestor(hash: bytes, height: int) -> Optional[Node]:
+    '''
+    Finds the ancestor of a known header at a certain height
+    Args:
+        hash (bytes): the big-endian header hash
+        height (int): the height of the ancestor
+    Returns:
+        (Node): the ancestor's node, or None if unknown
+    '''
+    with _LOCK:
+        node = _NODES.get(hash)
+        if node is None:
+            return None
+        return node.get_ancestor(height)
+
+
+def highest() -> List[bytes]:
+    '''
+    Returns:
+        (list(bytes)): hashes of all headers at the max height, sorted
+    '''
+    with _LOCK:
+        return sorted(_HIGHEST)
+
+
+def heaviest() -> List[bytes]:
+    '''
+    Returns:
+        (list(bytes)): hashes of all headers with the most work, sorted
+    '''
+    with _LOCK:
+        return sorted(_HEAVIEST)
+
+
+def size() -> int:
+    with _LOCK:
+        return len(_NODES)
+
+
+def count_at_height(height: int) -> int:
+    '''
+    Returns:
+        (int): the number of known headers at a height
+    '''
+    with _LOCK:
+        return _HEIGHTS.get(height, 0)
+
+
+def lowest_height() -> int:
+    '''
+    Returns:
+        (int): the lowest height of any connected header, 0 if there are none
+    '''
+    with _LOCK:
+        return min((h for h in _HEIGHTS if h != 0), default=0)
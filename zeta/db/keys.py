@@ -5,7 +5,7 @@ from zeta.db import connection
 
 from riemann.encoding import addresses as addr
 
-from typing import cast, Optional, List
+from typing import cast, Optional, List, Tuple
 from zeta.zeta_types import KeyEntry
 
 
@@ -25,6 +25,23 @@ def key_from_row(
     return res
 
 
+def key_from_tuple(
+        row: Tuple[str, bytes, str, str, str],
+        secret_phrase: Optional[str] = None,
+        get_priv: bool = False) -> KeyEntry:
+    '''
+    As key_from_row, for a row of
+    (pubkey, privkey, derivation, chain, address) from a tuple cursor
+    '''
+    return {
+        'pubkey': row[0],
+        'privkey': (crypto.decode_aes(row[1], secret_phrase)
+                    if get_priv and secret_phrase else b''),
+        'derivation': row[2],
+        'chain': row[3],
+        'address': row[4]}
+
+
 def validate_key(k: KeyEntry) -> bool:
     '''
     Checks internal consistency of a key entry
@@ -63,9 +80,10 @@ def store_key(key_entry: KeyEntry, secret_phrase: Optional[str]) -> bool:
             secret_phrase=cast(str, secret_phrase))
         c.execute(
             '''
-            INSERT OR IGNORE INTO addresses VALUES (
-                :address,
-                :script)
+            INSERT INTO addresses (address, script)
+            VALUES (:address, :script)
+            ON CONFLICT(address) DO UPDATE SET script = excluded.script
+            WHERE script IS NULL
             ''',
             {'address': k['address'], 'script': b''})
         c.execute(
@@ -78,7 +96,8 @@ def store_key(key_entry: KeyEntry, secret_phrase: Optional[str]) -> bool:
                 :address)
             ''',
             k)
-        connection.commit()
+        # NB: losing a key loses funds, so don't wait for a group commit
+        connection.commit(durable=True)
         return True
     except Exception:
         return False
@@ -90,13 +109,13 @@ def find_one() -> Optional[KeyEntry]:
     '''
     Finds some key. Useful for checking if there's a valid key in there
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
         res = c.execute(
             '''
-            SELECT * FROM keys
+            SELECT pubkey, privkey, derivation, chain, address FROM keys
             ''').fetchone()
-        return res if res is None else key_from_row(res)
+        return res if res is None else key_from_tuple(res)
     finally:
         c.close()
 
@@ -109,18 +128,18 @@ def find_by_address(
     finds a key by its primary address
     its primary address is the bech32 p2wpkh of its compressed pubkey
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
         res = c.execute(
             '''
-            SELECT * FROM keys
+            SELECT pubkey, privkey, derivation, chain, address FROM keys
             WHERE address = :address
             ''',
             {'address': address})
         for a in res:
             # little hacky. returns first entry
             # we know there can only be one
-            return key_from_row(a, secret_phrase, get_priv)
+            return key_from_tuple(a, secret_phrase, get_priv)
         return None
     finally:
         c.close()
@@ -133,11 +152,11 @@ def find_by_pubkey(
     '''
     finds a key by its pubkey
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
-        res = [key_from_row(r, secret_phrase, get_priv) for r in c.execute(
+        res = [key_from_tuple(r, secret_phrase, get_priv) for r in c.execute(
             '''
-            SELECT * FROM keys
+            SELECT pubkey, privkey, derivation, chain, address FROM keys
             WHERE pubkey = :pubkey
             ''',
             {'pubkey': pubkey})]
@@ -153,11 +172,11 @@ def find_by_script(
     '''
     Finds all KeyEntries whose pubkey appears in a certain script
     '''
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
-        res = [key_from_row(r, secret_phrase, get_priv) for r in c.execute(
+        res = [key_from_tuple(r, secret_phrase, get_priv) for r in c.execute(
             '''
-            SELECT * FROM keys
+            SELECT pubkey, privkey, derivation, chain, address FROM keys
             WHERE pubkey IN
                 (SELECT pubkey FROM pubkey_to_script
                  WHERE script = :script)
@@ -0,0 +1,110 @@
+from zeta.db import connection
+
+from typing import List, Optional, Tuple
+
+
+def find_tip() -> Optional[Tuple[int, bytes]]:
+    '''
+    Finds the tip of the recorded main chain
+    Returns:
+        (int, bytes): the height and big-endian hash, None if empty
+    '''
+    c = connection.get_tuple_cursor()
+    try:
+        row = c.execute(
+            '''
+            SELECT height, hash FROM main_chain
+            ORDER BY height DESC
+            LIMIT 1
+            ''').fetchone()
+    finally:
+        c.close()
+    if row is None:
+        return None
+    return row[0], row[1]
+
+
+def find_hash(height: int) -> Optional[str]:
+    '''
+    Finds the main chain header hash at a height
+    Args:
+        height (int): the block height
+    Returns:
+        (str): the 0000-first hash, None if the main chain isn't that long
+    '''
+    c = connection.get_tuple_cursor()
+    try:
+        row = c.execute(
+            '''
+            SELECT hash FROM main_chain
+            WHERE height = :height
+            ''',
+            {'height': height}).fetchone()
+    finally:
+        c.close()
+    if row is None:
+        return None
+    return row[0].hex()
+
+
+def on_main_chain(hash: str) -> bool:
+    '''
+    Checks whether a header is on the main chain
+    Args:
+        hash (str): the 0000-first header hash
+    Returns:
+        (bool): True if on the main chain
+    '''
+    try:
+        key = bytes.fromhex(hash)
+    except ValueError:
+        return False
+    c = connection.get_tuple_cursor()
+    try:
+        row = c.execute(
+            '''
+            SELECT 1 FROM main_chain
+            WHERE hash = :hash
+            ''',
+            {'hash': key}).fetchone()
+    finally:
+        c.close()
+    return row is not None
+
+
+def update(fork_height: int, connected: List[Tuple[int, bytes]]) -> None:
+    '''
+    Moves the main chain to a new tip in one transaction
+    Args:
+        fork_height          (int): the last height both chains share.
+                                    -1 replaces the whole chain
+        connected (list(int, bytes)): height and big-endian hash of each
+                                      header after the fork, lowest first
+    '''
+    with connection.transaction() as c:
+        c.execute(
+            '''
+            DELETE FROM main_chain
+            WHERE height > :height
+            ''',
+            {'height': fork_height})
+        c.executemany(
+            '''
+            INSERT INTO main_chain VALUES (?, ?)
+            ''',
+            connected)
+
+
+def prune(height: int) -> None:
+    '''
+    Forgets the main chain below a height, e.g. once compact has archived it
+    Args:
+        height (int): the lowest height to keep
+    '''
+    with connection.transaction() as c:
+        c.execute(
+            '''
+            DELETE FROM main_chain
+            WHERE height < :height
+            ''',
+            {'height': height})
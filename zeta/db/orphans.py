@@ -0,0 +1,101 @@
+import os
+import sqlite3
+
+from collections import OrderedDict
+
+from zeta.zeta_types import Header
+from typing import Dict, List, Optional
+
+# NB: caps memory use if a server sends us lots of unconnectable headers
+#     orphans are evicted first in, first out. Order is when we received
+#     them, not their timestamps, which the sender chooses
+MAX_ORPHANS = int(os.environ.get('ZETA_MAX_ORPHANS', 5000))
+
+# NB: only writes use the pool, so only the DB thread touches it. Finders
+#     never read it, so read pool threads need no lock
+_CONN: Optional[sqlite3.Connection] = None
+_BY_PREV: Dict[str, Dict[str, Header]] = {}  # prev_block -> hash -> header
+_AGE: 'OrderedDict[str, str]' = OrderedDict()  # hash -> prev_block, FIFO
+
+
+def active(conn: sqlite3.Connection) -> bool:
+    '''
+    Returns:
+        (bool): True if the pool was loaded for this connection
+    '''
+    return conn is _CONN
+
+
+def reset(conn: sqlite3.Connection) -> None:
+    '''
+    Empties the pool, and binds it to a connection
+    Args:
+        conn (sqlite3.Connection): the DB connection the pool belongs to
+    '''
+    global _CONN
+    clear()
+    _CONN = conn
+
+
+def clear() -> None:
+    global _CONN
+    _CONN = None
+    _BY_PREV.clear()
+    _AGE.clear()
+
+
+def size() -> int:
+    return len(_AGE)
+
+
+def contains(hash: str) -> bool:
+    return hash in _AGE
+
+
+def add(header: Header) -> List[str]:
+    '''
+    Adds a header whose parent is unknown
+    Evicts the orphans added earliest if the pool is full. Re-adding a
+    header moves it to the back of the queue
+    Args:
+        header (dict): the floating header
+    Returns:
+        (list(str)): 0000-first hashes of the evicted orphans
+    '''
+    discard(header['hash'])
+    _BY_PREV.setdefault(header['prev_block'], {})[header['hash']] = header
+    _AGE[header['hash']] = header['prev_block']
+    evicted = []
+    while len(_AGE) > MAX_ORPHANS:
+        evicted.append(next(iter(_AGE)))
+        discard(evicted[-1])
+    return evicted
+
+
+def discard(hash: str) -> None:
+    '''
+    Removes a header from the pool, if present
+    Args:
+        hash (str): the 0000-first header hash
+    '''
+    prev_block = _AGE.pop(hash, None)
+    if prev_block is None:
+        return
+    children = _BY_PREV[prev_block]
+    del children[hash]
+    if len(children) == 0:
+        del _BY_PREV[prev_block]
+
+
+def take_children(hash: str) -> List[Header]:
+    '''
+    Removes and returns the orphans that build on a header
+    Args:
+        hash (str): the 0000-first parent hash
+    Returns:
+        (list(dict)): the child headers, oldest first
+    '''
+    children = _BY_PREV.pop(hash, {})
+    for child in children:
+        del _AGE[child]
+    return list(children.values())
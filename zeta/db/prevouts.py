@@ -1,40 +1,58 @@
 import sqlite3
 
-from riemann import utils as rutils
 from riemann.encoding import addresses as addr
 
-from zeta import utils
-from zeta.db import connection
-from zeta.zeta_types import Outpoint, Prevout, PrevoutEntry
+from zeta.db import balances, connection
+from zeta.zeta_types import Outpoint, Prevout, PrevoutPage
 
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+# prevouts per page for the page_* and iter_* finders
+PAGE_SIZE = 1000
 
-def prevout_from_row(row: sqlite3.Row) -> Prevout:
-    res: Prevout = {
-        'outpoint': Outpoint(
-            tx_id=row['tx_id'],
-            index=row['idx']),
-        'value': row['value'],
-        'spent_at': row['spent_at'],
-        'spent_by': row['spent_by'],
-        'address': row['address']}
-    return res
+_MAX_PARAMS = 500
+
+
+def prevout_from_tuple(
+        row: Tuple[bytes, int, int, Optional[bytes], str]) -> Prevout:
+    '''
+    Makes a prevout from a row of
+    (outpoint, value, spent_at, spent_by, address) from a tuple cursor
+    '''
+    outpoint = row[0]
+    return {
+        'outpoint': {
+            'tx_id': outpoint[31::-1].hex(),
+            'index': int.from_bytes(outpoint[32:], 'little')},
+        'value': row[1],
+        'spent_at': row[2],
+        'spent_by': '' if row[3] is None else row[3].hex(),
+        'address': row[4]}
+
+
+def outpoint_key(outpoint: Outpoint) -> bytes:
+    '''
+    Serializes an outpoint, as it is keyed in the DB
+    Args:
+        outpoint (Outpoint): the outpoint
+    Returns:
+        (bytes): the 32 byte little-endian tx_id, then the 4 byte index
+    '''
+    return (bytes.fromhex(outpoint['tx_id'])[::-1]
+            + outpoint['index'].to_bytes(4, 'little'))
 
 
-def _flatten_prevout(prevout: Prevout) -> PrevoutEntry:
-    outpoint = '{tx_id}{index}'.format(
-        tx_id=utils.reverse_hex(prevout['outpoint']['tx_id']),
-        index=rutils.i2le_padded(prevout['outpoint']['index'], 4).hex())
+def _prevout_to_row(prevout: Prevout) -> Dict[str, Any]:
+    '''
+    Packs a prevout into the DB row format
+    '''
     return {
-        'outpoint': outpoint,
-        'tx_id': prevout['outpoint']['tx_id'],
-        'idx': prevout['outpoint']['index'],
+        'outpoint': outpoint_key(prevout['outpoint']),
         'value': prevout['value'],
         'spent_at': prevout['spent_at'],
-        'spent_by': prevout['spent_by'],
-        'address': prevout['address']
-    }
+        'spent_by': (bytes.fromhex(prevout['spent_by'])
+                     if prevout['spent_by'] else None),
+        'address': prevout['address']}
 
 
 def validate_prevout(prevout: Prevout) -> bool:
@@ -51,6 +69,80 @@ def validate_prevout(prevout: Prevout) -> bool:
     return True
 
 
+def _address_ids(c: sqlite3.Cursor, address_list: List[str]) -> Dict[str, int]:
+    '''
+    Finds the ids of addresses, adding any that aren't in addresses yet
+    '''
+    c.executemany(
+        '''
+        INSERT OR IGNORE INTO addresses (address) VALUES (?)
+        ''',
+        [(a,) for a in address_list])
+    return {a: c.execute(
+        '''
+        SELECT id FROM addresses WHERE address = ?
+        ''',
+        (a,)).fetchone()[0] for a in address_list}
+
+
+def _stored_rows(
+        c: sqlite3.Cursor,
+        keys: List[bytes]) -> Dict[bytes, Tuple[int, int, int]]:
+    '''
+    Finds the value, spent_at and address_id of outpoints already stored
+    '''
+    res: Dict[bytes, Tuple[int, int, int]] = {}
+    # NB: SQLite limits how many parameters one statement binds
+    for i in range(0, len(keys), _MAX_PARAMS):
+        chunk = keys[i:i + _MAX_PARAMS]
+        res.update((r[0], (r[1], r[2], r[3])) for r in c.execute(
+            '''
+            SELECT outpoint, value, spent_at, address_id FROM prevouts
+            WHERE outpoint IN ({question_marks})
+            '''.format(question_marks=', '.join('?' * len(chunk))),
+            chunk))
+    return res
+
+
+def _store_rows(c: sqlite3.Cursor, rows: List[Dict[str, Any]]) -> None:
+    '''
+    Writes prevout rows, and updates their addresses' balances
+    Addresses are added to addresses if needed, as prevouts refer to them
+    by id
+    '''
+    ids = _address_ids(c, list(set(r['address'] for r in rows)))
+    stored = _stored_rows(c, [r['outpoint'] for r in rows])
+
+    # NB: a row may replace one stored earlier, even earlier in this batch.
+    #     Its old contribution comes off the balance the old row was in
+    deltas: Dict[int, List[int]] = {}
+    for r in rows:
+        address_id = ids[r['address']]
+        r['address_id'] = address_id
+        old = stored.get(r['outpoint'])
+        if old is not None:
+            d = deltas.setdefault(old[2], [0, 0, 0, 0])
+            for j, v in enumerate(balances.contribution(old[0], old[1])):
+                d[j] -= v
+        d = deltas.setdefault(address_id, [0, 0, 0, 0])
+        for j, v in enumerate(
+                balances.contribution(r['value'], r['spent_at'])):
+            d[j] += v
+        stored[r['outpoint']] = (r['value'], r['spent_at'], address_id)
+
+    c.executemany(
+        '''
+        INSERT OR REPLACE INTO prevouts VALUES (
+            :outpoint,
+            :value,
+            :spent_at,
+            :spent_by,
+            :address_id)
+        ''',
+        rows)
+    balances.apply_deltas(c, deltas)
+
+
 def store_prevout(prevout: Prevout) -> bool:
     '''
     Stores a prevout in the database
@@ -59,31 +151,15 @@ def store_prevout(prevout: Prevout) -> bool:
     Return:
         (bool): true if successful, false if error
     '''
-    c = connection.get_cursor()
-
     if not validate_prevout(prevout):
         return False
 
     try:
-        flattened = _flatten_prevout(prevout)
-        c.execute(
-            '''
-            INSERT OR REPLACE INTO prevouts VALUES (
-                :outpoint,
-                :tx_id,
-                :idx,
-                :value,
-                :spent_at,
-                :spent_by,
-                :address)
-            ''',
-            flattened)
-        connection.commit()
+        with connection.transaction() as c:
+            _store_rows(c, [_prevout_to_row(prevout)])
         return True
     except Exception:
         return False
-    finally:
-        c.close()
 
 
 def batch_store_prevout(prevout_list: List[Prevout]) -> bool:
@@ -94,31 +170,31 @@ def batch_store_prevout(prevout_list: List[Prevout]) -> bool:
     Returns:
         (bool): True if prevouts were stored, false otherwise
     '''
-    c = connection.get_cursor()
-
     for prevout in prevout_list:
         if not validate_prevout(prevout):
             return False
 
     try:
-        flattened_list = list(map(_flatten_prevout, prevout_list))
-        for prevout_entry in flattened_list:
-            c.execute(
-                '''
-                INSERT OR REPLACE INTO prevouts VALUES (
-                    :outpoint,
-                    :tx_id,
-                    :idx,
-                    :value,
-                    :spent_at,
-                    :spent_by,
-                    :address)
-                ''',
-                prevout_entry)
-        connection.commit()
+        with connection.transaction() as c:
+            _store_rows(c, [_prevout_to_row(p) for p in prevout_list])
         return True
     except Exception:
         return False
+
+
+# NB: every finder selects prevout_from_tuple's columns this way
+_SELECT = '''
+    SELECT p.outpoint, p.value, p.spent_at, p.spent_by, a.address
+    FROM prevouts p
+    JOIN addresses a ON a.id = p.address_id
+    '''
+
+
+def _find(where: str, params: Any = ()) -> List[Prevout]:
+    c = connection.get_tuple_cursor()
+    try:
+        return [prevout_from_tuple(r) for r in c.execute(
+            _SELECT + where, params)]
     finally:
         c.close()
 
@@ -130,103 +206,89 @@ def find_by_address(address: str) -> List[Prevout]:
     Args:
         address (str):
     '''
-    c = connection.get_cursor()
+    return _find(
+        '''
+        WHERE p.address_id = (
+            SELECT id FROM addresses WHERE address = :address)
+        ''',
+        {'address': address})
 
-    try:
-        return [prevout_from_row(r) for r in c.execute(
-            '''
-            SELECT * FROM prevouts
-            WHERE address = :address
-            ''',
-            {'address': address})]
-    finally:
-        c.close()
+
+def find_unspents_by_address(address: str) -> List[Prevout]:
+    '''
+    Finds an address's unspent prevouts, without reading its spent ones
+    Args:
+        address (str):
+    '''
+    return _find(
+        '''
+        WHERE p.address_id = (
+            SELECT id FROM addresses WHERE address = :address)
+          AND p.spent_at = -2
+        ''',
+        {'address': address})
 
 
 def find_by_tx_id(tx_id: str) -> List[Prevout]:
-    c = connection.get_cursor()
     try:
-        res = [prevout_from_row(p) for p in c.execute(
-            '''
-            SELECT * from prevouts
-            WHERE tx_id = :tx_id
-            ''',
-            {'tx_id': tx_id}
-        )]
-        return res
-    finally:
-        c.close()
+        tx_id_le = bytes.fromhex(tx_id)[::-1]
+    except ValueError:
+        return []
+    # NB: a tx's outpoints are adjacent, in index order
+    return _find(
+        '''
+        WHERE p.outpoint BETWEEN :lower AND :upper
+        ''',
+        {'lower': tx_id_le + b'\x00' * 4,
+         'upper': tx_id_le + b'\xff' * 4})
 
 
 def find_by_outpoint(outpoint: Outpoint) -> Optional[Prevout]:
-    c = connection.get_cursor()
     try:
-        res = [prevout_from_row(p) for p in c.execute(
-            '''
-            SELECT * from prevouts
-            WHERE tx_id = :tx_id
-              AND idx = :index
-            ''',
-            outpoint
-        )]
-        for p in res:
-            # little hacky. returns first entry
-            # we know there can only be one
-            return p
+        key = outpoint_key(outpoint)
+    except (ValueError, TypeError, KeyError, OverflowError):
         return None
-    finally:
-        c.close()
+    res = _find(
+        '''
+        WHERE p.outpoint = :outpoint
+        ''',
+        {'outpoint': key})
+    return res[0] if len(res) != 0 else None
 
 
 def find_all_unspents() -> List[Prevout]:
-    c = connection.get_cursor()
-    try:
-        res = [prevout_from_row(p) for p in c.execute(
-            '''
-            SELECT * from prevouts
-            WHERE spent_at = -2
-            '''
-        )]
-        return res
-    finally:
-        c.close()
+    return _find(
+        '''
+        WHERE p.spent_at = -2
+        ''')
 
 
 def find_by_child(child_tx_id: str) -> List[Prevout]:
-    c = connection.get_cursor()
     try:
-        res = [prevout_from_row(p) for p in c.execute(
-            '''
-            SELECT * from prevouts
-            WHERE spent_by = :child_tx_id
-            ''',
-            {'child_tx_id': child_tx_id}
-        )]
-        return res
-    finally:
-        c.close()
+        spent_by = bytes.fromhex(child_tx_id)
+    except ValueError:
+        return []
+    return _find(
+        '''
+        WHERE p.spent_by = :child_tx_id
+        ''',
+        {'child_tx_id': spent_by})
 
 
 def find_by_value_range(
         lower_value: int,
         upper_value: int,
         unspents_only: bool = True) -> List[Prevout]:
-    c = connection.get_cursor()
-    try:
-        # I don't like this.
-        # figure out how to do this without string format
-        res = [prevout_from_row(p) for p in c.execute(
-            '''
-            SELECT * from prevouts
-            WHERE value <= :upper_value
-              AND value >= :lower_value
-              AND spent_at {operator} -2
-            '''.format(operator=('==' if unspents_only else '!=')),
-            {'upper_value': upper_value,
-             'lower_value': lower_value})]
-        return res
-    finally:
-        c.close()
+    # NB: spent_at is -2, -1 or a height, so > -2 is spent, and the
+    #     prevouts_spent index can be used as a range
+    return _find(
+        '''
+        WHERE p.value <= :upper_value
+          AND p.value >= :lower_value
+          AND p.spent_at {operator} -2
+        '''.format(operator=('=' if unspents_only else '>')),
+        {'upper_value': upper_value,
+         'lower_value': lower_value})
 
 
 def find_spent_by_mempool_tx() -> List[Prevout]:
@@ -234,18 +296,10 @@ def find_spent_by_mempool_tx() -> List[Prevout]:
     Finds prevouts that have been spent by a tx in the mempool
     Useful for checking if a tx can be replaced or has confirmed
     '''
-    c = connection.get_cursor()
-    try:
-        # I don't like this.
-        # figure out how to do this without string format
-        res = [prevout_from_row(p) for p in c.execute(
-            '''
-            SELECT * from prevouts
-            WHERE spent_at == -1
-            ''')]
-        return res
-    finally:
-        c.close()
+    return _find(
+        '''
+        WHERE p.spent_at = -1
+        ''')
 
 
 def check_for_known_outpoints(
@@ -254,24 +308,23 @@ def check_for_known_outpoints(
     Finds all prevouts we know of from a list of outpoints
     Useful for checking whether the DB already knows about specific prevouts
     '''
-    # NB: We want to flatten the outpoint to look it up in the DB
-    flattened_list: List[str] = []
-    for o in outpoint_list:
-        flat_outpoint = '{tx_id}{index}'.format(
-            tx_id=utils.reverse_hex(o['tx_id']),
-            index=rutils.i2le_padded(o['index'], 4).hex())
-        flattened_list.append(flat_outpoint)
+    keys = [outpoint_key(o) for o in outpoint_list]
 
-    c = connection.get_cursor()
+    c = connection.get_tuple_cursor()
     try:
-        question_marks = ', '.join(['?' for _ in range(len(outpoint_list))])
-        cursor = c.execute(
-            '''
-            SELECT tx_id, idx FROM prevouts
-            WHERE outpoint IN ({question_marks})
-            '''.format(question_marks=question_marks),
-            flattened_list)
-        res = [Outpoint(tx_id=p['tx_id'], index=p['idx']) for p in cursor]
+        res: List[Outpoint] = []
+        # NB: SQLite limits how many parameters one statement binds
+        for i in range(0, len(keys), _MAX_PARAMS):
+            chunk = keys[i:i + _MAX_PARAMS]
+            res.extend(Outpoint(
+                tx_id=p[0][31::-1].hex(),
+                index=int.from_bytes(p[0][32:], 'little'))
+                for p in c.execute(
+                    '''
+                    SELECT outpoint FROM prevouts
+                    WHERE outpoint IN ({question_marks})
+                    '''.format(question_marks=', '.join('?' * len(chunk))),
+                    chunk))
         return res
     finally:
         c.close()
@@ -279,14 +332,157 @@ def check_for_known_outpoints(
 
 def find_all() -> List[Prevout]:
     '''
-    Finds all prevouts
+    Finds all prevouts, in outpoint order
+    '''
+    return _find('ORDER BY p.outpoint')
+
+
+def _find_page(
+        where: str,
+        params: Dict[str, Any],
+        after: Optional[str],
+        limit: int) -> PrevoutPage:
     '''
-    c = connection.get_cursor()
+    Finds the next page of prevouts in outpoint order
+    Each page is its own query, so no cursor is held between pages
+    Args:
+        where   (str): extra conditions, starting with AND
+        params (dict): the parameters for where
+        after   (str): the token from the last page, None for the first
+        limit   (int): the most prevouts on the page
+    Returns:
+        (dict): the prevouts, and the token for the next page
+    '''
+    if limit < 1:
+        raise ValueError('limit must be at least 1. Got {}'.format(limit))
+    c = connection.get_tuple_cursor()
     try:
-        res = [prevout_from_row(r) for r in c.execute(
-            '''
-            SELECT * FROM prevouts
-            ''')]
-        return res
+        rows = c.execute(
+            _SELECT + '''
+            WHERE p.outpoint > :after {where}
+            ORDER BY p.outpoint
+            LIMIT :limit
+            '''.format(where=where),
+            dict(params, after=bytes.fromhex(after or ''),
+                 limit=limit)).fetchall()
     finally:
         c.close()
+    return {
+        'prevouts': [prevout_from_tuple(r) for r in rows],
+        'next': rows[-1][0].hex() if len(rows) == limit else None}
+
+
+def _iter_pages(
+        page: Callable[..., PrevoutPage],
+        *args: Any,
+        page_size: int = PAGE_SIZE) -> Iterator[Prevout]:
+    '''
+    Yields the prevouts from each page of a page_* finder in turn
+    '''
+    after: Optional[str] = None
+    while True:
+        res = page(*args, after, page_size)
+        yield from res['prevouts']
+        after = res['next']
+        if after is None:
+            return
+
+
+def page_all(
+        after: Optional[str] = None,
+        limit: int = PAGE_SIZE) -> PrevoutPage:
+    '''
+    Finds a page of all prevouts
+    Pages are keyed by outpoint, so prevouts stored while paging don't shift
+    later pages
+    Args:
+        after (str): the next token of the last page, None for the first
+        limit (int): the most prevouts on the page
+    Returns:
+        (dict): the prevouts, and the token for the next page
+    '''
+    return _find_page('', {}, after, limit)
+
+
+def page_all_unspents(
+        after: Optional[str] = None,
+        limit: int = PAGE_SIZE) -> PrevoutPage:
+    '''
+    Finds a page of unspent prevouts. See page_all
+    '''
+    return _find_page('AND p.spent_at = -2', {}, after, limit)
+
+
+def page_by_value_range(
+        lower_value: int,
+        upper_value: int,
+        unspents_only: bool = True,
+        after: Optional[str] = None,
+        limit: int = PAGE_SIZE) -> PrevoutPage:
+    '''
+    Finds a page of prevouts by value. See page_all
+    '''
+    return _find_page(
+        '''
+        AND p.value <= :upper_value
+        AND p.value >= :lower_value
+        AND p.spent_at {operator} -2
+        '''.format(operator=('=' if unspents_only else '>')),
+        {'upper_value': upper_value,
+         'lower_value': lower_value},
+        after, limit)
+
+
+def page_by_address(
+        address: str,
+        after: Optional[str] = None,
+        limit: int = PAGE_SIZE) -> PrevoutPage:
+    '''
+    Finds a page of prevouts by associated address. See page_all
+    '''
+    return _find_page(
+        '''
+        AND p.address_id = (SELECT id FROM addresses WHERE address = :address)
+        ''',
+        {'address': address},
+        after, limit)
+
+
+def iter_all(page_size: int = PAGE_SIZE) -> Iterator[Prevout]:
+    '''
+    As find_all, but reads a page at a time
+    Args:
+        page_size (int): prevouts read per query
+    Returns:
+        (iterator(Prevout)): the prevouts, in outpoint order
+    '''
+    return _iter_pages(page_all, page_size=page_size)
+
+
+def iter_all_unspents(page_size: int = PAGE_SIZE) -> Iterator[Prevout]:
+    '''
+    As find_all_unspents, but reads a page at a time. See iter_all
+    '''
+    return _iter_pages(page_all_unspents, page_size=page_size)
+
+
+def iter_by_value_range(
+        lower_value: int,
+        upper_value: int,
+        unspents_only: bool = True,
+        page_size: int = PAGE_SIZE) -> Iterator[Prevout]:
+    '''
+    As find_by_value_range, but reads a page at a time. See iter_all
+    '''
+    return _iter_pages(
+        page_by_value_range, lower_value, upper_value, unspents_only,
+        page_size=page_size)
+
+
+def iter_by_address(
+        address: str,
+        page_size: int = PAGE_SIZE) -> Iterator[Prevout]:
+    '''
+    As find_by_address, but reads a page at a time. See iter_all
+    '''
+    return _iter_pages(page_by_address, address, page_size=page_size)
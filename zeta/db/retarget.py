@@ -0,0 +1,91 @@
+from zeta import work
+from zeta.db import index
+
+from typing import Dict, Optional
+
+# NB: networks whose difficulty rules we check. Others (e.g. regtest) are
+#     not checked. Testnet allows min difficulty after 20 minutes
+MIN_DIFFICULTY_BLOCKS = {
+    'bitcoin_main': False,
+    'bitcoin_test': True
+}
+
+POW_LIMIT_BITS = work.target_to_nbits(work.POW_LIMIT)
+
+# NB: testnet headers inherit the last non-min difficulty nbits of their
+#     period. Caching it per node keeps lookups O(1) in long min-diff runs
+_LAST_BITS_CACHE_SIZE = 4096
+_LAST_BITS: Dict[bytes, Optional[bytes]] = {}
+
+
+def check_nbits(
+        nbits: bytes,
+        timestamp: int,
+        parent: index.Node,
+        network: Optional[str]) -> bool:
+    '''
+    Checks that a header uses the difficulty its position requires
+    Ancestors we don't have (e.g. before a checkpoint) can't be checked, so
+    those headers are given the benefit of the doubt. At a retarget without
+    the period's first header, we check the adjustment is within the limits
+    Args:
+        nbits     (bytes): the header's nbits
+        timestamp   (int): the header's timestamp
+        parent (index.Node): the header's parent
+        network     (str): the network name, e.g. bitcoin_main
+    Returns:
+        (bool): True if the nbits are valid, or can't be checked
+    '''
+    if network not in MIN_DIFFICULTY_BLOCKS or parent.bits is None:
+        return True
+    assert parent.time is not None
+    height = parent.height + 1
+
+    if height % work.RETARGET_INTERVAL != 0:
+        if not MIN_DIFFICULTY_BLOCKS[network]:
+            return nbits == parent.bits
+        if timestamp > parent.time + 2 * work.TARGET_SPACING:
+            return nbits == POW_LIMIT_BITS
+        last_bits = _last_non_min_bits(parent)
+        return last_bits is None or nbits == last_bits
+
+    first = parent.get_ancestor(height - work.RETARGET_INTERVAL)
+    if first is None or first.time is None:
+        target = work.make_target(nbits)
+        easiest = work.retarget(parent.bits, work.TARGET_TIMESPAN * 4)
+        hardest = work.retarget(parent.bits, work.TARGET_TIMESPAN // 4)
+        return (work.make_target(hardest)
+                <= target
+                <= work.make_target(easiest))
+    return nbits == work.retarget(parent.bits, parent.time - first.time)
+
+
+def _last_non_min_bits(node: index.Node) -> Optional[bytes]:
+    '''
+    Finds the nbits of the last header in the period that isn't using the
+    testnet min difficulty exception
+    Returns:
+        (bytes): the nbits, None if we don't have enough ancestors
+    '''
+    walked = []
+    walk: Optional[index.Node] = node
+    res: Optional[bytes] = None
+    while walk is not None:
+        if walk.hash in _LAST_BITS:
+            res = _LAST_BITS[walk.hash]
+            break
+        if (walk.height % work.RETARGET_INTERVAL == 0
+                or walk.bits != POW_LIMIT_BITS):
+            res = walk.bits
+            break
+        walked.append(walk.hash)
+        walk = walk.parent
+
+    # NB: missing ancestors may arrive later, so don't cache that
+    if res is None:
+        return None
+    if len(_LAST_BITS) + len(walked) > _LAST_BITS_CACHE_SIZE:
+        _LAST_BITS.clear()
+    for hash in walked:
+        _LAST_BITS[hash] = res
+    return res
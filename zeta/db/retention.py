@@ -0,0 +1,306 @@
+import os
+import sqlite3
+
+from zeta import work
+from zeta.db import cache, connection, index, mainchain, orphans, snapshot
+from zeta.db import timestamps
+
+from typing import Dict, List, Optional
+
+# NB: retention is off by default, and the full history is kept
+# stale fork headers this many blocks below the tip are deleted. 0 disables
+PRUNE_DEPTH = int(os.environ.get('ZETA_PRUNE_DEPTH', 0))
+
+# main chain headers this many blocks below the tip are moved from the DB
+# to an archive in snapshot format. 0 disables
+COMPACT_DEPTH = int(os.environ.get('ZETA_COMPACT_DEPTH', 0))
+ARCHIVE_PATH = os.environ.get('ZETA_ARCHIVE_PATH')
+
+# seconds between retention ticks
+PRUNE_INTERVAL = int(os.environ.get('ZETA_PRUNE_INTERVAL', 60))
+
+# max headers deleted or archived per tick, and pages freed by vacuum
+PRUNE_BATCH = int(os.environ.get('ZETA_PRUNE_BATCH', 500))
+VACUUM_PAGES = int(os.environ.get('ZETA_VACUUM_PAGES', 1000))
+
+# NB: retarget and median time past checks need this many ancestors
+MIN_COMPACT_DEPTH = work.RETARGET_INTERVAL + timestamps.MEDIAN_TIME_SPAN
+
+# heights checked for forks per tick. Most heights have 1 header
+SCAN_HEIGHTS = 20 * PRUNE_BATCH
+
+_CONN: Optional[sqlite3.Connection] = None
+_HEIGHT_CURSOR = 0  # next height to check for stale forks
+_FLOATING_CURSOR = b''  # last floating hash checked
+
+
+def _ensure(conn: sqlite3.Connection) -> None:
+    '''
+    Restarts the scans if the connection has been replaced
+    '''
+    global _CONN, _HEIGHT_CURSOR, _FLOATING_CURSOR
+    index.ensure(conn)
+    if conn is not _CONN:
+        _CONN = conn
+        _HEIGHT_CURSOR = 0
+        _FLOATING_CURSOR = b''
+
+
+def _main_tip() -> Optional[index.Node]:
+    heaviest = index.heaviest()
+    if len(heaviest) == 0:
+        return None
+    return index.get(heaviest[0])
+
+
+def _delete_headers(hashes: List[bytes]) -> None:
+    '''
+    Deletes headers from the DB, the index, and the caches
+    Args:
+        hashes (list(bytes)): big-endian header hashes
+    '''
+    if len(hashes) == 0:
+        return
+    heights = []
+    for hash in hashes:
+        node = index.get(hash)
+        if node is not None:
+            heights.append(node.height)
+
+    with connection.transaction() as c:
+        c.executemany(
+            '''
+            DELETE FROM headers
+            WHERE hash = ?
+            ''',
+            [(hash,) for hash in hashes])
+
+    cache.invalidate([hash.hex() for hash in hashes], heights)
+    for hash in hashes:
+        index.remove(hash)
+        orphans.discard(hash.hex())
+
+
+def prune_stale_forks(depth: int, limit: int = PRUNE_BATCH) -> int:
+    '''
+    Deletes headers that are off the main chain and at least depth blocks
+    below the tip. Picks up where the last call stopped, and wraps around
+    once it reaches the cutoff
+    Args:
+        depth (int): how far below the tip a fork must be
+        limit (int): roughly the most headers to delete
+    Returns:
+        (int): the number of headers deleted
+    '''
+    global _HEIGHT_CURSOR
+    _ensure(connection.CONN)
+    tip = _main_tip()
+    if tip is None or depth <= 0:
+        return 0
+
+    cutoff = tip.height - depth
+    if _HEIGHT_CURSOR < 1 or _HEIGHT_CURSOR >= cutoff:
+        _HEIGHT_CURSOR = max(index.lowest_height(), 1)
+
+    stale: List[bytes] = []
+    height = _HEIGHT_CURSOR
+    stop = min(height + SCAN_HEIGHTS, cutoff)
+    c = connection.get_cursor()
+    try:
+        while height < stop and len(stale) < limit:
+            main = (tip.get_ancestor(height)
+                    if index.count_at_height(height) > 1 else None)
+            # NB: if the main chain doesn't reach this height we can't tell
+            #     which header is stale, so we keep them all
+            if main is not None:
+                rows = c.execute(
+                    '''
+                    SELECT hash FROM headers
+                    WHERE height = :height
+                    ''',
+                    {'height': height})
+                stale.extend(r[0] for r in rows if r[0] != main.hash)
+            height += 1
+    finally:
+        c.close()
+    _HEIGHT_CURSOR = height
+
+    _delete_headers(stale)
+    return len(stale)
+
+
+def prune_floating(limit: int = PRUNE_BATCH) -> int:
+    '''
+    Deletes floating headers that aren't in the orphan pool
+    Writes delete what the pool evicts, but a restart with a smaller pool or
+    a failed write can leave some behind. They can never be connected
+    Args:
+        limit (int): the most floating headers to check
+    Returns:
+        (int): the number of headers deleted
+    '''
+    global _FLOATING_CURSOR
+    _ensure(connection.CONN)
+    # NB: until the pool is loaded we don't know what was evicted
+    if not orphans.active(connection.CONN):
+        return 0
+
+    c = connection.get_tuple_cursor()
+    try:
+        rows = c.execute(
+            '''
+            SELECT hash FROM headers
+            WHERE height = 0 AND hash > :after
+            ORDER BY hash
+            LIMIT :limit
+            ''',
+            {'after': _FLOATING_CURSOR, 'limit': limit}).fetchall()
+    finally:
+        c.close()
+    _FLOATING_CURSOR = rows[-1][0] if len(rows) == limit else b''
+
+    evicted = [r[0] for r in rows if not orphans.contains(r[0].hex())]
+    _delete_headers(evicted)
+    return len(evicted)
+
+
+def compact(
+        path: str,
+        network: str,
+        depth: int,
+        limit: int = PRUNE_BATCH) -> int:
+    '''
+    Moves the lowest main chain headers into an archive snapshot file, and
+    deletes them and any forks at their heights from the DB. The lowest
+    remaining header becomes a rolling checkpoint
+    Stops at least MIN_COMPACT_DEPTH below the tip
+    Args:
+        path    (str): the archive file, see zeta.db.snapshot
+        network (str): the network name, e.g. bitcoin_main
+        depth   (int): how far below the tip to keep headers
+        limit   (int): the most main chain headers to archive
+    Returns:
+        (int): the number of main chain headers archived
+    '''
+    _ensure(connection.CONN)
+    tip = _main_tip()
+    if tip is None:
+        return 0
+
+    lowest = index.lowest_height()
+    start = lowest
+    if os.path.exists(path):
+        _, snap_start, count, _, _ = snapshot.read_trailer(path)
+        start = max(snap_start + count, lowest)
+    stop = min(start + limit, tip.height - max(depth, MIN_COMPACT_DEPTH))
+
+    # walk down from the new checkpoint's parent
+    nodes: List[index.Node] = []
+    node = tip.get_ancestor(stop - 1) if stop > start else None
+    while node is not None and node.height >= start:
+        nodes.append(node)
+        node = node.parent
+    nodes.reverse()
+    if len(nodes) == 0 or nodes[0].height != start:
+        return 0
+
+    c = connection.get_cursor()
+    try:
+        raw_headers = [
+            c.execute(
+                '''
+                SELECT header FROM headers
+                WHERE hash = :hash
+                ''',
+                {'hash': n.hash}).fetchone()[0]
+            for n in nodes]
+        snapshot.append_snapshot(
+            path, network, raw_headers,
+            start_height=start,
+            start_work=nodes[0].work,
+            tip_work=nodes[-1].work)
+
+        # NB: from lowest, to clear anything left by an interrupted compact
+        rows = c.execute(
+            '''
+            SELECT hash FROM headers
+            WHERE height >= :lowest AND height < :stop
+            ''',
+            {'lowest': max(lowest, 1), 'stop': stop}).fetchall()
+    finally:
+        c.close()
+
+    _delete_headers([r[0] for r in rows])
+    mainchain.prune(stop)
+    return len(nodes)
+
+
+def _pragma(name: str) -> int:
+    c = connection.get_tuple_cursor()
+    try:
+        return c.execute('PRAGMA {}'.format(name)).fetchone()[0]
+    finally:
+        c.close()
+
+
+def vacuum(pages: int = VACUUM_PAGES) -> int:
+    '''
+    Returns free pages to the filesystem, in the current transaction
+    Does nothing if the DB can't vacuum incrementally. See full_vacuum
+    Args:
+        pages (int): the most pages to free
+    Returns:
+        (int): the number of pages freed
+    '''
+    # NB: 2 is INCREMENTAL
+    if _pragma('auto_vacuum') != 2:
+        return 0
+    before = _pragma('freelist_count')
+    # NB: execute steps this PRAGMA once, freeing 1 page. executescript would
+    #     run it to completion, but commits behind connection.commit's back
+    with connection.transaction() as c:
+        for _ in range(min(pages, before)):
+            c.execute('PRAGMA incremental_vacuum(1)')
+    return before - _pragma('freelist_count')
+
+
+def full_vacuum() -> int:
+    '''
+    Rebuilds the DB file and switches it to incremental vacuum
+    DBs created before retention existed need this once. It rewrites the
+    whole file and blocks the DB thread while it runs, so step never calls
+    it. Run it during maintenance, with the node stopped
+    Returns:
+        (int): the number of pages freed
+    '''
+    before = _pragma('freelist_count')
+    # NB: VACUUM can't run in a transaction. Commit pending writes first
+    connection.flush()
+    c = connection.get_cursor()
+    try:
+        c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        c.execute('VACUUM')
+    finally:
+        c.close()
+    return before - _pragma('freelist_count')
+
+
+def step(network: str) -> Dict[str, int]:
+    '''
+    Does one bounded round of retention work, as configured by the
+    ZETA_PRUNE_* and ZETA_COMPACT_* environment variables
+    Args:
+        network (str): the network name, e.g. bitcoin_main
+    Returns:
+        (dict): how many stale, floating, and archived headers were removed,
+                and how many pages were vacuumed
+    '''
+    res = {'stale': 0, 'floating': 0, 'archived': 0, 'vacuumed': 0}
+    if PRUNE_DEPTH > 0:
+        res['stale'] = prune_stale_forks(PRUNE_DEPTH)
+        res['floating'] = prune_floating()
+    if COMPACT_DEPTH > 0 and ARCHIVE_PATH is not None:
+        res['archived'] = compact(ARCHIVE_PATH, network, COMPACT_DEPTH)
+    if PRUNE_DEPTH > 0 or COMPACT_DEPTH > 0:
+        res['vacuumed'] = vacuum()
+    return res
@@ -0,0 +1,348 @@
+import os
+import struct
+import hashlib
+
+from zeta import work
+from zeta.db import cache, connection, flatfile, index
+
+from zeta.zeta_types import Header
+from typing import List, Optional, Tuple
+
+# NB: A snapshot is a run of raw 80 byte main chain headers, in height order,
+#     followed by a fixed-size trailer:
+#         magic          8 bytes  b'ZETASNAP'
+#         version        4 bytes  uint32 LE
+#         network       16 bytes  ascii, NUL padded
+#         start_height   8 bytes  uint64 LE, height of the first header
+#         count          8 bytes  uint64 LE, number of headers
+#         start_work    32 bytes  accumulated work of the first header, BE
+#         tip_work      32 bytes  accumulated work of the last header, BE
+MAGIC = b'ZETASNAP'
+VERSION = 1
+TRAILER = struct.Struct('<8sI16sQQ32s32s')
+
+
+def _pack_trailer(
+        network: str,
+        start_height: int,
+        count: int,
+        start_work: int,
+        tip_work: int) -> bytes:
+    return TRAILER.pack(
+        MAGIC,
+        VERSION,
+        network.encode('ascii'),
+        start_height,
+        count,
+        start_work.to_bytes(32, 'big'),
+        tip_work.to_bytes(32, 'big'))
+
+
+def read_trailer(path: str) -> Tuple[str, int, int, int, int]:
+    '''
+    Reads a snapshot's trailer
+    Args:
+        path (str): the snapshot file
+    Returns:
+        (str, int, int, int, int): network, start height, count,
+                                   start work, tip work
+    '''
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < TRAILER.size:
+            raise ValueError('Invalid snapshot: too short')
+        f.seek(size - TRAILER.size)
+        (magic, version, network, start_height, count,
+         start_work, tip_work) = TRAILER.unpack(f.read(TRAILER.size))
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Invalid snapshot: unknown format')
+    if size != count * 80 + TRAILER.size:
+        raise ValueError('Invalid snapshot: length does not match count')
+    return (network.rstrip(b'\x00').decode('ascii'),
+            start_height,
+            count,
+            int.from_bytes(start_work, 'big'),
+            int.from_bytes(tip_work, 'big'))
+
+
+def _main_chain(tip: bytes) -> List[index.Node]:
+    '''
+    Walks back from a tip to the first known connected ancestor
+    Returns:
+        (list(index.Node)): the chain, lowest first
+    '''
+    chain: List[index.Node] = []
+    node = index.get(tip)
+    while node is not None and node.height != 0:
+        chain.append(node)
+        node = node.parent
+    return chain[::-1]
+
+
+def export_snapshot(
+        path: str,
+        network: str,
+        tip: Optional[str] = None) -> int:
+    '''
+    Writes the main chain to a snapshot file
+    Args:
+        path    (str): the snapshot file to write
+        network (str): the network name, e.g. bitcoin_main
+        tip     (str): 0000-first hash of the tip. defaults to heaviest
+    Returns:
+        (int): the number of headers written
+    '''
+    index.ensure(connection.CONN)
+    if tip is None:
+        heaviest = index.heaviest()
+        if len(heaviest) == 0:
+            raise ValueError('No headers to export')
+        tip_key = heaviest[0]
+    else:
+        tip_key = bytes.fromhex(tip)
+
+    chain = _main_chain(tip_key)
+    if len(chain) == 0:
+        raise ValueError('No connected headers to export')
+
+    # NB: write to a temp file so a crash never leaves a partial snapshot
+    tmp_path = path + '.tmp'
+    c = connection.get_cursor()
+    try:
+        with open(tmp_path, 'wb') as f:
+            for node in chain:
+                row = c.execute(
+                    '''
+                    SELECT header FROM headers
+                    WHERE hash = :hash
+                    ''',
+                    {'hash': node.hash}).fetchone()
+                f.write(row[0])
+            f.write(_pack_trailer(
+                network=network,
+                start_height=chain[0].height,
+                count=len(chain),
+                start_work=chain[0].work,
+                tip_work=chain[-1].work))
+        os.replace(tmp_path, path)
+    finally:
+        c.close()
+    return len(chain)
+
+
+def append_snapshot(
+        path: str,
+        network: str,
+        raw_headers: List[bytes],
+        start_height: int,
+        start_work: int,
+        tip_work: int) -> int:
+    '''
+    Appends main chain headers to a snapshot file, creating it if needed
+    The headers must continue the snapshot's chain
+    Args:
+        path          (str): the snapshot file
+        network       (str): the network name, e.g. bitcoin_main
+        raw_headers (list(bytes)): 80 byte headers, lowest first
+        start_height  (int): height of the first new header
+        start_work    (int): accumulated work of the first new header
+        tip_work      (int): accumulated work of the last new header
+    Returns:
+        (int): the number of headers in the snapshot
+    '''
+    if not os.path.exists(path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(raw_headers))
+            f.write(_pack_trailer(
+                network=network,
+                start_height=start_height,
+                count=len(raw_headers),
+                start_work=start_work,
+                tip_work=tip_work))
+        os.replace(tmp_path, path)
+        return len(raw_headers)
+
+    (snap_network, snap_start, count,
+     snap_start_work, _) = read_trailer(path)
+    if snap_network != network:
+        raise ValueError('Invalid snapshot: network is {}'.format(
+            snap_network))
+    if snap_start + count != start_height:
+        raise ValueError('Invalid snapshot: does not end at height {}'.format(
+            start_height - 1))
+
+    # NB: the new headers overwrite the old trailer. A crash mid-write leaves
+    #     a file that fails read_trailer, but callers only delete the
+    #     headers from the DB after this returns
+    with open(path, 'r+b') as f:
+        f.seek((count - 1) * 80)
+        last = f.read(80)
+        sha256 = hashlib.sha256
+        if raw_headers[0][4:36] != sha256(sha256(last).digest()).digest():
+            raise ValueError(
+                'Invalid snapshot: broken link at height {}'.format(
+                    start_height))
+        f.write(b''.join(raw_headers))
+        f.write(_pack_trailer(
+            network=network,
+            start_height=snap_start,
+            count=count + len(raw_headers),
+            start_work=snap_start_work,
+            tip_work=tip_work))
+    return count + len(raw_headers)
+
+
+def read_tip(path: str) -> Tuple[int, str]:
+    '''
+    Reads the last header of a snapshot
+    Args:
+        path (str): the snapshot file
+    Returns:
+        (int, str): height and 0000-first hash of the snapshot's tip
+    '''
+    _, start_height, count, _, _ = read_trailer(path)
+    if count == 0:
+        raise ValueError('Invalid snapshot: no headers')
+    with open(path, 'rb') as f:
+        f.seek((count - 1) * 80)
+        raw = f.read(80)
+    sha256 = hashlib.sha256
+    return (start_height + count - 1,
+            sha256(sha256(raw).digest()).digest()[::-1].hex())
+
+
+def is_loaded(path: str) -> bool:
+    '''
+    Checks whether the DB already holds a snapshot
+    It does if the snapshot's tip is stored, or if compact has pruned the DB
+    past the tip
+    Args:
+        path (str): the snapshot file
+    Returns:
+        (bool): True if importing the snapshot would add nothing
+    '''
+    height, tip = read_tip(path)
+    index.ensure(connection.CONN)
+    node = index.get(bytes.fromhex(tip))
+    if node is not None and node.height == height:
+        return True
+    return index.lowest_height() > height
+
+
+def _start_work(
+        raw: bytes,
+        start_height: int,
+        checkpoint: Optional[Header]) -> int:
+    '''
+    Finds the accumulated work of a snapshot's first header from headers we
+    already trust. It must be stored, be the checkpoint, or extend a stored
+    header
+    Args:
+        raw           (bytes): the first 80 byte header
+        start_height    (int): its height according to the trailer
+        checkpoint     (dict): a trusted header, or None
+    Returns:
+        (int): the accumulated work of the first header
+    '''
+    sha256 = hashlib.sha256
+    hash_be = sha256(sha256(raw).digest()).digest()[::-1]
+
+    # NB: height 0 is a floating header, so it can't anchor anything
+    node = index.get(hash_be)
+    if node is not None and node.height == start_height != 0:
+        return node.work
+    if (checkpoint is not None
+            and checkpoint['hash'] == hash_be.hex()
+            and checkpoint['height'] == start_height):
+        return checkpoint['accumulated_work']
+    parent = index.get(raw[4:36][::-1])
+    if parent is not None and parent.height == start_height - 1 != 0:
+        return parent.work + work.work_from_nbits(raw[72:76])
+    raise ValueError('Invalid snapshot: parent of height {} is unknown'.format(
+        start_height))
+
+
+def import_snapshot(
+        path: str,
+        network: str,
+        checkpoint: Optional[Header] = None) -> int:
+    '''
+    Bulk loads a snapshot file into the DB
+    Verifies linkage, each header's PoW, and the total chainwork before
+    writing anything. The first header must be stored already, be the
+    checkpoint, or extend a stored header. Its work comes from there, never
+    from the trailer
+    Args:
+        path        (str): the snapshot file to read
+        network     (str): the network we expect the snapshot to be for
+        checkpoint (dict): if the snapshot covers its height, must match
+    Returns:
+        (int): the height of the last header loaded
+    '''
+    (snap_network, start_height, count,
+     start_work, tip_work) = read_trailer(path)
+    if snap_network != network:
+        raise ValueError('Invalid snapshot: network is {}'.format(
+            snap_network))
+
+    if count == 0:
+        raise ValueError('Invalid snapshot: no headers')
+
+    with open(path, 'rb') as f:
+        blob = f.read(count * 80)
+
+    index.ensure(connection.CONN)
+    if _start_work(blob[:80], start_height, checkpoint) != start_work:
+        raise ValueError('Invalid snapshot: chainwork does not match')
+
+    rows: List[Tuple[bytes, bytes, int, bytes]] = []
+    view = memoryview(blob)
+    sha256 = hashlib.sha256
+    prev_hash: Optional[bytes] = None
+    acc = start_work
+    for i in range(count):
+        raw = view[i * 80:(i + 1) * 80]
+        hash_le = sha256(sha256(raw).digest()).digest()
+
+        if prev_hash is not None:
+            if raw[4:36] != prev_hash:
+                raise ValueError(
+                    'Invalid snapshot: broken link at height {}'.format(
+                        start_height + i))
+            acc += work.work_from_nbits(bytes(raw[72:76]))
+        if int.from_bytes(hash_le, 'little') > work.make_target(
+                bytes(raw[72:76])):
+            raise ValueError(
+                'Invalid snapshot: insufficient work at height {}'.format(
+                    start_height + i))
+        prev_hash = hash_le
+        rows.append((hash_le[::-1], bytes(raw), start_height + i,
+                     acc.to_bytes(32, 'big')))
+
+    if acc != tip_work:
+        raise ValueError('Invalid snapshot: chainwork does not match')
+
+    if checkpoint is not None:
+        offset = checkpoint['height'] - start_height
+        if 0 <= offset < count and rows[offset][0].hex() != checkpoint['hash']:
+            raise ValueError('Invalid snapshot: does not match checkpoint')
+
+    with connection.transaction() as c:
+        c.executemany(
+            '''
+            INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?)
+            ''',
+            rows)
+    cache.clear()
+
+    for row in rows:
+        index.add(row[0], row[1][4:36][::-1], row[2],
+                  int.from_bytes(row[3], 'big'), row[1][72:76],
+                  int.from_bytes(row[1][68:72], 'little'))
+    if flatfile.active(connection.CONN):
+        flatfile.sync({row[0]: row[1] for row in rows})
+
+    return start_height + count - 1
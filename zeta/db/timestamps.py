@@ -0,0 +1,110 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from zeta.db import index
+
+from typing import List, Optional, Tuple
+
+# NB: Bitcoin's timestamp rules. A header's timestamp must be later than
+#     the median of the previous 11, and at most 2 hours in the future
+MEDIAN_TIME_SPAN = 11
+MAX_FUTURE_BLOCK_TIME = 2 * 60 * 60
+
+# NB: windows are cached by hash, so extending a tip reuses its parent's
+#     window instead of walking back 11 headers. Read pool threads check
+#     timestamps too, so the cache is locked
+_WINDOWS_CACHE_SIZE = 4096
+_WINDOWS: 'OrderedDict[bytes, Tuple[int, ...]]' = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def _cached_window(hash: bytes) -> Optional[Tuple[int, ...]]:
+    '''
+    Looks up a cached window, marking it as recently used
+    '''
+    with _LOCK:
+        window = _WINDOWS.get(hash)
+        if window is not None:
+            _WINDOWS.move_to_end(hash)
+        return window
+
+
+def time_window(node: index.Node) -> Tuple[int, ...]:
+    '''
+    Collects the timestamps of a header and up to 10 of its ancestors
+    Args:
+        node (index.Node): the header
+    Returns:
+        (tuple(int)): the timestamps, oldest first. Shorter than 11 if we
+                      don't know enough ancestors
+    '''
+    cached = _cached_window(node.hash)
+    if cached is not None:
+        return cached
+
+    window: Tuple[int, ...] = ()
+    parent_window = (_cached_window(node.parent.hash)
+                     if node.parent is not None else None)
+    if parent_window is not None and node.time is not None:
+        window = parent_window[1:] + (node.time,)
+    else:
+        times: List[int] = []
+        walk: Optional[index.Node] = node
+        while (walk is not None
+                and walk.time is not None
+                and len(times) < MEDIAN_TIME_SPAN):
+            times.append(walk.time)
+            walk = walk.parent
+        window = tuple(times[::-1])
+
+    # NB: only full windows are cached. Missing ancestors may arrive later
+    if len(window) == MEDIAN_TIME_SPAN:
+        with _LOCK:
+            _WINDOWS[node.hash] = window
+            _WINDOWS.move_to_end(node.hash)
+            while len(_WINDOWS) > _WINDOWS_CACHE_SIZE:
+                _WINDOWS.popitem(last=False)
+    return window
+
+
+def median_time_past(node: index.Node) -> Optional[int]:
+    '''
+    Calculates the median time past of a header, as in BIP113
+    Args:
+        node (index.Node): the header
+    Returns:
+        (int): the median of its and up to 10 ancestors' timestamps,
+               None if we don't know its timestamp
+    '''
+    window = time_window(node)
+    if len(window) == 0:
+        return None
+    return sorted(window)[len(window) // 2]
+
+
+def check_timestamp(
+        timestamp: int,
+        parent: index.Node,
+        now: Optional[int] = None) -> bool:
+    '''
+    Checks a new header's timestamp against its parent's median time past
+    and the current time
+    The median is only checked if we know all 11 ancestors
+    Args:
+        timestamp   (int): the new header's timestamp
+        parent (index.Node): the new header's parent
+        now         (int): the current time. defaults to the system clock
+    Returns:
+        (bool): True if the timestamp is valid, or can't be checked
+    '''
+    if now is None:
+        now = int(time.time())
+    if timestamp > now + MAX_FUTURE_BLOCK_TIME:
+        return False
+
+    window = time_window(parent)
+    if len(window) < MEDIAN_TIME_SPAN:
+        return True
+    return timestamp > sorted(window)[MEDIAN_TIME_SPAN // 2]
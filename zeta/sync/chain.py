@@ -1,10 +1,41 @@
+import os
+import time
+import sqlite3
 import asyncio
+import multiprocessing
+
+from concurrent.futures import Executor, ProcessPoolExecutor
 
 from zeta import electrum
-from zeta.db import checkpoint, headers
+from zeta.db import arrays, checkpoint, connection, headers, index
+from zeta.db import mainchain, retention, snapshot
+from zeta.db.aio import runner
+from zeta.db.aio import headers as aio_headers
+
+from zeta.zeta_types import Header, ReorgEvent
+from typing import cast, Dict, List, Optional, Union
+
+# NB: electrum servers return at most 2016 headers per request
+CHUNK_SIZE = 2016
+
+# how many chunk requests catch up keeps in flight at once
+CATCH_UP_WINDOW = int(os.environ.get('ZETA_CATCH_UP_WINDOW', 4))
+
+# seconds before catch up starts again after a chunk it couldn't store
+CATCH_UP_RETRY = int(os.environ.get('ZETA_CATCH_UP_RETRY', 60))
+
+# seconds between catch up progress lines
+PROGRESS_INTERVAL = int(os.environ.get('ZETA_PROGRESS_INTERVAL', 10))
 
-from zeta.zeta_types import Header
-from typing import cast, List, Optional, Union
+# batches at least this large are parsed in a process pool
+# set ZETA_PARSE_WORKERS to 0 to always parse on the event loop
+PARSE_POOL_THRESHOLD = int(os.environ.get('ZETA_PARSE_POOL_THRESHOLD', 500))
+PARSE_WORKERS = int(os.environ.get('ZETA_PARSE_WORKERS', os.cpu_count() or 1))
+
+_PARSE_POOL: Optional[Executor] = None
+
+# a header snapshot to bulk load at startup, see zeta.db.snapshot
+SNAPSHOT_PATH = os.environ.get('ZETA_SNAPSHOT_PATH')
 
 
 async def sync(
@@ -14,28 +45,48 @@ async def sync(
     Starts all header tracking processes
     1. subscribe to headers feed (track chain tip)
     2. catch up to the servers' view of the chain tip
-    3. clean up any headers that didn't fit a chain when we found them
+    3. prune old headers, if retention is configured
     4. print status updates
+    Headers that don't fit a chain yet wait in the orphan pool, and are
+    connected as soon as their parent is stored
     '''
-    last_known_height = _initial_setup(network)
+    last_known_height = await runner.run(_initial_setup, network)
     # NB: assume there hasn't been a 10 block reorg
     asyncio.ensure_future(_track_chain_tip(outq))
-    asyncio.ensure_future(_catch_up(last_known_height))
-    asyncio.ensure_future(_maintain_db())
+    asyncio.ensure_future(_catch_up(last_known_height, outq=outq))
+    asyncio.ensure_future(_maintain_db(network))
     # asyncio.ensure_future(_status_updater())
 
 
-def _initial_setup(network: str) -> int:
+def _initial_setup(
+        network: str,
+        snapshot_path: Optional[str] = None) -> int:
     '''
     Ensures the database directory exists, and tables exist
-    Then set the highest checkpoint, and return its height
+    Then set the highest checkpoint
+    If a snapshot file is available and not yet loaded, bulk load it
+    Return the highest known height
     '''
     # Get the highest checkpoint
     latest_checkpoint = max(
         checkpoint.CHECKPOINTS[network],
         key=lambda k: k['height'])
-    headers.store_header(latest_checkpoint)
 
+    # NB: once compact has pruned past the checkpoint, storing it again would
+    #     bring back a header it deleted
+    index.ensure(connection.CONN)
+    if index.lowest_height() <= latest_checkpoint['height']:
+        headers.store_header(latest_checkpoint)
+
+    path = snapshot_path if snapshot_path is not None else SNAPSHOT_PATH
+    if path is not None and os.path.exists(path):
+        try:
+            if not snapshot.is_loaded(path):
+                snapshot.import_snapshot(path, network, latest_checkpoint)
+        except (ValueError, OSError) as e:
+            print('snapshot not loaded: {}'.format(e))
+
+    _update_main_chain()
     return cast(int, headers.find_highest()[0]['height'])
 
 
@@ -49,6 +100,26 @@ async def _track_chain_tip(
     asyncio.ensure_future(_header_queue_handler(q, outq))
 
 
+async def _maintain_db(network: str) -> None:
+    '''
+    Runs bounded rounds of header retention work between other tasks
+    See zeta.db.retention
+    Args:
+        network (str): the network name, e.g. bitcoin_main
+    '''
+    if retention.PRUNE_DEPTH <= 0 and retention.COMPACT_DEPTH <= 0:
+        return
+    while True:
+        await asyncio.sleep(retention.PRUNE_INTERVAL)
+        try:
+            res = await runner.run(retention.step, network)
+        except (sqlite3.Error, ValueError, OSError) as e:
+            print('retention: {}'.format(e))
+            continue
+        if any(res.values()):
+            print('retention: {}'.format(res))
+
+
 async def _header_queue_handler(
         inq: asyncio.Queue,
         outq: Optional[asyncio.Queue] = None) -> None:
@@ -67,54 +138,339 @@ async def _header_queue_handler(
         except Exception:
             header_dict = header
 
-        headers.store_header(header_dict['hex'])
+        await aio_headers.store_header(header_dict['hex'])
+        await _emit_reorg(outq)
 
         if outq is not None:
             await outq.put(header_dict)
 
 
-async def _catch_up(from_height: int) -> None:
+def _update_main_chain() -> Optional[ReorgEvent]:
+    '''
+    Moves the main chain table to the heaviest known tip
+    Only visits headers between the two tips and their fork point
+    Returns:
+        (dict): a reorg event if headers were disconnected, otherwise None
+    '''
+    index.ensure(connection.CONN)
+    tips = index.heaviest()
+    if len(tips) == 0:
+        return None
+
+    old = mainchain.find_tip()
+    old_node = index.get(old[1]) if old is not None else None
+
+    # NB: on a tie, stay on the chain we already have
+    new_tip = old[1] if old is not None and old[1] in tips else tips[0]
+    new_node = index.get(new_tip)
+    if new_node is None or new_node.height == 0 or new_node is old_node:
+        return None
+
+    fork = _find_fork(old_node, new_node)
+    connected = _path_from(new_node, fork)
+    if fork is None:
+        # NB: first run, or the old tip is gone. Record the whole chain
+        mainchain.update(-1, [(n.height, n.hash) for n in connected])
+        return None
+
+    assert old_node is not None
+    disconnected = _path_from(old_node, fork)
+    mainchain.update(fork.height, [(n.height, n.hash) for n in connected])
+    if len(disconnected) == 0:
+        return None
+    return ReorgEvent(
+        type='reorg',
+        fork_height=fork.height,
+        fork_hash=fork.hash.hex(),
+        disconnected=[n.hash.hex() for n in disconnected[::-1]],
+        connected=[n.hash.hex() for n in connected])
+
+
+def _find_fork(
+        a: Optional[index.Node],
+        b: Optional[index.Node]) -> Optional[index.Node]:
+    '''
+    Finds the last common ancestor of two index nodes
+    Returns:
+        (index.Node): the fork point, None if they share no known ancestor
+    '''
+    if a is None or b is None:
+        return None
+    height = min(a.height, b.height)
+    a = a.get_ancestor(height)
+    b = b.get_ancestor(height)
+    while a is not None and b is not None and a is not b:
+        a = a.parent
+        b = b.parent
+    return a if a is b else None
+
+
+def _path_from(
+        node: Optional[index.Node],
+        stop: Optional[index.Node]) -> List[index.Node]:
+    '''
+    Collects the nodes from stop (exclusive) up to node, lowest first
+    If stop is None, collects back to the first known ancestor
+    '''
+    path: List[index.Node] = []
+    while node is not None and node is not stop:
+        path.append(node)
+        node = node.parent
+    return path[::-1]
+
+
+async def _emit_reorg(outq: Optional[asyncio.Queue] = None) -> None:
+    '''
+    Updates the main chain, and reports any reorg on the queue
+    '''
+    event = await runner.run(_update_main_chain)
+    if event is not None and outq is not None:
+        await outq.put(event)
+
+
+async def _catch_up(
+        from_height: int,
+        window: int = CATCH_UP_WINDOW,
+        outq: Optional[asyncio.Queue] = None) -> int:
     '''
     Catches the chain tip up to latest by batch requesting headers
-    Schedules itself at a new from_height if not complete yet
-    Increments by 2014 to pad against the possibility of multiple off-by-ones
+    Keeps up to `window` chunk requests in flight. The MetaClient spreads
+    them across its connections. Chunks are stored in height order, and
+    only if they link to the previous chunk
+    If a chunk fails twice, stops and starts again from there later
     Args:
         from_height (int): height we currently have, and want to start from
+        window      (int): max number of concurrent chunk requests
+        outq (asyncio.Queue): optional queue for reorg events
+    Returns:
+        (int): the height after the last chunk we stored
     '''
-    electrum_response = await electrum.get_headers(from_height, 2016)
+    fetches: Dict[int, asyncio.Future] = {}
+    next_fetch = from_height
+    height = from_height
+    last_hash: Optional[str] = None
+    progress = _CatchUpProgress(from_height)
+    at_tip = False
+
+    try:
+        while True:
+            # keep the window full until a chunk comes back short
+            while not at_tip and len(fetches) < window:
+                fetches[next_fetch] = asyncio.ensure_future(
+                    electrum.get_headers(next_fetch, CHUNK_SIZE))
+                next_fetch += CHUNK_SIZE
 
-    # NB: we requested 2016. If we got back 2016, it's likely there are more
-    if electrum_response['count'] == 2016:
-        asyncio.ensure_future(_catch_up(from_height + 2014))
-    _process_header_batch(electrum_response['hex'])
+            if height not in fetches:
+                return height
 
+            # NB: wait for chunks in order. Later ones may already be done
+            batch = await _fetch_linked_chunk(fetches.pop(height), last_hash)
+            if batch is None:
+                batch = await _fetch_linked_chunk(
+                    electrum.get_headers(height, CHUNK_SIZE), last_hash)
+            if batch is None:
+                # NB: we retried once. Try again later, maybe from another
+                #     server, so tip headers don't pile up as orphans
+                print('catch up: bad chunk at height {}, retrying in {}s'
+                      .format(height, CATCH_UP_RETRY))
+                _resume_catch_up(height, window, outq)
+                return height
 
-async def _maintain_db() -> None:
+            # NB: we requested 2016. If we got back less, we're at the tip
+            if len(batch) < CHUNK_SIZE:
+                at_tip = True
+
+            if len(batch) != 0 and not await _store_chunk(batch):
+                # NB: a rejected header or a DB error. Retry once, like a
+                #     bad chunk, so the next chunk never links to a hash
+                #     we didn't store
+                batch = await _fetch_linked_chunk(
+                    electrum.get_headers(height, CHUNK_SIZE), last_hash)
+                if batch is None or not await _store_chunk(batch):
+                    print('catch up: could not store chunk at height {}, '
+                          'retrying in {}s'.format(height, CATCH_UP_RETRY))
+                    _resume_catch_up(height, window, outq)
+                    return height
+
+            if len(batch) != 0:
+                await _emit_reorg(outq)
+                last_hash = batch[-1]['hash']
+                height += len(batch)
+                if at_tip or progress.due():
+                    print(progress.update(
+                        height - 1, batch[-1]['timestamp']))
+    finally:
+        for fut in fetches.values():
+            fut.cancel()
+
+
+def _resume_catch_up(
+        height: int,
+        window: int,
+        outq: Optional[asyncio.Queue]) -> None:
     '''
-    Loop that checks the DB for headers at height 0
-    Restoring them attempts to connect them to another known header
+    Starts catch up again from a height after CATCH_UP_RETRY seconds
     '''
-    while True:
-        await asyncio.sleep(60)
+    loop = asyncio.get_running_loop()
+    loop.call_later(
+        CATCH_UP_RETRY,
+        lambda: asyncio.ensure_future(_catch_up(height, window, outq)))
 
-        # NB: 0 means no known parent
-        floating = headers.find_by_height(0)
 
-        # NB: this will attempt to find their parent and fill in height/accdiff
-        for header in floating:
-            headers.store_header(header)
+async def _store_chunk(batch: List[Header]) -> bool:
+    '''
+    Stores a chunk of headers on the DB thread
+    Returns:
+        (bool): True if every header was stored
+    '''
+    return await aio_headers.batch_store_header(
+        cast(List[Union[Header, str]], batch))
 
 
-def _process_header_batch(electrum_hex: str) -> None:
+async def _fetch_linked_chunk(
+        fetch,
+        prev_hash: Optional[str]) -> Optional[List[Header]]:
     '''
-    Processes a batch of headers and sends to the DB for storage
+    Waits for a chunk request and checks that its headers form a chain
+    Args:
+        fetch     (awaitable): the electrum get_headers request
+        prev_hash       (str): the hash the chunk should build on, if known
+    Returns:
+        (list(Header)): the parsed headers, or None if invalid
+    '''
+    try:
+        response = await fetch
+        batch = await _parse_header_chunk_async(response['hex'])
+    except Exception:
+        return None
+    if not _check_linkage(batch, prev_hash):
+        return None
+    return batch
+
+
+def _parse_header_chunk(electrum_hex: str) -> List[Header]:
+    '''
+    Parses the concatenated headers in an electrum getheaders response
+    Args:
+        electrum_hex (str): The 'hex' attribute of electrum's getheaders res
+    Returns:
+        (list(Header)): the parsed headers
+    '''
+    return _parse_blob(bytes.fromhex(electrum_hex))
+
+
+def _parse_blob(blob: bytes) -> List[Header]:
+    '''
+    Parses concatenated headers, vectorized if numpy is installed
+    This is a top-level function so it can run in a process pool
+    '''
+    if arrays.np is not None:
+        return arrays.parse_header_blob(blob)
+    return headers.parse_header_blob(blob)
+
+
+def _get_parse_pool() -> Optional[Executor]:
+    '''
+    Gets the process pool for header parsing, creating it if necessary
+    Returns:
+        (Executor): the pool, or None if disabled
+    '''
+    global _PARSE_POOL
+    if PARSE_WORKERS <= 0:
+        return None
+    if _PARSE_POOL is None:
+        # NB: by now the DB and read pool threads are running. A forked
+        #     child would inherit their SQLite locks mid-use, so workers
+        #     start from a fresh interpreter instead
+        methods = multiprocessing.get_all_start_methods()
+        _PARSE_POOL = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context(
+                'forkserver' if 'forkserver' in methods else 'spawn'))
+    return _PARSE_POOL
+
+
+async def _parse_header_chunk_async(electrum_hex: str) -> List[Header]:
+    '''
+    Parses the concatenated headers in an electrum getheaders response
+    Hashing is the expensive part. Large batches are split across a
+    process pool so the event loop stays responsive. Small batches are
+    parsed inline, where the pool overhead would dominate
     Args:
         electrum_hex (str): The 'hex' attribute of electrum's getheaders res
+    Returns:
+        (list(Header)): the parsed headers
     '''
     blob = bytes.fromhex(electrum_hex)
+    count = len(blob) // 80
+    pool = _get_parse_pool()
+    if pool is None or count < PARSE_POOL_THRESHOLD:
+        return _parse_blob(blob)
 
-    # NB: this comes as a single hex string with all headers concatenated
-    header_list: List[Union[Header, str]]
-    header_list = [blob[i:i + 80].hex() for i in range(0, len(blob), 80)]
+    # NB: one slice per worker, on 80 byte boundaries
+    per_slice = -(-count // PARSE_WORKERS) * 80
+    loop = asyncio.get_event_loop()
+    parsed = await asyncio.gather(*[
+        loop.run_in_executor(
+            pool, _parse_blob, blob[i:i + per_slice])
+        for i in range(0, len(blob), per_slice)])
+    return [h for batch in parsed for h in batch]
+
+
+def _check_linkage(batch: List[Header], prev_hash: Optional[str]) -> bool:
+    '''
+    Checks that each header builds on the previous one
+    Args:
+        batch (list(Header)): the parsed headers
+        prev_hash      (str): the hash the first header should build on
+    Returns:
+        (bool): True if linked
+    '''
+    for header in batch:
+        if prev_hash is not None and header['prev_block'] != prev_hash:
+            return False
+        prev_hash = header['hash']
+    return True
+
+
+class _CatchUpProgress():
+    '''
+    Tracks catch up speed, and estimates time to the tip
+    The tip height is estimated from the latest timestamp, at 1 block
+    every 10 minutes
+    '''
 
-    headers.batch_store_header(header_list)
+    def __init__(self, start_height: int):
+        self.start_height = start_height
+        self.start_time = time.monotonic()
+        self.last_report = self.start_time
+
+    def due(self) -> bool:
+        '''
+        Returns:
+            (bool): True at most once every PROGRESS_INTERVAL seconds
+        '''
+        now = time.monotonic()
+        if now - self.last_report < PROGRESS_INTERVAL:
+            return False
+        self.last_report = now
+        return True
+
+    def update(self, height: int, timestamp: int) -> str:
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        rate = (height - self.start_height) / elapsed
+        remaining = max(int(time.time()) - timestamp, 0) // 600
+        eta = '{:.0f}s'.format(remaining / rate) if rate > 0 else 'unknown'
+        return 'catch up: height {} ({:.0f} heights/sec, ETA {})'.format(
+            height, rate, eta)
+
+
+def _process_header_batch(electrum_hex: str) -> None:
+    '''
+    Processes a batch of headers and sends to the DB for storage
+    Args:
+        electrum_hex (str): The 'hex' attribute of electrum's getheaders res
+    '''
+    # NB: this comes as a single hex string with all headers concatenated
+    header_list = _parse_header_chunk(electrum_hex)
+    headers.batch_store_header(cast(List[Union[Header, str]], header_list))
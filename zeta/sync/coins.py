@@ -1,7 +1,7 @@
 import asyncio
 
 from zeta import electrum
-from zeta.db import addresses, headers, prevouts
+from zeta.db.aio import addresses, headers, prevouts
 
 from typing import Any, cast, Dict, List, Optional
 from zeta.zeta_types import Header, Prevout
@@ -23,7 +23,7 @@ async def _track_known_addresses(outq: Optional[asyncio.Queue]) -> None:
     tracked: List[str] = []
     while True:
         # Find the addresses we know
-        known_addrs = addresses.find_all_addresses()
+        known_addrs = await addresses.find_all_addresses()
         # Figure out which ones we aren't already tracking and track them
         untracked = list(filter(lambda a: a not in tracked, known_addrs))
 
@@ -72,8 +72,7 @@ async def _get_address_unspents(
     elec_outpoints = [p['outpoint'] for p in prevout_list]
 
     # see if we know of any
-    known_prevouts = prevouts.find_by_address(address)
-    known_outpoints = [p['outpoint'] for p in known_prevouts]
+    known_outpoints = await prevouts.check_for_known_outpoints(elec_outpoints)
 
     # filter any we already know about
     new_prevouts = list(filter(
@@ -82,9 +81,10 @@ async def _get_address_unspents(
 
     # NB: spent_at is -2 if we think it's unspent
     #     this checks that we think unspent, but electrum thinks spent
+    known_unspents = await prevouts.find_unspents_by_address(address)
     recently_spent = list(filter(
-        lambda p: p['spent_at'] == -2 and p['outpoint'] not in elec_outpoints,
-        known_prevouts))
+        lambda p: p['outpoint'] not in elec_outpoints,
+        known_unspents))
 
     # send new ones to the outq if present
     if outq is not None:
@@ -92,7 +92,7 @@ async def _get_address_unspents(
             await outq.put(prevout)
 
     # store new ones in the db
-    prevouts.batch_store_prevout(new_prevouts)
+    await prevouts.batch_store_prevout(new_prevouts)
 
     # check on those recently spent
     asyncio.ensure_future(_update_recently_spent(
@@ -176,7 +176,7 @@ async def _update_recently_spent(
                     if outq is not None:
                         await outq.put(prevout)
                 elif 'blockhash' in tx:
-                    header = headers.find_by_hash(tx['blockhash'])
+                    header = await headers.find_by_hash(tx['blockhash'])
                     if header is not None:
                         # we found its header
                         prevout['spent_at'] = header['height']
@@ -187,7 +187,7 @@ async def _update_recently_spent(
                         prevout['spent_at'] = -2
 
                 # we have assigned a spent_by and height. write it to the db.
-                prevouts.store_prevout(prevout)
+                await prevouts.store_prevout(prevout)
 
 
 async def _maintain_db(
@@ -209,7 +209,7 @@ async def _update_children_in_mempool(
         # NB: sleep at the end so that this runs once at startup
 
         # find all the prevouts that claim to be spent by a tx in the mempool
-        child_in_mempool = prevouts.find_spent_by_mempool_tx()
+        child_in_mempool = await prevouts.find_spent_by_mempool_tx()
 
         for prevout in child_in_mempool:
             # ask the electrum servers for tx info
@@ -220,7 +220,7 @@ async def _update_children_in_mempool(
             if tx_details is None:
                 prevout['spent_at'] = -2
                 prevout['spent_by'] = ''
-                prevouts.store_prevout(prevout)
+                await prevouts.store_prevout(prevout)
                 if outq is not None:
                     await outq.put(prevout)
                 continue
@@ -229,13 +229,13 @@ async def _update_children_in_mempool(
             #     if it has 10+ confs, update its `spent_at` and store
             #     we should also notify the frontend that we found it
             if tx_details['confirmations'] >= 10:
-                h = headers.find_by_hash(tx_details['blockhash'])
+                h = await headers.find_by_hash(tx_details['blockhash'])
                 if h is None:
                     continue
                 else:
                     confirming = cast(Header, h)
                 prevout['spent_at'] = confirming['height']
-                prevouts.store_prevout(prevout)
+                await prevouts.store_prevout(prevout)
                 if outq is not None:
                     await outq.put(prevout)
                 continue
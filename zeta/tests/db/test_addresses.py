@@ -49,6 +49,12 @@ class TestAddresses(unittest.TestCase):
             self.assertEqual(addr_entry[key], fake_row[key])
         self.assertEqual(addr_entry['script_pubkeys'], [])
 
+    def test_address_from_tuple(self):
+        self.assertEqual(
+            addresses.address_from_tuple(
+                (self.test_msig['address'], self.test_msig['script'])),
+            self.test_msig)
+
     def test_validate_address(self):
         # valid pkh address
         self.assertTrue(addresses.validate_address({
@@ -95,6 +101,18 @@ class TestAddresses(unittest.TestCase):
             ['0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81788', '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81799', '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798']  # noqa: E501
         )
 
+    def test_pubkeys_from_script_cached(self):
+        script = self.test_msig['script']
+        res = addresses.pubkeys_from_script(script)
+        res.append('mutated')
+
+        with mock.patch('zeta.db.addresses.script_ser') as mock_ser:
+            self.assertEqual(
+                addresses.pubkeys_from_script(script),
+                self.test_msig['script_pubkeys'])
+            self.assertEqual(addresses.pubkeys_from_script(b''), [])
+        mock_ser.deserialize.assert_not_called()
+
     def test_store_address(self):
         # storage is done in setup. So this tests mostly failure
         self.assertFalse(addresses.store_address(6))
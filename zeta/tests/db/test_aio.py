@@ -0,0 +1,190 @@
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from zeta.db import addresses, connection, prevouts
+from zeta.db.aio import runner
+from zeta.db.aio import addresses as aio_addresses
+from zeta.db.aio import balances as aio_balances
+from zeta.db.aio import headers as aio_headers
+from zeta.db.aio import prevouts as aio_prevouts
+
+ADDRESS = '1GniSeeH9Ui1ZK4eyoaopNP1TnQLEgQiFW'
+
+
+def make_prevouts(start, count):
+    return [{
+        'outpoint': {'tx_id': i.to_bytes(32, 'big').hex(), 'index': 0},
+        'value': 1000,
+        'spent_at': -2,
+        'spent_by': '',
+        'address': ADDRESS} for i in range(start, start + count)]
+
+
+class TestAio(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        connection.init_conn(
+            path=self.tmp.name, db_name='test', chain_name='regtest')
+        self.loop = asyncio.new_event_loop()
+        runner.start()
+
+    def tearDown(self):
+        runner.stop()
+        self.loop.close()
+        connection.close_readers()
+        connection.CONN.close()
+        self.tmp.cleanup()
+
+    def run_coro(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_start_stop(self):
+        self.assertTrue(runner.running())
+        # NB: the first request makes sure the thread has claimed CONN
+        self.run_coro(aio_headers.find_highest())
+        self.assertFalse(connection.is_writer())
+
+        db_thread = self.run_coro(runner.run(threading.get_ident))
+        self.assertNotEqual(db_thread, threading.get_ident())
+
+        runner.stop()
+        self.assertFalse(runner.running())
+        self.assertTrue(connection.is_writer())
+        self.assertEqual(
+            self.run_coro(runner.run(threading.get_ident)),
+            threading.get_ident())
+
+    def test_order(self):
+        async def calls():
+            return await asyncio.gather(
+                aio_addresses.find_all_addresses(),
+                aio_addresses.store_address(ADDRESS),
+                aio_addresses.find_all_addresses(),
+                aio_prevouts.batch_store_prevout(make_prevouts(0, 10)),
+                aio_prevouts.find_by_address(ADDRESS),
+                aio_balances.find_total())
+
+        before, stored, after, batch, found, total = self.run_coro(calls())
+        self.assertEqual(before, [])
+        self.assertTrue(stored)
+        self.assertEqual(after, [ADDRESS])
+        self.assertTrue(batch)
+        self.assertEqual(len(found), 10)
+        self.assertEqual(total['total_value'], 10000)
+
+        # and it is committed
+        runner.stop()
+        self.assertEqual(len(prevouts.find_all()), 10)
+
+    def test_batches_commits(self):
+        self.run_coro(aio_addresses.store_address(ADDRESS))
+
+        async def calls():
+            return await asyncio.gather(*[
+                aio_prevouts.store_prevout(p)
+                for p in make_prevouts(0, 50)])
+
+        with mock.patch('zeta.db.connection.flush',
+                        wraps=connection.flush) as mock_flush:
+            self.assertTrue(all(self.run_coro(calls())))
+        self.assertLess(mock_flush.call_count, 50)
+
+    def test_exceptions(self):
+        def fail():
+            raise ValueError('nope')
+
+        with self.assertRaises(ValueError):
+            self.run_coro(runner.run(fail))
+        self.assertTrue(runner.running())
+        self.assertEqual(self.run_coro(aio_headers.find_highest()), [])
+
+    def test_failed_commit(self):
+        def setup():
+            # NB: a deferred foreign key is only checked by COMMIT
+            connection.CONN.execute('PRAGMA foreign_keys = ON')
+            connection.CONN.execute(
+                '''
+                CREATE TABLE child (
+                    id INTEGER REFERENCES addresses(id)
+                    DEFERRABLE INITIALLY DEFERRED)
+                ''')
+
+        def write():
+            addresses.store_address(ADDRESS)
+            connection.CONN.execute('INSERT INTO child VALUES (99)')
+            connection.commit()
+            return True
+
+        self.run_coro(runner.run(setup))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.run_coro(runner.run(write))
+
+        # the write is reported as failed, so it must never land later
+        self.assertEqual(self.run_coro(aio_headers.find_highest()), [])
+        runner.stop()
+        self.assertEqual(addresses.find_all_addresses(), [])
+
+    def test_inline(self):
+        runner.stop()
+        self.assertEqual(
+            self.run_coro(runner.run(threading.get_ident)),
+            threading.get_ident())
+        self.assertTrue(self.run_coro(aio_addresses.store_address(ADDRESS)))
+        self.assertEqual(addresses.find_all_addresses(), [ADDRESS])
+
+    def test_iter(self):
+        self.run_coro(aio_addresses.store_address(ADDRESS))
+        self.run_coro(aio_prevouts.batch_store_prevout(make_prevouts(0, 10)))
+
+        async def collect():
+            res = []
+            async for p in aio_prevouts.iter_by_address(ADDRESS, page_size=3):
+                # NB: pages are separate requests, so this runs in between
+                if len(res) == 0:
+                    await aio_prevouts.store_prevout(make_prevouts(10, 1)[0])
+                res.append(p)
+            return res
+
+        res = self.run_coro(collect())
+        self.assertEqual(len(res), 11)
+        self.assertEqual(
+            res, self.run_coro(aio_prevouts.page_all(limit=20))['prevouts'])
+
+    def test_loop_lag(self):
+        self.run_coro(aio_addresses.store_address(ADDRESS))
+        batches = [make_prevouts(i * 2000, 2000) for i in range(10)]
+        ticked = threading.Event()
+        waits = []
+        store = prevouts.batch_store_prevout
+
+        def store_after_tick(batch):
+            # NB: runs on the DB thread. The loop only ticks again if
+            #     waiting for this batch doesn't block it
+            ticked.clear()
+            waits.append(ticked.wait(5))
+            return store(batch)
+
+        async def ticker(done):
+            while not done.is_set():
+                ticked.set()
+                await asyncio.sleep(0)
+
+        async def ingest():
+            done = asyncio.Event()
+            tick = asyncio.ensure_future(ticker(done))
+            for batch in batches:
+                self.assertTrue(await aio_prevouts.batch_store_prevout(batch))
+            done.set()
+            await tick
+
+        with mock.patch.object(
+                prevouts, 'batch_store_prevout', store_after_tick):
+            self.run_coro(ingest())
+
+        self.assertEqual(waits, [True] * 10)
+        self.assertEqual(len(prevouts.find_all()), 20000)
@@ -0,0 +1,59 @@
+import unittest
+from unittest import mock
+
+from zeta.db import arrays, headers
+
+
+@unittest.skipIf(arrays.np is None, 'numpy not installed')
+class TestArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.hexes = [
+            '01000000459f16a1c695d04282fd9f84f4fe771121d467e5497eb1aa8bf66d8000000000cf7ef5b5c22d4edf641f0fd5fcfbcefa30acaa2fbc910206f8773e3918748504c1586e49ffff001d398eff7a',  # noqa: E501
+            '01000000db773c8f3b90efa51d8e40291406897062c164dff617d2a7bf64f64f00000000774328ddff50701ade3a2e1f28711643a17ad5f53f1e94639b04234fa0a5bbcf575b6e49ffff001d7232e103',  # noqa: E501
+            '01000000f9980503946685d96c93e577fbc9178bf36afda513d16ca79272884600000000a2211eb4bc799c5a8f144bf04cae15842c7981ceab73ab53df166eaec53b6d99275d6e49ffff001d1f75f325']  # noqa: E501
+        self.blob = bytes.fromhex(''.join(self.hexes))
+
+    def test_dtype(self):
+        self.assertEqual(arrays.HEADER_DTYPE.itemsize, 80)
+
+    def test_header_batch(self):
+        batch = arrays.HeaderBatch(self.blob)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.array['version'].tolist(), [1, 1, 1])
+        self.assertEqual(
+            batch.array['timestamp'].tolist(),
+            [1231968449, 1231969111, 1231969575])
+        self.assertEqual(batch.hashes.shape, (3, 32))
+        # zero copy view of the input
+        self.assertFalse(batch.array.flags['OWNDATA'])
+
+        with self.assertRaises(ValueError) as context:
+            arrays.HeaderBatch(self.blob[:-1])
+        self.assertIn('Invalid header received', str(context.exception))
+
+    def test_to_headers(self):
+        self.assertEqual(
+            arrays.HeaderBatch(self.blob).to_headers(),
+            [headers.parse_header(h) for h in self.hexes])
+        self.assertEqual(
+            arrays.parse_header_blob(self.blob),
+            headers.parse_header_blob(self.blob))
+        self.assertEqual(arrays.parse_header_blob(b''), [])
+
+    def test_check_linkage(self):
+        parsed = [headers.parse_header(h) for h in self.hexes]
+        batch = arrays.HeaderBatch(self.blob)
+        self.assertTrue(batch.check_linkage())
+        self.assertTrue(batch.check_linkage(parsed[0]['prev_block']))
+        self.assertFalse(batch.check_linkage(parsed[2]['hash']))
+
+        self.assertTrue(arrays.HeaderBatch(b'').check_linkage('00' * 32))
+
+        unlinked = bytes.fromhex(self.hexes[0] + self.hexes[2])
+        self.assertFalse(arrays.HeaderBatch(unlinked).check_linkage())
+
+    @mock.patch('zeta.db.arrays.np', None)
+    def test_require_numpy(self):
+        with self.assertRaises(ImportError):
+            arrays.HeaderBatch(self.blob)
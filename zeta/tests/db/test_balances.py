@@ -0,0 +1,163 @@
+import sqlite3
+import unittest
+from unittest import mock
+
+from zeta.db import addresses, balances, connection, prevouts
+
+ADDRESS = '1GniSeeH9Ui1ZK4eyoaopNP1TnQLEgQiFW'
+OTHER = '36gWkx1AR4ABH9nqzzsRJ6NFMedHw6QzW3'
+
+ZERO = {
+    'confirmed': 0,
+    'mempool_spent': 0,
+    'unspent_count': 0,
+    'total_value': 0}
+
+
+def make_prevout(i, spent_at=-2, address=ADDRESS):
+    return {
+        'outpoint': {'tx_id': '{:064x}'.format(i), 'index': 0},
+        'value': 1000 + i,
+        'spent_at': spent_at,
+        'spent_by': '' if spent_at == -2 else '67' * 32,
+        'address': address}
+
+
+class TestBalances(unittest.TestCase):
+
+    def setUp(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        connection.ensure_tables()
+        self.assertTrue(addresses.store_address(ADDRESS))
+
+    def tearDown(self):
+        connection.CONN.close()
+
+    def summed(self, address):
+        '''
+        The balance, summed the slow way
+        '''
+        res = dict(ZERO)
+        for p in prevouts.find_by_address(address):
+            for k, v in zip(
+                    ['confirmed', 'mempool_spent', 'unspent_count',
+                     'total_value'],
+                    balances.contribution(p['value'], p['spent_at'])):
+                res[k] += v
+        return res
+
+    def summed_total(self):
+        res = dict(ZERO)
+        for address in addresses.find_all_addresses():
+            for k, v in self.summed(address).items():
+                res[k] += v
+        return res
+
+    def test_contribution(self):
+        self.assertEqual(balances.contribution(5, -2), (5, 0, 1, 5))
+        self.assertEqual(balances.contribution(5, -1), (5, 5, 0, 5))
+        self.assertEqual(balances.contribution(5, 100), (0, 0, 0, 5))
+
+    def test_find_by_address(self):
+        self.assertEqual(balances.find_by_address(ADDRESS), ZERO)
+        self.assertEqual(balances.find_by_address('nope'), ZERO)
+
+        self.assertTrue(prevouts.store_prevout(make_prevout(0)))
+        self.assertTrue(prevouts.batch_store_prevout([
+            make_prevout(1, -1), make_prevout(2, 554702)]))
+        self.assertEqual(
+            balances.find_by_address(ADDRESS),
+            {'confirmed': 2001,
+             'mempool_spent': 1001,
+             'unspent_count': 1,
+             'total_value': 3003})
+        self.assertEqual(balances.find_by_address(ADDRESS),
+                         self.summed(ADDRESS))
+
+    def test_restore(self):
+        self.assertTrue(prevouts.batch_store_prevout(
+            [make_prevout(i) for i in range(3)]))
+
+        # spending moves value between the sums, storing again changes none
+        self.assertTrue(prevouts.store_prevout(make_prevout(0, -1)))
+        self.assertTrue(prevouts.store_prevout(make_prevout(0, -1)))
+        self.assertTrue(prevouts.batch_store_prevout([
+            make_prevout(1, -1), make_prevout(1, 554702),
+            make_prevout(2, address=OTHER)]))
+        self.assertEqual(
+            balances.find_by_address(ADDRESS),
+            {'confirmed': 1000,
+             'mempool_spent': 1000,
+             'unspent_count': 0,
+             'total_value': 2001})
+        self.assertEqual(balances.find_by_address(ADDRESS),
+                         self.summed(ADDRESS))
+        self.assertEqual(balances.find_by_address(OTHER),
+                         self.summed(OTHER))
+
+    def test_failed_batch(self):
+        self.assertTrue(prevouts.store_prevout(make_prevout(0)))
+
+        # the prevouts are written first, and roll back with the balance
+        with mock.patch('zeta.db.balances.apply_deltas',
+                        side_effect=ValueError()):
+            self.assertFalse(prevouts.batch_store_prevout(
+                [make_prevout(0, 554702), make_prevout(1)]))
+        self.assertEqual(prevouts.find_all(), [make_prevout(0)])
+        self.assertEqual(balances.find_by_address(ADDRESS),
+                         self.summed(ADDRESS))
+
+    def test_find_total(self):
+        self.assertEqual(balances.find_total(), ZERO)
+        self.assertTrue(addresses.store_address(OTHER))
+        self.assertTrue(prevouts.batch_store_prevout([
+            make_prevout(0), make_prevout(1, -1, OTHER)]))
+        self.assertEqual(
+            balances.find_total(),
+            {'confirmed': 2001,
+             'mempool_spent': 1001,
+             'unspent_count': 1,
+             'total_value': 2001})
+
+        # untracked addresses aren't part of the wallet
+        self.assertTrue(prevouts.store_prevout(
+            make_prevout(2, address='1BoatSLRHtKNngkdXEeobR76b53LETtpyT')))
+        self.assertEqual(balances.find_total()['total_value'], 2001)
+
+        # until we start tracking them
+        self.assertTrue(
+            addresses.store_address('1BoatSLRHtKNngkdXEeobR76b53LETtpyT'))
+        self.assertEqual(balances.find_total()['total_value'], 3003)
+        self.assertTrue(
+            addresses.store_address('1BoatSLRHtKNngkdXEeobR76b53LETtpyT'))
+        self.assertEqual(balances.find_total(), self.summed_total())
+
+    def test_migrate_v6(self):
+        self.assertTrue(prevouts.batch_store_prevout([
+            make_prevout(0), make_prevout(1, -1), make_prevout(2, 554702),
+            make_prevout(3, address=OTHER)]))
+        before = balances.find_by_address(ADDRESS)
+
+        c = connection.CONN
+        c.execute('DROP TABLE address_balances')
+        c.execute('DROP TABLE tracked_balance')
+        c.execute('PRAGMA user_version = 5')
+        self.assertTrue(connection.ensure_tables())
+        self.assertEqual(balances.find_by_address(ADDRESS), before)
+        self.assertEqual(balances.find_by_address(OTHER),
+                         self.summed(OTHER))
+
+    def test_migrate_v7(self):
+        self.assertTrue(prevouts.batch_store_prevout([
+            make_prevout(0), make_prevout(1, -1), make_prevout(2, 554702),
+            make_prevout(3, address=OTHER)]))
+        before = balances.find_total()
+        self.assertEqual(before, self.summed_total())
+
+        c = connection.CONN
+        c.execute('DROP TABLE tracked_balance')
+        c.execute('PRAGMA user_version = 6')
+        self.assertTrue(connection.ensure_tables())
+        self.assertEqual(balances.find_total(), before)
@@ -0,0 +1,81 @@
+import unittest
+
+from zeta.db import cache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_put(self):
+        lru = cache.LRUCache(2)
+        self.assertIsNone(lru.get('a'))
+        lru.put('a', 1)
+        lru.put('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+
+        # b is least recently used
+        lru.put('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(len(lru), 2)
+        self.assertEqual((lru.hits, lru.misses), (3, 2))
+
+        lru.pop('a')
+        lru.pop('missing')
+        self.assertIsNone(lru.get('a'))
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+    def test_disabled(self):
+        lru = cache.LRUCache(0)
+        lru.put('a', 1)
+        self.assertIsNone(lru.get('a'))
+
+
+class TestHeaderCache(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_returns_copies(self):
+        header = {'hash': 'aa', 'height': 5}
+        cache.put_by_hash(header)
+        cache.put_by_height(5, [header])
+        header['height'] = 6
+
+        cached = cache.get_by_hash('aa')
+        self.assertEqual(cached['height'], 5)
+        cached['height'] = 7
+        self.assertEqual(cache.get_by_hash('aa')['height'], 5)
+
+        cache.get_by_height(5)[0]['height'] = 7
+        self.assertEqual(cache.get_by_height(5), [{'hash': 'aa', 'height': 5}])
+
+    def test_invalidate(self):
+        cache.put_by_hash({'hash': 'aa', 'height': 5})
+        cache.put_by_height(5, [])
+        cache.put_by_height(6, [])
+        cache.invalidate(['aa'], [5])
+        self.assertIsNone(cache.get_by_hash('aa'))
+        self.assertIsNone(cache.get_by_height(5))
+        self.assertEqual(cache.get_by_height(6), [])
+
+    def test_ensure(self):
+        conn = object()
+        cache.ensure(conn)
+        cache.put_by_height(5, [])
+        cache.ensure(conn)
+        self.assertEqual(cache.get_by_height(5), [])
+        cache.ensure(object())
+        self.assertIsNone(cache.get_by_height(5))
+
+    def test_stats(self):
+        stats = cache.stats()
+        cache.get_by_hash('missing')
+        self.assertEqual(
+            cache.stats()['by_hash_misses'],
+            stats['by_hash_misses'] + 1)
+        self.assertEqual(cache.stats()['by_hash_size'], 0)
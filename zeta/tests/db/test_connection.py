@@ -1,13 +1,580 @@
+import os
+import asyncio
+import sqlite3
+import tempfile
 import unittest
+import threading
 from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 
-from zeta.db import connection
+from zeta.db import addresses, checkpoint, connection, headers, index
+from zeta.db import prevouts
 
 
 class TestConnect(unittest.TestCase):
 
+    def _query_plan(self, query, params={}):
+        return ' '.join(
+            r['detail'] for r in connection.CONN.execute(
+                'EXPLAIN QUERY PLAN ' + query, params))
+
+    def _fresh_db(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        self.assertTrue(connection.ensure_tables())
+        return c
+
+    def test_schema_version(self):
+        c = self._fresh_db()
+        self.assertEqual(
+            connection.schema_version(),
+            connection.SCHEMA_VERSION)
+
+        # running again is a no-op
+        self.assertTrue(connection.ensure_tables())
+        self.assertEqual(
+            connection.schema_version(),
+            connection.SCHEMA_VERSION)
+        c.close()
+
+    def test_ensure_tables_partial_migration(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        connection._migrate_v1(c.cursor())
+        c.execute('PRAGMA user_version = 1')
+
+        self.assertTrue(connection.ensure_tables())
+        indexes = [r['name'] for r in c.execute(
+            '''
+            SELECT name FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = 'headers'
+            ''')]
+        for name in ['headers_height', 'headers_accumulated_work',
+                     'headers_prev_block', 'headers_floating']:
+            self.assertIn(name, indexes)
+        c.close()
+
+    def test_header_indexes_used(self):
+        c = self._fresh_db()
+
+        plan = self._query_plan(
+            'SELECT * FROM headers WHERE height = :height',
+            {'height': 500})
+        self.assertIn('USING INDEX headers_height', plan)
+
+        plan = self._query_plan(
+            '''
+            SELECT * FROM headers
+            WHERE height = (SELECT max(height) FROM headers)
+            ''')
+        self.assertNotIn('SCAN', plan)
+        self.assertIn('headers_height', plan)
+
+        plan = self._query_plan(
+            '''
+            SELECT * FROM headers
+            WHERE accumulated_work =
+                (SELECT max(accumulated_work) FROM headers)
+            ''')
+        self.assertNotIn('SCAN', plan)
+        self.assertIn('headers_accumulated_work', plan)
+
+        plan = self._query_plan(
+            'SELECT * FROM headers WHERE substr(header, 5, 32) = :p',
+            {'p': b'\x00' * 32})
+        self.assertIn('USING INDEX headers_prev_block', plan)
+
+        plan = self._query_plan(
+            '''
+            SELECT * FROM headers
+            WHERE substr(header, 5, 32) = :p AND height = 0
+            ''',
+            {'p': b'\x00' * 32})
+        self.assertIn('USING INDEX headers_floating', plan)
+        c.close()
+
+    def test_ensure_tables_failed_migration(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+
+        def fail(cursor):
+            cursor.execute('CREATE TABLE half_done(x INTEGER)')
+            raise ValueError('nope')
+
+        migrations = connection.MIGRATIONS[:2] + [fail]
+        with mock.patch('zeta.db.connection.MIGRATIONS', migrations):
+            self.assertFalse(connection.ensure_tables())
+        # earlier migrations are kept, the failed one is rolled back
+        self.assertEqual(connection.schema_version(), 2)
+        self.assertIsNone(c.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'half_done'"
+        ).fetchone())
+
+        self.assertTrue(connection.ensure_tables())
+        self.assertEqual(
+            connection.schema_version(), connection.SCHEMA_VERSION)
+        c.close()
+
+    def test_init_conn_failed_migration(self):
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch('zeta.db.connection.ensure_tables',
+                            return_value=False):
+                with self.assertRaises(RuntimeError):
+                    connection.init_conn(
+                        path=d, db_name='test', chain_name='regtest')
+            connection.close_readers()
+            connection.CONN.close()
+
     @mock.patch('zeta.db.connection.get_cursor')
     def test_ensure_tables(self, mock_get_cursor):
         mock_get_cursor.return_value.execute.side_effect = ValueError()
 
         self.assertFalse(connection.ensure_tables())
+
+    def test_ensure_tables_migrates_legacy_headers(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        c.execute('''
+            CREATE TABLE headers(
+                hash TEXT PRIMARY KEY,
+                version INTEGER,
+                prev_block TEXT,
+                merkle_root TEXT,
+                timestamp INTEGER,
+                nbits TEXT,
+                nonce TEXT,
+                difficulty INTEGER,
+                hex TEXT,
+                height INTEGER,
+                accumulated_work INTEGER)
+            ''')
+        header = checkpoint.CHECKPOINTS['bitcoin_test'][0]
+        c.execute(
+            '''
+            INSERT INTO headers VALUES (
+                :hash, :version, :prev_block, :merkle_root, :timestamp,
+                :nbits, :nonce, :difficulty, :hex, :height, :accumulated_work)
+            ''',
+            header)
+
+        self.assertTrue(connection.ensure_tables())
+
+        columns = [r[1] for r in c.execute('PRAGMA table_info(headers)')]
+        self.assertEqual(
+            columns,
+            ['hash', 'header', 'height', 'accumulated_work'])
+        self.assertEqual(headers.find_by_hash(header['hash']), header)
+        c.close()
+
+    def test_transaction(self):
+        c = self._fresh_db()
+        with connection.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO addresses VALUES (NULL, 'a', x'')")
+        self.assertFalse(c.in_transaction)
+        self.assertEqual(
+            c.execute('SELECT COUNT(*) FROM addresses').fetchone()[0], 1)
+
+        with self.assertRaises(ValueError):
+            with connection.transaction() as cursor:
+                cursor.execute(
+                    "INSERT INTO addresses VALUES (NULL, 'b', x'')")
+                raise ValueError()
+        self.assertEqual(
+            c.execute('SELECT COUNT(*) FROM addresses').fetchone()[0], 1)
+
+        # does not clobber an outer transaction on failure
+        c.execute("INSERT INTO addresses VALUES (NULL, 'c', x'')")
+        with self.assertRaises(ValueError):
+            with connection.transaction() as cursor:
+                cursor.execute(
+                    "INSERT INTO addresses VALUES (NULL, 'd', x'')")
+                raise ValueError()
+        c.commit()
+        self.assertEqual(
+            [r[0] for r in c.execute('SELECT address FROM addresses')],
+            ['a', 'c'])
+        c.close()
+
+    def test_commit_without_loop(self):
+        c = self._fresh_db()
+        c.execute("INSERT INTO addresses VALUES (NULL, 'a', x'')")
+        connection.commit()
+        self.assertFalse(c.in_transaction)
+        self.assertEqual(connection.pending(), 0)
+        c.close()
+
+    def test_group_commit(self):
+        c = self._fresh_db()
+        loop = asyncio.new_event_loop()
+
+        async def writes():
+            for i in range(3):
+                c.execute(
+                    "INSERT INTO addresses VALUES (NULL, ?, x'')", (str(i),))
+                connection.commit()
+            self.assertTrue(c.in_transaction)
+            self.assertEqual(connection.pending(), 3)
+
+            # uncommitted writes are visible on the same connection
+            self.assertEqual(
+                c.execute('SELECT COUNT(*) FROM addresses').fetchone()[0], 3)
+
+            await asyncio.sleep(connection.COMMIT_DELAY * 2)
+            self.assertFalse(c.in_transaction)
+            self.assertEqual(connection.pending(), 0)
+
+            # a durable commit flushes everything pending
+            c.execute("INSERT INTO addresses VALUES (NULL, 'x', x'')")
+            connection.commit()
+            c.execute("INSERT INTO addresses VALUES (NULL, 'y', x'')")
+            connection.commit(durable=True)
+            self.assertFalse(c.in_transaction)
+
+            with mock.patch('zeta.db.connection.COMMIT_BATCH', 2):
+                c.execute("INSERT INTO addresses VALUES (NULL, 'z', x'')")
+                connection.commit()
+                self.assertTrue(c.in_transaction)
+                connection.commit()
+                self.assertFalse(c.in_transaction)
+
+        loop.run_until_complete(writes())
+        loop.close()
+
+        # a flush scheduled on a closed loop doesn't block new ones
+        async def commit():
+            connection.commit()
+
+        loop = asyncio.new_event_loop()
+        c.execute("INSERT INTO addresses VALUES (NULL, 'w', x'')")
+        loop.run_until_complete(commit())
+        self.assertTrue(c.in_transaction)
+        loop.close()
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(commit())
+        loop.run_until_complete(asyncio.sleep(connection.COMMIT_DELAY * 2))
+        self.assertFalse(c.in_transaction)
+        loop.close()
+        c.close()
+
+    def test_group_commit_transaction(self):
+        c = self._fresh_db()
+        loop = asyncio.new_event_loop()
+
+        async def writes():
+            with connection.transaction() as cursor:
+                cursor.execute(
+                    "INSERT INTO addresses VALUES (NULL, 'a', x'')")
+            self.assertTrue(c.in_transaction)
+
+            # a failed transaction keeps earlier pending writes
+            with self.assertRaises(ValueError):
+                with connection.transaction() as cursor:
+                    cursor.execute(
+                        "INSERT INTO addresses VALUES (NULL, 'b', x'')")
+                    raise ValueError()
+            connection.flush()
+            self.assertEqual(
+                [r[0] for r in c.execute('SELECT address FROM addresses')],
+                ['a'])
+
+        loop.run_until_complete(writes())
+        loop.close()
+        c.close()
+
+    def test_batch_commits_failed_commit(self):
+        c = self._fresh_db()
+        index.ensure(c)
+        # NB: a deferred foreign key is only checked by COMMIT
+        c.execute('PRAGMA foreign_keys = ON')
+        c.execute(
+            '''
+            CREATE TABLE child (
+                id INTEGER REFERENCES addresses(id)
+                DEFERRABLE INITIALLY DEFERRED)
+            ''')
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            with connection.batch_commits():
+                c.execute("INSERT INTO addresses VALUES (NULL, 'a', x'')")
+                connection.commit()
+                index.add(b'\x01' * 32, b'\x00' * 32, 1, 1)
+                c.execute('INSERT INTO child VALUES (99)')
+                connection.commit()
+        self.assertFalse(c.in_transaction)
+        self.assertEqual(connection.pending(), 0)
+        # the index forgets what was rolled back
+        self.assertEqual(index.size(), 0)
+
+        # the next flush doesn't commit them after all
+        connection.flush()
+        self.assertEqual(
+            c.execute('SELECT COUNT(*) FROM addresses').fetchone()[0], 0)
+        c.close()
+
+    def _file_db(self, d):
+        connection.init_conn(path=d, db_name='test', chain_name='regtest')
+        self.addCleanup(connection.CONN.close)
+        self.addCleanup(connection.close_readers)
+        return connection.CONN
+
+    def test_readers(self):
+        with tempfile.TemporaryDirectory() as d:
+            c = self._file_db(d)
+            self.assertTrue(connection.is_writer())
+            self.assertIs(connection.reader(), c)
+
+            def in_thread():
+                self.assertFalse(connection.is_writer())
+                return connection.reader(), connection.reader()
+
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                a, b = pool.submit(in_thread).result()
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                other, _ = pool.submit(in_thread).result()
+            self.assertIs(a, b)
+            self.assertIsNot(a, c)
+            self.assertIsNot(a, other)
+
+            # readers can't write
+            def write():
+                with connection.transaction() as cursor:
+                    cursor.execute(
+                        "INSERT INTO addresses VALUES (NULL, 'a', x'')")
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                with self.assertRaises(sqlite3.OperationalError):
+                    pool.submit(write).result()
+
+    def test_get_tuple_cursor(self):
+        with tempfile.TemporaryDirectory() as d:
+            c = self._file_db(d)
+            c.execute("INSERT INTO addresses VALUES (NULL, 'a', x'')")
+            connection.commit(durable=True)
+
+            def in_thread():
+                return connection.get_tuple_cursor().execute(
+                    'SELECT * FROM addresses').fetchall()
+
+            self.assertEqual(in_thread(), [(1, 'a', b'')])
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                self.assertEqual(
+                    pool.submit(in_thread).result(), [(1, 'a', b'')])
+            # other cursors still return rows
+            self.assertIsInstance(
+                connection.get_cursor().execute(
+                    'SELECT * FROM addresses').fetchone(),
+                sqlite3.Row)
+
+    def test_readers_concurrent_with_writer(self):
+        with tempfile.TemporaryDirectory() as d:
+            c = self._file_db(d)
+            self.assertTrue(addresses.store_address(
+                {'address': '1GniSeeH9Ui1ZK4eyoaopNP1TnQLEgQiFW',
+                 'script': b'', 'script_pubkeys': []}))
+
+            # an open write transaction doesn't block readers
+            c.execute("INSERT INTO addresses VALUES (NULL, 'b', x'')")
+            self.assertTrue(c.in_transaction)
+
+            loop = asyncio.new_event_loop()
+            res = loop.run_until_complete(
+                connection.run_read(addresses.find_all_addresses))
+            self.assertEqual(res, ['1GniSeeH9Ui1ZK4eyoaopNP1TnQLEgQiFW'])
+
+            connection.flush()
+            res = loop.run_until_complete(
+                connection.run_read(addresses.find_all_addresses))
+            self.assertEqual(len(res), 2)
+            loop.close()
+
+    def test_run_read_inline(self):
+        c = self._fresh_db()
+        loop = asyncio.new_event_loop()
+        with mock.patch('zeta.db.connection._READ_URI', None):
+            self.assertEqual(
+                loop.run_until_complete(
+                    connection.run_read(threading.get_ident)),
+                threading.get_ident())
+        loop.close()
+        c.close()
+
+    def test_storage_profile(self):
+        self.assertEqual(
+            connection.storage_profile(), connection.PRAGMA_DEFAULTS)
+        with mock.patch.dict(os.environ, {'ZETA_DB_SYNCHRONOUS': 'FULL'}):
+            self.assertIn(
+                ('synchronous', 'FULL'), connection.storage_profile())
+
+    def test_apply_profile(self):
+        with tempfile.TemporaryDirectory() as d:
+            c = sqlite3.connect(os.path.join(d, 'test.db'))
+            self.assertEqual(connection.apply_profile(c), {
+                'page_size': '4096',
+                'auto_vacuum': '2',
+                'journal_mode': 'wal',
+                'synchronous': '1',
+                'mmap_size': str(256 * 1024 * 1024),
+                'cache_size': str(-64 * 1024),
+                'temp_store': '2'})
+
+            connection.CONN = c
+            self.assertTrue(connection.ensure_tables())
+            self.assertEqual(
+                c.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+
+            self.assertEqual(
+                connection.apply_profile(
+                    c, [('journal_mode', 'delete'), ('synchronous', 'FULL')]),
+                {'journal_mode': 'delete', 'synchronous': '2'})
+            c.close()
+
+        # in-memory DBs can't use WAL
+        c = sqlite3.connect(':memory:')
+        self.assertEqual(
+            connection.apply_profile(c)['journal_mode'], 'memory')
+
+        for bad in [[('journal_mode', 'WAL; DROP TABLE headers')],
+                    [('synchronous', 'SOMETIMES')],
+                    [('cache_size', '1; VACUUM')]]:
+            with self.assertRaises(ValueError):
+                connection.apply_profile(c, bad)
+        c.close()
+
+    def test_migrate_v3_recomputes_work(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        cursor = c.cursor()
+        connection._migrate_v1(cursor)
+        connection._migrate_v2(cursor)
+        c.execute('PRAGMA user_version = 2')
+
+        parsed_500 = headers.parse_header('01000000459f16a1c695d04282fd9f84f4fe771121d467e5497eb1aa8bf66d8000000000cf7ef5b5c22d4edf641f0fd5fcfbcefa30acaa2fbc910206f8773e3918748504c1586e49ffff001d398eff7a')  # noqa: E501
+        parsed_501 = headers.parse_header('01000000db773c8f3b90efa51d8e40291406897062c164dff617d2a7bf64f64f00000000774328ddff50701ade3a2e1f28711643a17ad5f53f1e94639b04234fa0a5bbcf575b6e49ffff001d7232e103')  # noqa: E501
+        floating = checkpoint.CHECKPOINTS['bitcoin_test'][0]
+
+        # old style: integer difficulty sums
+        for h, height, acc in [(parsed_500, 500, 0),
+                               (parsed_501, 501, 1),
+                               (floating, 0, 0)]:
+            c.execute(
+                'INSERT INTO headers VALUES (?, ?, ?, ?)',
+                (bytes.fromhex(h['hash']), bytes.fromhex(h['hex']),
+                 height, acc))
+
+        self.assertTrue(connection.ensure_tables())
+        self.assertEqual(
+            connection.schema_version(), connection.SCHEMA_VERSION)
+        self.assertEqual(
+            headers.find_by_hash(parsed_500['hash'])['accumulated_work'],
+            0)
+        self.assertEqual(
+            headers.find_by_hash(parsed_501['hash'])['accumulated_work'],
+            0x100010001)
+        self.assertEqual(
+            headers.find_by_hash(floating['hash'])['accumulated_work'],
+            0)
+        self.assertEqual(headers.find_heaviest()[0]['height'], 501)
+        c.close()
+
+    def test_migrate_v5_prevouts(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        cursor = c.cursor()
+        for migrate in connection.MIGRATIONS[:4]:
+            migrate(cursor)
+        c.execute('PRAGMA user_version = 4')
+
+        tracked = '1GniSeeH9Ui1ZK4eyoaopNP1TnQLEgQiFW'
+        untracked = '36gWkx1AR4ABH9nqzzsRJ6NFMedHw6QzW3'
+        c.execute(
+            "INSERT INTO addresses VALUES (?, x'00')", (tracked,))
+        prevout_list = [{
+            'outpoint': {'tx_id': '{:064x}'.format(i), 'index': i},
+            'value': 1000 + i,
+            'spent_at': -2 if i % 2 else 554702,
+            'spent_by': '' if i % 2 else '67' * 32,
+            'address': tracked if i < 3 else untracked} for i in range(4)]
+        # old style: hex outpoints and address strings
+        c.executemany(
+            'INSERT INTO prevouts VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(prevouts.outpoint_key(p['outpoint']).hex(),
+              p['outpoint']['tx_id'], p['outpoint']['index'], p['value'],
+              p['spent_at'], p['spent_by'], p['address'])
+             for p in prevout_list])
+
+        self.assertTrue(connection.ensure_tables())
+        self.assertEqual(
+            connection.schema_version(), connection.SCHEMA_VERSION)
+
+        self.assertEqual(prevouts.find_all(), prevout_list)
+        self.assertEqual(
+            prevouts.find_by_address(untracked), prevout_list[3:])
+        self.assertEqual(
+            prevouts.find_by_child('67' * 32),
+            [prevout_list[0], prevout_list[2]])
+        self.assertEqual(
+            addresses.find_by_address(tracked)['script'], b'\x00')
+        self.assertEqual(addresses.find_all_addresses(), [tracked])
+        self.assertIsNone(addresses.find_by_address(untracked))
+        c.close()
+
+    def test_migrate_v5_null_address(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        cursor = c.cursor()
+        for migrate in connection.MIGRATIONS[:4]:
+            migrate(cursor)
+        c.execute('PRAGMA user_version = 4')
+        c.execute(
+            'INSERT INTO prevouts VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ('00' * 36, '00' * 32, 0, 1000, -2, '', None))
+        c.commit()
+
+        with self.assertRaisesRegex(ValueError, '1 prevouts'):
+            connection.MIGRATIONS[4](c.cursor())
+        # the migration fails, and the prevout is kept
+        self.assertFalse(connection.ensure_tables())
+        self.assertEqual(connection.schema_version(), 4)
+        self.assertEqual(
+            c.execute('SELECT count(*) FROM prevouts').fetchone()[0], 1)
+        c.close()
+
+    def test_prevout_indexes_used(self):
+        c = self._fresh_db()
+        select = 'SELECT p.outpoint, p.value, p.spent_at, p.spent_by, ' \
+            'a.address FROM prevouts p JOIN addresses a ON a.id = p.address_id'
+
+        plan = self._query_plan(
+            select + '''
+            WHERE p.address_id = (
+                SELECT id FROM addresses WHERE address = :address)
+            AND p.outpoint > :after
+            ORDER BY p.outpoint
+            ''',
+            {'address': 'a', 'after': b''})
+        self.assertIn('USING COVERING INDEX prevouts_address', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+        plan = self._query_plan(
+            select + '''
+            WHERE p.value <= 10 AND p.value >= 1 AND p.spent_at = -2
+            ''')
+        self.assertIn('USING COVERING INDEX prevouts_spent', plan)
+
+        plan = self._query_plan(
+            select + ' WHERE p.spent_by = :child',
+            {'child': b'\x00' * 32})
+        self.assertIn('USING INDEX prevouts_spent_by', plan)
+
+        plan = self._query_plan(
+            select + ' WHERE p.outpoint BETWEEN :lower AND :upper',
+            {'lower': b'\x00', 'upper': b'\xff'})
+        self.assertIn('USING PRIMARY KEY', plan)
+        c.close()
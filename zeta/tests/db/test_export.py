@@ -0,0 +1,117 @@
+import sqlite3
+import unittest
+from unittest import mock
+
+from zeta.db import addresses, connection, export, headers, prevouts
+
+ADDRESS = '1GniSeeH9Ui1ZK4eyoaopNP1TnQLEgQiFW'
+OTHER = '36gWkx1AR4ABH9nqzzsRJ6NFMedHw6QzW3'
+
+
+@unittest.skipIf(export.np is None, 'numpy not installed')
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        connection.ensure_tables()
+
+        self.hexes = [
+            '01000000459f16a1c695d04282fd9f84f4fe771121d467e5497eb1aa8bf66d8000000000cf7ef5b5c22d4edf641f0fd5fcfbcefa30acaa2fbc910206f8773e3918748504c1586e49ffff001d398eff7a',  # noqa: E501
+            '01000000db773c8f3b90efa51d8e40291406897062c164dff617d2a7bf64f64f00000000774328ddff50701ade3a2e1f28711643a17ad5f53f1e94639b04234fa0a5bbcf575b6e49ffff001d7232e103',  # noqa: E501
+            '01000000f9980503946685d96c93e577fbc9178bf36afda513d16ca79272884600000000a2211eb4bc799c5a8f144bf04cae15842c7981ceab73ab53df166eaec53b6d99275d6e49ffff001d1f75f325']  # noqa: E501
+        base = headers.parse_header(self.hexes[0])
+        base['height'] = 500
+        self.assertTrue(headers.store_header(base))
+        for h in self.hexes[1:]:
+            self.assertTrue(headers.store_header(h))
+        self.headers = [headers.find_by_height(h)[0] for h in range(500, 503)]
+
+        self.assertTrue(addresses.store_address(ADDRESS))
+        self.assertTrue(addresses.store_address(OTHER))
+        self.prevouts = [{
+            'outpoint': {'tx_id': '{:064x}'.format(i), 'index': i},
+            'value': 1000 + i,
+            'spent_at': -2 if i % 2 else 554702,
+            'spent_by': '' if i % 2 else '67' * 32,
+            'address': ADDRESS if i < 4 else OTHER} for i in range(5)]
+        self.assertTrue(prevouts.batch_store_prevout(self.prevouts))
+
+    def tearDown(self):
+        connection.CONN.close()
+
+    def test_header_arrays(self):
+        chunks = list(export.iter_header_arrays(chunk_size=2))
+        self.assertEqual([len(a) for a in chunks], [2, 1])
+        self.assertEqual(chunks[0].dtype, export.HEADER_EXPORT_DTYPE)
+
+        res = export.np.concatenate(chunks)
+        self.assertEqual(res['height'].tolist(), [500, 501, 502])
+        for row, h in zip(res, self.headers):
+            self.assertEqual(row['hash'].tobytes().hex(), h['hash'])
+            self.assertEqual(
+                int.from_bytes(row['accumulated_work'].tobytes(), 'big'),
+                h['accumulated_work'])
+            self.assertEqual(row['version'], h['version'])
+            self.assertEqual(row['timestamp'], h['timestamp'])
+            self.assertEqual(row['nbits'].tobytes().hex(), h['nbits'])
+            self.assertEqual(
+                row['prev_block'].tobytes()[::-1].hex(), h['prev_block'])
+
+    def test_header_arrays_range(self):
+        res = export.np.concatenate(list(export.iter_header_arrays(
+            lower_height=501, upper_height=501)))
+        self.assertEqual(res['height'].tolist(), [501])
+        self.assertEqual(
+            list(export.iter_header_arrays(lower_height=503)), [])
+
+    def test_prevout_arrays(self):
+        chunks = list(export.iter_prevout_arrays(chunk_size=2))
+        self.assertEqual([len(a) for a in chunks], [2, 2, 1])
+
+        res = export.np.concatenate(chunks)
+        self.assertEqual(res['idx'].tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(
+            res['value'].tolist(), [p['value'] for p in self.prevouts])
+        self.assertEqual(
+            res['spent_at'].tolist(), [p['spent_at'] for p in self.prevouts])
+        self.assertEqual(
+            res[4]['tx_id'].tobytes().hex(),
+            self.prevouts[4]['outpoint']['tx_id'])
+        self.assertEqual(res[0]['spent_by'].tobytes(), b'\x67' * 32)
+        self.assertEqual(res[1]['spent_by'].tobytes(), b'\x00' * 32)
+        self.assertEqual(res[0]['address'], ADDRESS.encode())
+
+    def test_prevout_arrays_address(self):
+        res = export.np.concatenate(list(export.iter_prevout_arrays(OTHER)))
+        self.assertEqual(res['idx'].tolist(), [4])
+        self.assertEqual(list(export.iter_prevout_arrays('nope')), [])
+
+    def test_missing_numpy(self):
+        with mock.patch('zeta.db.export.np', None):
+            with self.assertRaises(ImportError):
+                export.iter_header_arrays()
+            with self.assertRaises(ImportError):
+                export.iter_prevout_batches()
+
+    @unittest.skipIf(export.pa is None, 'pyarrow not installed')
+    def test_header_batches(self):
+        batches = list(export.iter_header_batches(chunk_size=2))
+        self.assertEqual([b.num_rows for b in batches], [2, 1])
+        self.assertEqual(
+            batches[0].schema.names, list(export.HEADER_EXPORT_DTYPE.names))
+        self.assertEqual(
+            batches[0].column('hash')[0].as_py().hex(),
+            self.headers[0]['hash'])
+        self.assertEqual(
+            batches[1].column('height').to_pylist(), [502])
+
+    @unittest.skipIf(export.pa is None, 'pyarrow not installed')
+    def test_prevout_batches(self):
+        batches = list(export.iter_prevout_batches(ADDRESS))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(
+            batches[0].column('address').to_pylist(), [ADDRESS] * 4)
+        self.assertEqual(
+            batches[0].column('value').to_pylist(), [1000, 1001, 1002, 1003])
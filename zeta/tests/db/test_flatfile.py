@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from riemann import utils as rutils
+
+from zeta.db import connection, flatfile, headers
+from zeta.tests.helpers import make_chain
+
+
+class TestFlatFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'zeta_test.headers')
+
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        connection.ensure_tables()
+
+        self.chain = make_chain(20)
+        base = headers.parse_header(self.chain[0].hex())
+        base['height'] = 100
+        headers.store_header(base)
+        headers.batch_store_header([h.hex() for h in self.chain[1:10]])
+
+    def tearDown(self):
+        flatfile.close()
+        connection.CONN.close()
+        self.tmp.cleanup()
+
+    def _from_sqlite(self, height):
+        return [headers.header_from_tuple(tuple(r))
+                for r in connection.CONN.execute(
+                    '''
+                    SELECT hash, header, height, accumulated_work FROM headers
+                    WHERE height = ?
+                    ''',
+                    (height,))]
+
+    def test_open_and_get(self):
+        flatfile.open_file(self.path, connection.CONN)
+        self.assertTrue(flatfile.active(connection.CONN))
+        self.assertEqual(flatfile.base_height(), 100)
+        self.assertEqual(flatfile.tip_height(), 109)
+        self.assertEqual(
+            os.path.getsize(self.path),
+            flatfile.PREAMBLE.size + 10 * 80)
+
+        for i in range(10):
+            self.assertEqual(flatfile.get(100 + i), self.chain[i])
+        self.assertIsNone(flatfile.get(99))
+        self.assertIsNone(flatfile.get(110))
+
+    def test_follows_stores(self):
+        flatfile.open_file(self.path, connection.CONN)
+        headers.store_header(self.chain[10].hex())
+        headers.batch_store_header([h.hex() for h in self.chain[11:]])
+
+        self.assertEqual(flatfile.tip_height(), 119)
+        self.assertEqual(
+            flatfile.tip_hash(),
+            rutils.hash256(self.chain[19])[::-1])
+        # the hash comes from the index, so reads don't rehash the header
+        with mock.patch('zeta.db.headers.rutils.hash256') as mock_hash:
+            self.assertIsNotNone(headers._find_in_flatfile(115))
+            mock_hash.assert_not_called()
+        for height in range(100, 120):
+            self.assertEqual(
+                headers.find_by_height(height),
+                self._from_sqlite(height))
+
+    def test_reorg(self):
+        flatfile.open_file(self.path, connection.CONN)
+
+        # fork off height 105 with a longer chain
+        fork = make_chain(8, rutils.hash256(self.chain[5]), b'\x01')
+        headers.batch_store_header([h.hex() for h in fork])
+
+        self.assertEqual(flatfile.tip_height(), 113)
+        self.assertEqual(flatfile.get(105), self.chain[5])
+        self.assertEqual(flatfile.get(106), fork[0])
+        self.assertEqual(flatfile.get(113), fork[-1])
+
+        # two headers at 106, so that comes from SQLite
+        self.assertEqual(len(headers.find_by_height(106)), 2)
+        self.assertEqual(
+            headers.find_by_height(112),
+            self._from_sqlite(112))
+
+    def test_reopen_catches_up(self):
+        flatfile.open_file(self.path, connection.CONN)
+        flatfile.close()
+        self.assertFalse(flatfile.active(connection.CONN))
+
+        headers.batch_store_header([h.hex() for h in self.chain[10:]])
+
+        # and a partial header from a crash mid-write
+        with open(self.path, 'ab') as f:
+            f.write(b'\x00' * 30)
+
+        flatfile.open_file(self.path, connection.CONN)
+        self.assertEqual(flatfile.tip_height(), 119)
+        self.assertEqual(flatfile.get(119), self.chain[19])
+        self.assertEqual(
+            os.path.getsize(self.path),
+            flatfile.PREAMBLE.size + 20 * 80)
+
+    def test_reopen_rewrites_stale_tail(self):
+        flatfile.open_file(self.path, connection.CONN)
+        flatfile.close()
+        # NB: writes only ever touch the tail, so that's what is checked
+        with open(self.path, 'r+b') as f:
+            f.seek(flatfile.PREAMBLE.size + 9 * 80)
+            f.write(b'\x00' * 80)
+
+        flatfile.open_file(self.path, connection.CONN)
+        self.assertEqual(flatfile.get(109), self.chain[9])
+        self.assertEqual(flatfile.tip_height(), 109)
+
+    def test_inactive_for_other_connection(self):
+        flatfile.open_file(self.path, connection.CONN)
+        c = sqlite3.connect(':memory:')
+        self.assertFalse(flatfile.active(c))
+        c.close()
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\x00' * 100)
+        with self.assertRaises(ValueError):
+            flatfile.open_file(self.path, connection.CONN)
+        self.assertFalse(flatfile.active(connection.CONN))
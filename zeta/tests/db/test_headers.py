@@ -2,7 +2,7 @@ import sqlite3
 import unittest
 from unittest import mock
 
-from zeta.db import checkpoint, connection, headers
+from zeta.db import cache, checkpoint, connection, headers, index, orphans
 
 
 class TestHeaders(unittest.TestCase):
@@ -38,8 +38,33 @@ class TestHeaders(unittest.TestCase):
         connection.CONN.close()
 
     def test_header_from_row(self):
+        row = connection.get_cursor().execute(
+            '''
+            SELECT * FROM headers
+            ''').fetchone()
         self.assertEqual(
-            headers.header_from_row(self.test_header),
+            headers.header_from_row(row),
+            self.test_header)
+
+    def test_header_from_tuple(self):
+        row = connection.get_tuple_cursor().execute(
+            '''
+            SELECT hash, header, height, accumulated_work FROM headers
+            ''').fetchone()
+        self.assertEqual(
+            headers.header_from_tuple(row),
+            self.test_header)
+
+    def test_header_to_row(self):
+        row = headers.header_to_row(self.test_header)
+        self.assertEqual(row['hash'], bytes.fromhex(self.test_header['hash']))
+        self.assertEqual(len(row['header']), 80)
+        self.assertEqual(row['header'].hex(), self.test_header['hex'])
+        self.assertEqual(row['height'], 552955)
+        self.assertEqual(
+            headers.header_from_tuple((
+                row['hash'], row['header'], row['height'],
+                row['accumulated_work'])),
             self.test_header)
 
     def test_check_work(self):
@@ -79,6 +104,18 @@ class TestHeaders(unittest.TestCase):
             headers.parse_header('33')
         self.assertIn('Invalid header received', str(context.exception))
 
+    def test_parse_header_blob(self):
+        blob = bytes.fromhex(self.parsed_500['hex'] + self.block_501)
+        parsed = headers.parse_header_blob(blob)
+        self.assertEqual(
+            parsed,
+            [headers.parse_header(self.parsed_500['hex']),
+             headers.parse_header(self.block_501)])
+        self.assertEqual(headers.parse_header_blob(b''), [])
+        with self.assertRaises(ValueError) as context:
+            headers.parse_header_blob(blob[:-1])
+        self.assertIn('Invalid header received', str(context.exception))
+
     def test_batch_store_header(self):
         self.assertTrue(headers.batch_store_header(
             checkpoint.CHECKPOINTS['bitcoin_test']))
@@ -110,6 +147,92 @@ class TestHeaders(unittest.TestCase):
             heaviest['height'],
             502)
 
+    def test_batch_store_header_is_atomic(self):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        bad_502 = headers.parse_header(self.block_502)
+        del bad_502['hex']
+        self.assertFalse(headers.batch_store_header(
+            [self.block_501, bad_502]))
+        self.assertEqual(headers.find_by_height(501), [])
+        self.assertEqual(headers.find_by_height(502), [])
+
+    def test_batch_store_header_discards_unconnected_prefix(self):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        unconnected = checkpoint.CHECKPOINTS['bitcoin_test'][0].copy()
+        self.assertTrue(headers.batch_store_header(
+            [unconnected, self.block_501, self.block_502]))
+        self.assertIsNone(headers.find_by_hash(unconnected['hash']))
+        self.assertEqual(headers.find_by_height(502)[0]['hex'], self.block_502)
+
+    @mock.patch('zeta.db.connection.CHAIN_NAME', 'bitcoin_main', create=True)
+    def test_batch_store_header_checks_retarget(self):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertTrue(headers.batch_store_header(
+            [self.block_501, self.block_502]))
+
+    @mock.patch('zeta.db.headers.retarget.check_nbits')
+    def test_batch_store_header_rejects_bad_retarget(self, mock_check):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        mock_check.side_effect = [True, False]
+        self.assertFalse(headers.batch_store_header(
+            [self.block_501, self.block_502]))
+        self.assertEqual(headers.find_by_height(501), [])
+
+        mock_check.side_effect = None
+        mock_check.return_value = False
+        self.assertFalse(headers.store_header(self.block_501))
+        self.assertEqual(headers.find_by_height(501), [])
+
+    @mock.patch('zeta.db.headers.retarget.check_nbits')
+    def test_orphans_with_bad_retarget_are_deleted(self, mock_check):
+        mock_check.return_value = False
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertEqual(len(headers.find_by_height(0)), 1)
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertEqual(headers.find_by_height(501), [])
+        # dropped from the pool, so deleted from the DB and the index too
+        self.assertEqual(headers.find_by_height(0), [])
+        self.assertEqual(orphans.size(), 0)
+        self.assertIsNone(index.get(bytes.fromhex(
+            headers.parse_header(self.block_501)['hash'])))
+
+    @mock.patch('zeta.db.timestamps.time.time')
+    def test_store_header_rejects_future_timestamp(self, mock_time):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        mock_time.return_value = 1231969111 - 7201
+        self.assertFalse(headers.store_header(self.block_501))
+        self.assertFalse(headers.batch_store_header([self.block_501]))
+        self.assertEqual(headers.find_by_height(501), [])
+
+    def test_median_time_past(self):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertTrue(headers.batch_store_header(
+            [self.block_501, self.block_502]))
+        self.assertEqual(
+            headers.median_time_past(
+                headers.parse_header(self.block_502)['hash']),
+            headers.parse_header(self.block_501)['timestamp'])
+        self.assertIsNone(headers.median_time_past('00' * 32))
+        self.assertIsNone(headers.median_time_past('zz'))
+
+    def test_accumulated_work(self):
+        # NB: 500 is the base of the chain here, so it has 0 work
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertTrue(headers.batch_store_header([self.block_502]))
+        heaviest = headers.find_heaviest()[0]
+        self.assertEqual(heaviest['height'], 502)
+        self.assertEqual(heaviest['accumulated_work'], 2 * 0x100010001)
+
+    def test_accumulated_work_exceeds_64_bits(self):
+        big = self.parsed_500.copy()
+        big['accumulated_work'] = 2 ** 90
+        self.assertTrue(headers.store_header(big))
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertEqual(
+            headers.find_heaviest()[0]['accumulated_work'],
+            2 ** 90 + 0x100010001)
+
     def test_parent_height_and_work(self):
         # set this block as base for the chain
         self.assertTrue(headers.store_header(self.parsed_500))
@@ -142,6 +265,114 @@ class TestHeaders(unittest.TestCase):
         mock_get_cursor.return_value.execute.side_effect = ValueError()
         self.assertFalse(headers.store_header(self.parsed_500))
 
+    def test_orphans_connect_on_store(self):
+        self.assertTrue(headers.store_header(self.block_502))
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertEqual(orphans.size(), 2)
+        self.assertEqual(headers.find_by_height(502), [])
+
+        # the parent arrives, and its descendants connect right away
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertEqual(orphans.size(), 0)
+        connected = headers.find_by_height(502)[0]
+        self.assertEqual(connected['hex'], self.block_502)
+        self.assertEqual(connected['accumulated_work'], 2 * 0x100010001)
+        self.assertEqual(headers.find_heaviest()[0]['height'], 502)
+
+    def test_orphans_connect_on_batch(self):
+        self.assertTrue(headers.store_header(self.block_502))
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertTrue(headers.batch_store_header([self.block_501]))
+        self.assertEqual(orphans.size(), 0)
+        self.assertEqual(headers.find_by_height(502)[0]['hex'], self.block_502)
+
+    def test_orphans_loaded_from_db(self):
+        self.assertTrue(headers.store_header(self.block_502))
+
+        # e.g. a restart
+        orphans.clear()
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertEqual(headers.find_by_height(502)[0]['hex'], self.block_502)
+
+    @mock.patch('zeta.db.orphans.MAX_ORPHANS', 1)
+    def test_orphans_evicted_from_db(self):
+        self.assertTrue(headers.store_header(self.block_502))
+        self.assertTrue(headers.store_header(self.block_501))
+        hash_502 = headers.parse_header(self.block_502)['hash']
+        hash_501 = headers.parse_header(self.block_501)['hash']
+
+        # 502 was evicted, so it is gone from the DB and the index too
+        self.assertEqual(orphans.size(), 1)
+        self.assertEqual(index.size(), 2)
+        self.assertIsNone(index.get(bytes.fromhex(hash_502)))
+        self.assertIsNone(headers.find_by_hash(hash_502))
+        self.assertEqual(headers.find_by_hash(hash_501)['height'], 0)
+
+        # a batch of floating headers is bounded too
+        self.assertTrue(headers.batch_store_header(
+            [self.block_502, self.block_501]))
+        self.assertEqual(orphans.size(), 1)
+        self.assertEqual(index.size(), 2)
+
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertEqual(headers.find_by_height(501)[0]['hash'], hash_501)
+        self.assertEqual(index.size(), 3)
+
+    def test_orphans_restored_on_failure(self):
+        self.assertTrue(headers.store_header(self.block_502))
+        self.assertTrue(headers.store_header(self.parsed_500))
+        with mock.patch('zeta.db.headers._write_headers') as mock_write:
+            mock_write.side_effect = ValueError()
+            self.assertFalse(headers.store_header(self.block_501))
+        self.assertEqual(orphans.size(), 1)
+
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertEqual(headers.find_by_height(502)[0]['hex'], self.block_502)
+
+    def test_cache_hits(self):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        first = headers.find_by_hash(self.parsed_500['hash'])
+        headers.find_by_height(500)
+        hits = cache.stats()['by_hash_hits']
+
+        with mock.patch('zeta.db.headers.connection.get_cursor') as mock_c, \
+                mock.patch('zeta.db.headers.connection.get_tuple_cursor') \
+                as mock_tuple_c:
+            second = headers.find_by_hash(self.parsed_500['hash'])
+            self.assertEqual(headers.find_by_height(500), [second])
+            mock_c.assert_not_called()
+            mock_tuple_c.assert_not_called()
+        self.assertEqual(second, first)
+        self.assertIsNot(second, first)
+        self.assertEqual(cache.stats()['by_hash_hits'], hits + 1)
+
+    @mock.patch('zeta.db.headers.connection.is_writer')
+    def test_readers_dont_cache(self, mock_writer):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        cache.clear()
+        mock_writer.return_value = False
+        self.assertEqual(
+            headers.find_by_hash(self.parsed_500['hash']), self.parsed_500)
+        self.assertEqual(headers.find_by_height(500), [self.parsed_500])
+        self.assertEqual(cache.stats()['by_hash_size'], 0)
+        self.assertEqual(cache.stats()['by_height_size'], 0)
+
+    def test_cache_invalidated_on_write(self):
+        parsed_501 = headers.parse_header(self.block_501)
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertEqual(
+            headers.find_by_hash(parsed_501['hash'])['height'], 0)
+        self.assertEqual(len(headers.find_by_height(0)), 1)
+        self.assertEqual(headers.find_by_height(501), [])
+
+        # connecting 501 moves it from height 0 to 501
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertEqual(
+            headers.find_by_hash(parsed_501['hash'])['height'], 501)
+        self.assertEqual(headers.find_by_height(0), [])
+        self.assertEqual(len(headers.find_by_height(501)), 1)
+
     def test_find_by_height(self):
         self.assertEqual(headers.find_by_height(500), [])
         self.assertTrue(headers.store_header(self.parsed_500))
@@ -149,11 +380,48 @@ class TestHeaders(unittest.TestCase):
 
     def test_find_by_hash(self):
         self.assertIsNone(headers.find_by_hash(self.parsed_500['hash']))
+        self.assertIsNone(headers.find_by_hash('zz'))
         self.assertTrue(headers.store_header(self.parsed_500))
         self.assertEqual(
             headers.find_by_hash(self.parsed_500['hash']),
             self.parsed_500)
 
+    @mock.patch('zeta.db.headers.connection.get_tuple_cursor')
+    @mock.patch('zeta.db.headers.connection.get_cursor')
+    def test_find_by_hash_miss_skips_db(self, mock_get_cursor,
+                                        mock_get_tuple_cursor):
+        self.assertIsNone(headers.find_by_hash('77' * 32))
+        mock_get_cursor.assert_not_called()
+        mock_get_tuple_cursor.assert_not_called()
+
+    def test_find_ancestor(self):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertTrue(headers.store_header(self.block_502))
+        tip = headers.find_heaviest()[0]
+
+        self.assertEqual(
+            headers.find_ancestor(tip['hash'], 500),
+            self.parsed_500)
+        self.assertEqual(
+            headers.find_ancestor(tip['hash'], 502)['hash'],
+            tip['hash'])
+        self.assertIsNone(headers.find_ancestor(tip['hash'], 499))
+        self.assertIsNone(headers.find_ancestor('77' * 32, 500))
+        self.assertIsNone(headers.find_ancestor('zz', 500))
+
+    def test_index_reflects_writes(self):
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertTrue(headers.batch_store_header(
+            [self.block_501, self.block_502]))
+        node = index.get(bytes.fromhex(
+            headers.parse_header(self.block_502)['hash']))
+        self.assertEqual(node.height, 502)
+        self.assertEqual(node.parent.height, 501)
+        self.assertEqual(
+            node.parent.parent.hash,
+            bytes.fromhex(self.parsed_500['hash']))
+
     @mock.patch('zeta.db.headers.check_work')
     def test_find_highest(self, mock_check):
         mock_check.return_value = True
@@ -185,3 +453,26 @@ class TestHeaders(unittest.TestCase):
         self.assertEqual(
             headers.find_heaviest()[0]['hex'],
             self.block_502)
+
+    def test_find_by_prev_block(self):
+        self.assertEqual(
+            headers.find_by_prev_block(self.parsed_500['hash']), [])
+        self.assertEqual(headers.find_by_prev_block('zz'), [])
+
+        parsed_501 = headers.parse_header(self.block_501)
+        self.assertTrue(headers.store_header(parsed_501))
+        self.assertEqual(
+            headers.find_by_prev_block(self.parsed_500['hash']),
+            [parsed_501])
+        self.assertEqual(
+            headers.find_by_prev_block(self.parsed_500['hash'], True),
+            [parsed_501])
+
+        self.assertTrue(headers.store_header(self.parsed_500))
+        self.assertTrue(headers.store_header(self.block_501))
+        self.assertEqual(
+            headers.find_by_prev_block(self.parsed_500['hash'], True),
+            [])
+        self.assertEqual(
+            headers.find_by_prev_block(self.parsed_500['hash'])[0]['height'],
+            501)
@@ -0,0 +1,164 @@
+import sqlite3
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from zeta.db import connection, index
+from zeta.tests.helpers import make_hash
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        connection.ensure_tables()
+        index.load(c)
+
+        # a chain of 1000 nodes starting at height 500
+        for i in range(1000):
+            index.add(make_hash(i + 1), make_hash(i), 500 + i, i * 10)
+
+    def tearDown(self):
+        index.clear()
+        connection.CONN.close()
+
+    def test_skip_height(self):
+        self.assertEqual(index._skip_height(0), 0)
+        self.assertEqual(index._skip_height(1), 0)
+        for height in range(2, 5000):
+            self.assertLess(index._skip_height(height), height)
+
+    def test_add(self):
+        self.assertEqual(index.size(), 1000)
+        node = index.get(make_hash(1000))
+        self.assertEqual(node.height, 1499)
+        self.assertEqual(node.work, 9990)
+        self.assertIs(node.parent, index.get(make_hash(999)))
+
+        # first node has no known parent
+        self.assertIsNone(index.get(make_hash(1)).parent)
+
+        # floating headers don't get parents
+        floating = index.add(make_hash(5000), make_hash(1000), 0, 0)
+        self.assertIsNone(floating.parent)
+
+        # unless they're updated later
+        updated = index.add(make_hash(5000), make_hash(1000), 1500, 10000)
+        self.assertIs(floating, updated)
+        self.assertIs(updated.parent, index.get(make_hash(1000)))
+
+    def test_get_ancestor(self):
+        tip = index.get(make_hash(1000))
+        for height in range(500, 1500):
+            ancestor = tip.get_ancestor(height)
+            self.assertEqual(ancestor.height, height)
+            self.assertEqual(ancestor.hash, make_hash(height - 499))
+
+        self.assertIsNone(tip.get_ancestor(499))
+        self.assertIsNone(tip.get_ancestor(1500))
+        self.assertIsNone(tip.get_ancestor(-1))
+
+        self.assertEqual(
+            index.ancestor(make_hash(1000), 600).hash,
+            make_hash(101))
+        self.assertIsNone(index.ancestor(make_hash(99999), 600))
+
+    def test_get_ancestor_uses_skips(self):
+        tip = index.get(make_hash(1000))
+        walked = 0
+        walk = tip
+        while walk.height > 510:
+            height_skip = index._skip_height(walk.height)
+            if walk.skip is not None and height_skip >= 510:
+                walk = walk.skip
+            else:
+                walk = walk.parent
+            walked += 1
+        self.assertLess(walked, 100)
+
+    def test_tips(self):
+        self.assertEqual(index.highest(), [make_hash(1000)])
+        self.assertEqual(index.heaviest(), [make_hash(1000)])
+
+        # competing tip
+        index.add(make_hash(2000), make_hash(999), 1499, 9990)
+        self.assertEqual(index.highest(), [make_hash(1000), make_hash(2000)])
+        self.assertEqual(index.heaviest(), [make_hash(1000), make_hash(2000)])
+
+        # overwrite a tip with a lower value
+        index.add(make_hash(2000), make_hash(999), 0, 0)
+        self.assertEqual(index.highest(), [make_hash(1000)])
+        index.add(make_hash(1000), make_hash(999), 0, 0)
+        self.assertEqual(index.highest(), [make_hash(999)])
+        self.assertEqual(index.heaviest(), [make_hash(999)])
+
+    def test_count_at_height(self):
+        self.assertEqual(index.count_at_height(700), 1)
+        self.assertEqual(index.count_at_height(499), 0)
+
+        index.add(make_hash(2000), make_hash(199), 700, 2000)
+        self.assertEqual(index.count_at_height(700), 2)
+
+        # moving a node updates both heights
+        index.add(make_hash(2000), make_hash(199), 0, 0)
+        self.assertEqual(index.count_at_height(700), 1)
+        self.assertEqual(index.count_at_height(0), 1)
+
+    def test_remove(self):
+        index.add(make_hash(2000), make_hash(999), 1499, 9990)
+        index.remove(make_hash(2000))
+        index.remove(make_hash(2000))
+        self.assertIsNone(index.get(make_hash(2000)))
+        self.assertEqual(index.size(), 1000)
+        self.assertEqual(index.count_at_height(1499), 1)
+        self.assertEqual(index.heaviest(), [make_hash(1000)])
+
+        # removing the tip falls back to the next best
+        index.remove(make_hash(1000))
+        self.assertEqual(index.highest(), [make_hash(999)])
+        self.assertEqual(index.heaviest(), [make_hash(999)])
+
+        # descendants of a removed node still walk through it
+        index.remove(make_hash(500))
+        self.assertEqual(
+            index.ancestor(make_hash(999), 700).hash, make_hash(201))
+        self.assertEqual(index.count_at_height(999), 0)
+
+    def test_lowest_height(self):
+        self.assertEqual(index.lowest_height(), 500)
+        index.add(make_hash(5000), make_hash(4999), 0, 0)
+        self.assertEqual(index.lowest_height(), 500)
+        index.remove(make_hash(1))
+        self.assertEqual(index.lowest_height(), 501)
+        index.clear()
+        self.assertEqual(index.lowest_height(), 0)
+
+    def test_reads_during_writes(self):
+        def read():
+            for _ in range(200):
+                self.assertEqual(index.lowest_height(), 500)
+                self.assertEqual(len(index.highest()), 1)
+            return True
+
+        # the DB thread adds and removes while read pool threads query
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            reads = [pool.submit(read) for _ in range(2)]
+            for i in range(3000, 5000):
+                index.add(make_hash(i), make_hash(i - 1), 600 + i % 300, 0)
+                index.remove(make_hash(i))
+            self.assertTrue(all(r.result() for r in reads))
+        self.assertEqual(index.size(), 1000)
+
+    def test_ensure(self):
+        index.ensure(connection.CONN)
+        self.assertEqual(index.size(), 1000)
+
+        # a new connection triggers a reload
+        c = sqlite3.connect(':memory:')
+        connection.CONN = c
+        connection.ensure_tables()
+        index.ensure(c)
+        self.assertEqual(index.size(), 0)
+        self.assertEqual(index.highest(), [])
@@ -44,9 +44,27 @@ class TestKeys(unittest.TestCase):
             keys.key_from_row(self.enc_test_key),
             no_priv)
 
+    def test_key_from_tuple(self):
+        k = self.enc_test_key
+        row = (k['pubkey'], k['privkey'], k['derivation'], k['chain'],
+               k['address'])
+        self.assertEqual(
+            keys.key_from_tuple(row, self.secret, True),
+            self.test_key)
+
+        no_priv = self.test_key.copy()
+        no_priv['privkey'] = b''
+        self.assertEqual(keys.key_from_tuple(row), no_priv)
+        self.assertEqual(keys.key_from_tuple(row, get_priv=True), no_priv)
+
     def test_store_key(self):
         self.assertFalse(keys.store_key({}, self.secret))
 
+    @mock.patch('zeta.db.keys.connection.commit')
+    def test_store_key_durable(self, mock_commit):
+        self.assertTrue(keys.store_key(self.test_key, self.secret))
+        mock_commit.assert_called_once_with(durable=True)
+
     @mock.patch('zeta.db.keys.validate_key')
     def test_store_general_failure(self, mock_val):
         mock_val.return_value = True
@@ -0,0 +1,68 @@
+import sqlite3
+import tempfile
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from zeta.db import connection, mainchain
+from zeta.tests.helpers import make_hash
+
+
+class TestMainChain(unittest.TestCase):
+
+    def setUp(self):
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        connection.ensure_tables()
+
+    def tearDown(self):
+        connection.CONN.close()
+
+    def test_update(self):
+        self.assertIsNone(mainchain.find_tip())
+
+        mainchain.update(-1, [(h, make_hash(h)) for h in range(100, 110)])
+        self.assertEqual(mainchain.find_tip(), (109, make_hash(109)))
+        self.assertEqual(mainchain.find_hash(105), make_hash(105).hex())
+        self.assertIsNone(mainchain.find_hash(110))
+
+        # replace everything above 104
+        mainchain.update(104, [(105, make_hash(5105))])
+        self.assertEqual(mainchain.find_tip(), (105, make_hash(5105)))
+        self.assertIsNone(mainchain.find_hash(106))
+
+        # a failed update changes nothing
+        with self.assertRaises(sqlite3.IntegrityError):
+            mainchain.update(
+                100, [(101, make_hash(1)), (102, make_hash(1))])
+        self.assertEqual(mainchain.find_tip(), (105, make_hash(5105)))
+
+    def test_on_main_chain(self):
+        mainchain.update(-1, [(1, make_hash(1))])
+        self.assertTrue(mainchain.on_main_chain(make_hash(1).hex()))
+        self.assertFalse(mainchain.on_main_chain(make_hash(2).hex()))
+        self.assertFalse(mainchain.on_main_chain('zz'))
+
+    def test_read_pool(self):
+        with tempfile.TemporaryDirectory() as d:
+            connection.init_conn(path=d, db_name='test', chain_name='regtest')
+            self.addCleanup(connection.close_readers)
+            mainchain.update(-1, [(1, make_hash(1))])
+            connection.commit(durable=True)
+
+            # finders read through the thread's own connection, so they
+            # don't see writes that aren't committed yet
+            with ThreadPoolExecutor(max_workers=1) as pool, \
+                    connection.batch_commits():
+                mainchain.update(1, [(2, make_hash(2))])
+                self.assertEqual(
+                    pool.submit(mainchain.find_tip).result(),
+                    (1, make_hash(1)))
+                self.assertEqual(
+                    pool.submit(mainchain.find_hash, 1).result(),
+                    make_hash(1).hex())
+                self.assertTrue(pool.submit(
+                    mainchain.on_main_chain, make_hash(1).hex()).result())
+                self.assertEqual(mainchain.find_tip(), (2, make_hash(2)))
+            connection.CONN.close()
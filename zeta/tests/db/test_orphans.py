@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+from zeta.db import orphans
+
+
+def make_header(hash, prev_block):
+    return {'hash': hash, 'prev_block': prev_block, 'height': 0}
+
+
+class TestOrphans(unittest.TestCase):
+
+    def setUp(self):
+        orphans.clear()
+
+    def tearDown(self):
+        orphans.clear()
+
+    def test_add_and_take(self):
+        orphans.add(make_header('b1', 'a'))
+        orphans.add(make_header('b2', 'a'))
+        orphans.add(make_header('c', 'b1'))
+        self.assertEqual(orphans.size(), 3)
+
+        self.assertEqual(
+            [h['hash'] for h in orphans.take_children('a')],
+            ['b1', 'b2'])
+        self.assertEqual(orphans.take_children('a'), [])
+        self.assertEqual(orphans.size(), 1)
+
+        # re-adding replaces
+        orphans.add(make_header('c', 'b1'))
+        self.assertEqual(orphans.size(), 1)
+
+    def test_discard(self):
+        orphans.add(make_header('b', 'a'))
+        self.assertTrue(orphans.contains('b'))
+        orphans.discard('b')
+        orphans.discard('unknown')
+        self.assertFalse(orphans.contains('b'))
+        self.assertEqual(orphans.size(), 0)
+        self.assertEqual(orphans.take_children('a'), [])
+
+    @mock.patch('zeta.db.orphans.MAX_ORPHANS', 3)
+    def test_evicts_oldest(self):
+        for i in range(5):
+            orphans.add(make_header(str(i), 'a'))
+        self.assertEqual(orphans.size(), 3)
+        self.assertEqual(
+            [h['hash'] for h in orphans.take_children('a')],
+            ['2', '3', '4'])
+
+    def test_reset(self):
+        conn = object()
+        orphans.add(make_header('b', 'a'))
+        orphans.reset(conn)
+        self.assertTrue(orphans.active(conn))
+        self.assertEqual(orphans.size(), 0)
+        orphans.clear()
+        self.assertFalse(orphans.active(conn))
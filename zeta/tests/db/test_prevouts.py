@@ -75,21 +75,37 @@ class TestPrevouts(unittest.TestCase):
         p_list = [{}, {}]
         self.assertFalse(prevouts.batch_store_prevout(p_list))
 
-    def test_prevout_from_row(self):
+    def test_prevout_from_tuple(self):
+        row = self.prevout_as_row
         self.assertEqual(
-            prevouts.prevout_from_row(self.prevout_as_row),
+            prevouts.prevout_from_tuple((
+                bytes.fromhex(row['outpoint']), row['value'],
+                row['spent_at'], bytes.fromhex(row['spent_by']),
+                row['address'])),
             self.prevout)
 
-    def test_flatten_prevout(self):
+    def test_outpoint_key(self):
         self.assertEqual(
-            prevouts._flatten_prevout(self.prevout),
-            self.prevout_as_row)
+            prevouts.outpoint_key(self.prevout['outpoint']).hex(),
+            self.prevout_as_row['outpoint'])
 
     def test_find_by_address(self):
         self.assertEqual(
             prevouts.find_by_address(self.prevout['address']),
             [self.prevout])
 
+    def test_find_unspents_by_address(self):
+        address = self.prevout['address']
+        self.assertEqual(prevouts.find_unspents_by_address(address), [])
+
+        unspent = self.prevout.copy()
+        unspent['outpoint'] = {'tx_id': '99' * 32, 'index': 1}
+        unspent['spent_at'] = -2
+        unspent['spent_by'] = ''
+        self.assertTrue(prevouts.store_prevout(unspent))
+        self.assertEqual(prevouts.find_unspents_by_address(address), [unspent])
+        self.assertEqual(prevouts.find_unspents_by_address('nope'), [])
+
     def test_find_by_tx_id(self):
         self.assertEqual(
             prevouts.find_by_tx_id(self.prevout['outpoint']['tx_id']),
@@ -132,6 +148,16 @@ class TestPrevouts(unittest.TestCase):
             prevouts.check_for_known_outpoints([self.prevout['outpoint']]),
             [self.prevout['outpoint']])
 
+    def test_check_for_known_outpoints_many(self):
+        # more outpoints than SQLite binds in one statement
+        connection.CONN.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        unknown = [{'tx_id': '{:064x}'.format(i), 'index': 0}
+                   for i in range(2000)]
+        self.assertEqual(
+            prevouts.check_for_known_outpoints(
+                unknown + [self.prevout['outpoint']]),
+            [self.prevout['outpoint']])
+
     def test_find_spent_by_mempool_tx(self):
         self.assertEqual(
             prevouts.find_spent_by_mempool_tx(),
@@ -153,3 +179,71 @@ class TestPrevouts(unittest.TestCase):
 
     def test_find_all(self):
         prevouts.find_all()
+
+    def _store_many(self, count):
+        many = [{
+            'outpoint': {'tx_id': '{:064x}'.format(i), 'index': i},
+            'value': 1000 + i,
+            'spent_at': -2 if i % 2 else 5555,
+            'spent_by': '' if i % 2 else '44' * 32,
+            'address': '36gWkx1AR4ABH9nqzzsRJ6NFMedHw6QzW3'}
+            for i in range(count)]
+        self.assertTrue(prevouts.batch_store_prevout(many))
+        return many
+
+    def test_page_all(self):
+        many = self._store_many(5)
+
+        page = prevouts.page_all(limit=4)
+        self.assertEqual(len(page['prevouts']), 4)
+        self.assertIsNotNone(page['next'])
+        rest = prevouts.page_all(after=page['next'], limit=4)
+        self.assertEqual(len(rest['prevouts']), 2)
+        self.assertIsNone(rest['next'])
+        self.assertCountEqual(
+            page['prevouts'] + rest['prevouts'], many + [self.prevout])
+
+        # stores don't shift later pages
+        self.assertTrue(prevouts.batch_store_prevout(
+            [dict(many[0], value=1)]))
+        self.assertEqual(
+            prevouts.page_all(after=page['next'], limit=4), rest)
+
+        with self.assertRaises(ValueError):
+            prevouts.page_all(limit=0)
+
+    def test_page_filters(self):
+        many = self._store_many(5)
+        unspent = [p for p in many if p['spent_at'] == -2]
+
+        self.assertCountEqual(
+            prevouts.page_all_unspents()['prevouts'], unspent)
+        self.assertCountEqual(
+            prevouts.page_by_value_range(1001, 1003)['prevouts'], unspent)
+        self.assertCountEqual(
+            prevouts.page_by_value_range(
+                1000, 1002, unspents_only=False)['prevouts'],
+            [many[0], many[2]])
+        self.assertEqual(
+            prevouts.page_by_address(self.prevout['address']),
+            {'prevouts': [self.prevout], 'next': None})
+
+    def test_iter(self):
+        many = self._store_many(7)
+
+        expected = prevouts.page_all(limit=8)['prevouts']
+        with mock.patch('zeta.db.prevouts._find_page',
+                        wraps=prevouts._find_page) as mock_page:
+            self.assertEqual(list(prevouts.iter_all(page_size=3)), expected)
+        self.assertEqual(mock_page.call_count, 3)
+
+        self.assertCountEqual(
+            prevouts.iter_by_address(
+                '36gWkx1AR4ABH9nqzzsRJ6NFMedHw6QzW3', page_size=2),
+            many)
+        self.assertCountEqual(
+            prevouts.iter_all_unspents(page_size=2),
+            prevouts.find_all_unspents())
+        self.assertCountEqual(
+            prevouts.iter_by_value_range(1000, 1004, False, page_size=2),
+            [many[0], many[2], many[4]])
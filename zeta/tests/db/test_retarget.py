@@ -0,0 +1,89 @@
+import unittest
+
+from zeta import work
+from zeta.db import index, retarget
+from zeta.tests.helpers import make_nodes, spaced
+
+MAIN_BITS = bytes.fromhex('1d00ffff')[::-1]
+HARD_BITS = bytes.fromhex('1c05a3f4')[::-1]
+
+
+class TestRetarget(unittest.TestCase):
+
+    def setUp(self):
+        retarget._LAST_BITS.clear()
+
+    def test_unchecked(self):
+        parent = make_nodes(spaced(0, 1), 100, MAIN_BITS)[-1]
+        self.assertTrue(retarget.check_nbits(HARD_BITS, 0, parent, None))
+        self.assertTrue(
+            retarget.check_nbits(HARD_BITS, 0, parent, 'regtest'))
+
+        unknown = index.Node(b'\x00' * 32, 100, 0)
+        self.assertTrue(
+            retarget.check_nbits(HARD_BITS, 0, unknown, 'bitcoin_main'))
+
+    def test_mainnet_within_period(self):
+        parent = make_nodes(spaced(0, 2), 100, MAIN_BITS)[-1]
+        self.assertTrue(
+            retarget.check_nbits(MAIN_BITS, 0, parent, 'bitcoin_main'))
+        self.assertFalse(
+            retarget.check_nbits(HARD_BITS, 0, parent, 'bitcoin_main'))
+        # no min difficulty exception
+        parent = make_nodes(spaced(0, 2), 100, HARD_BITS)[-1]
+        self.assertFalse(retarget.check_nbits(
+            retarget.POW_LIMIT_BITS, 10 ** 9, parent, 'bitcoin_main'))
+
+    def test_mainnet_retarget(self):
+        # NB: the first vector from Bitcoin Core's pow_tests.cpp
+        nodes = make_nodes(spaced(1261130161, 2016), 30240, MAIN_BITS)
+        nodes[-1].time = 1262152739
+        self.assertTrue(retarget.check_nbits(
+            bytes.fromhex('1d00d86a')[::-1], 0, nodes[-1], 'bitcoin_main'))
+        self.assertFalse(retarget.check_nbits(
+            MAIN_BITS, 0, nodes[-1], 'bitcoin_main'))
+
+    def test_retarget_without_period_start(self):
+        # NB: e.g. the period started before our checkpoint
+        parent = make_nodes(spaced(0, 56), 32200, HARD_BITS)[-1]
+        hardest = work.retarget(HARD_BITS, work.TARGET_TIMESPAN // 4)
+        easiest = work.retarget(HARD_BITS, work.TARGET_TIMESPAN * 4)
+        for bits in [hardest, easiest, HARD_BITS]:
+            self.assertTrue(
+                retarget.check_nbits(bits, 0, parent, 'bitcoin_main'))
+        self.assertFalse(retarget.check_nbits(
+            work.target_to_nbits(work.make_target(hardest) - 2 ** 200),
+            0, parent, 'bitcoin_main'))
+        self.assertFalse(retarget.check_nbits(
+            MAIN_BITS, 0, parent, 'bitcoin_main'))
+
+    def test_testnet_min_difficulty(self):
+        nodes = make_nodes(spaced(0, 10), 4032, HARD_BITS)
+        min_diff = make_nodes(
+            spaced(20000, 500), 4042, retarget.POW_LIMIT_BITS)
+        min_diff[0].parent = nodes[-1]
+        parent = min_diff[-1]
+
+        # more than 20 minutes after the parent, min difficulty is required
+        late = parent.time + 1201
+        self.assertTrue(retarget.check_nbits(
+            retarget.POW_LIMIT_BITS, late, parent, 'bitcoin_test'))
+        self.assertFalse(
+            retarget.check_nbits(HARD_BITS, late, parent, 'bitcoin_test'))
+
+        # otherwise the last real difficulty applies
+        early = parent.time + 600
+        self.assertTrue(
+            retarget.check_nbits(HARD_BITS, early, parent, 'bitcoin_test'))
+        self.assertFalse(retarget.check_nbits(
+            retarget.POW_LIMIT_BITS, early, parent, 'bitcoin_test'))
+
+        # the walk back was cached
+        self.assertEqual(retarget._LAST_BITS[parent.hash], HARD_BITS)
+        self.assertEqual(len(retarget._LAST_BITS), 500)
+
+    def test_testnet_missing_ancestors(self):
+        parent = make_nodes(spaced(0, 5), 4042, retarget.POW_LIMIT_BITS)[-1]
+        self.assertTrue(
+            retarget.check_nbits(HARD_BITS, 3000, parent, 'bitcoin_test'))
+        self.assertEqual(len(retarget._LAST_BITS), 0)
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from riemann import utils as rutils
+
+from zeta.db import connection, headers, index, mainchain, orphans
+from zeta.db import retention, snapshot
+from zeta.tests.helpers import make_chain
+
+
+class TestRetention(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'archive.snap')
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.row_factory = sqlite3.Row
+        connection.CONN = self.conn
+        connection.ensure_tables()
+
+        # 50 headers from height 100
+        self.chain = make_chain(50)
+        base = headers.parse_header(self.chain[0].hex())
+        base['height'] = 100
+        headers.store_header(base)
+        self._store(self.chain[1:])
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def _store(self, raw_headers):
+        self.assertTrue(headers.batch_store_header(
+            [headers.parse_header(h.hex()) for h in raw_headers]))
+
+    def _fork(self, height, count):
+        '''
+        Stores a fork of count headers on top of the header at height
+        '''
+        fork = make_chain(
+            count,
+            prev=rutils.hash256(self.chain[height - 100]),
+            start_time=1500000000 + (height - 100 + 1) * 600 + 1)
+        self._store(fork)
+        return [rutils.hash256(h)[::-1] for h in fork]
+
+    def test_prune_stale_forks(self):
+        deep = self._fork(105, 3)
+        shallow = self._fork(140, 2)
+        size = index.size()
+
+        # the tip is at 149, so the cutoff is 139
+        self.assertEqual(retention.prune_stale_forks(10), 3)
+        self.assertEqual(index.size(), size - 3)
+        for hash in deep:
+            self.assertIsNone(index.get(hash))
+            self.assertIsNone(headers.find_by_hash(hash.hex()))
+        for hash in shallow:
+            self.assertIsNotNone(headers.find_by_hash(hash.hex()))
+        self.assertEqual(len(headers.find_by_height(106)), 1)
+        self.assertEqual(
+            headers.find_by_height(106)[0]['hex'], self.chain[6].hex())
+
+        # the main chain is untouched
+        self.assertEqual(retention.prune_stale_forks(10), 0)
+        self.assertEqual(
+            len(headers.find_by_height(149)), 1)
+        self.assertEqual(retention.prune_stale_forks(0), 0)
+
+    def test_prune_stale_forks_bounded(self):
+        self._fork(105, 3)
+
+        # one height per call, resuming where the last call stopped
+        self.assertEqual(retention.prune_stale_forks(10, limit=1), 1)
+        self.assertEqual(retention._HEIGHT_CURSOR, 107)
+        self.assertEqual(retention.prune_stale_forks(10, limit=1), 1)
+        self.assertEqual(retention.prune_stale_forks(10, limit=1), 1)
+        self.assertEqual(retention.prune_stale_forks(10, limit=1), 0)
+
+        with mock.patch('zeta.db.retention.SCAN_HEIGHTS', 2):
+            retention.prune_stale_forks(10)
+            self.assertEqual(retention._HEIGHT_CURSOR, 102)
+
+    def test_prune_floating(self):
+        floating = make_chain(3, prev=b'\x11' * 32)
+        with mock.patch('zeta.db.orphans.MAX_ORPHANS', 2):
+            for h in floating:
+                headers.store_header(h.hex())
+        self.assertEqual(orphans.size(), 2)
+
+        # the first was deleted when the pool evicted it
+        self.assertIsNone(headers.find_by_hash(
+            rutils.hash256(floating[0])[::-1].hex()))
+        self.assertEqual(retention.prune_floating(), 0)
+
+        # one that left the pool some other way can never connect
+        orphans.discard(rutils.hash256(floating[1])[::-1].hex())
+        self.assertEqual(retention.prune_floating(), 1)
+        self.assertIsNone(headers.find_by_hash(
+            rutils.hash256(floating[1])[::-1].hex()))
+        self.assertIsNotNone(headers.find_by_hash(
+            rutils.hash256(floating[2])[::-1].hex()))
+        self.assertEqual(retention.prune_floating(), 0)
+
+        # the pool isn't loaded, so nothing is known to be evicted
+        orphans.clear()
+        self.assertEqual(retention.prune_floating(), 0)
+
+    def test_prune_floating_bounded(self):
+        floating = make_chain(3, prev=b'\x11' * 32)
+        for h in floating:
+            headers.store_header(h.hex())
+        orphans.discard(rutils.hash256(floating[2])[::-1].hex())
+        orphans.discard(rutils.hash256(floating[1])[::-1].hex())
+
+        counts = [retention.prune_floating(limit=2) for _ in range(3)]
+        self.assertEqual(sum(counts), 2)
+        self.assertEqual(headers.find_by_height(0)[0]['hex'],
+                         floating[0].hex())
+
+    @mock.patch('zeta.db.retention.MIN_COMPACT_DEPTH', 0)
+    def test_compact(self):
+        expected = [headers.find_by_height(h)[0] for h in range(100, 150)]
+        fork = self._fork(105, 1)
+        mainchain.update(-1, [(h['height'], bytes.fromhex(h['hash']))
+                              for h in expected])
+
+        self.assertEqual(
+            retention.compact(self.path, 'bitcoin_test', 10, limit=15), 15)
+        self.assertIsNone(mainchain.find_hash(114))
+        self.assertEqual(mainchain.find_hash(115), expected[15]['hash'])
+        self.assertEqual(
+            snapshot.read_trailer(self.path),
+            ('bitcoin_test', 100, 15, expected[0]['accumulated_work'],
+             expected[14]['accumulated_work']))
+        self.assertEqual(index.lowest_height(), 115)
+        self.assertEqual(headers.find_by_height(110), [])
+        self.assertIsNone(headers.find_by_hash(fork[0].hex()))
+        self.assertEqual(headers.find_by_height(115), [expected[15]])
+
+        self.assertEqual(
+            retention.compact(self.path, 'bitcoin_test', 10, limit=15), 15)
+        self.assertEqual(
+            retention.compact(self.path, 'bitcoin_test', 10, limit=15), 9)
+        self.assertEqual(
+            retention.compact(self.path, 'bitcoin_test', 10, limit=15), 0)
+        # the header 10 below the tip is the rolling checkpoint
+        self.assertEqual(index.lowest_height(), 139)
+        self.assertEqual(headers.find_heaviest(), [expected[-1]])
+
+        # the archive is a valid snapshot
+        conn = sqlite3.connect(':memory:')
+        conn.row_factory = sqlite3.Row
+        connection.CONN = conn
+        connection.ensure_tables()
+        self.assertEqual(
+            snapshot.import_snapshot(
+                self.path, 'bitcoin_test', expected[0]),
+            138)
+        self.assertEqual(headers.find_by_height(138), [expected[38]])
+        conn.close()
+
+    def test_compact_min_depth(self):
+        self.assertEqual(
+            retention.compact(self.path, 'bitcoin_test', 10), 0)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(index.lowest_height(), 100)
+
+    @mock.patch('zeta.db.retention.MIN_COMPACT_DEPTH', 0)
+    def test_compact_wrong_network(self):
+        retention.compact(self.path, 'bitcoin_test', 10, limit=15)
+        with self.assertRaises(ValueError):
+            retention.compact(self.path, 'bitcoin_main', 10, limit=15)
+        self.assertEqual(index.lowest_height(), 115)
+
+    def _fill_and_empty(self, conn):
+        conn.execute('CREATE TABLE filler (data BLOB)')
+        conn.executemany('INSERT INTO filler VALUES (?)',
+                         [(b'\x00' * 1000,) for _ in range(500)])
+        conn.execute('DELETE FROM filler')
+        conn.commit()
+
+    def test_vacuum(self):
+        self.assertEqual(
+            self.conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        self._fill_and_empty(self.conn)
+        # freed pages are committed with the next group commit
+        with connection.batch_commits():
+            self.assertEqual(retention.vacuum(pages=10), 10)
+            self.assertTrue(self.conn.in_transaction)
+        self.assertFalse(self.conn.in_transaction)
+        self.assertGreater(retention.vacuum(), 0)
+        self.assertEqual(
+            self.conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+
+    def test_vacuum_legacy(self):
+        # NB: tables created before ensure_tables, as in older DBs
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE legacy (data BLOB)')
+        connection.CONN = conn
+        connection.ensure_tables()
+        self.assertEqual(conn.execute('PRAGMA auto_vacuum').fetchone()[0], 0)
+        self._fill_and_empty(conn)
+
+        # only an explicit full vacuum converts it
+        self.assertEqual(retention.vacuum(), 0)
+        self.assertGreater(retention.full_vacuum(), 0)
+        self.assertEqual(conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        self.assertEqual(retention.vacuum(), 0)
+        conn.close()
+
+    @mock.patch('zeta.db.retention.vacuum')
+    @mock.patch('zeta.db.retention.compact')
+    @mock.patch('zeta.db.retention.prune_floating')
+    @mock.patch('zeta.db.retention.prune_stale_forks')
+    def test_step(self, mock_stale, mock_floating, mock_compact,
+                  mock_vacuum):
+        self.assertEqual(
+            retention.step('bitcoin_main'),
+            {'stale': 0, 'floating': 0, 'archived': 0, 'vacuumed': 0})
+        mock_vacuum.assert_not_called()
+
+        mock_stale.return_value = 1
+        mock_floating.return_value = 2
+        mock_compact.return_value = 3
+        mock_vacuum.return_value = 4
+        with mock.patch.multiple(
+                'zeta.db.retention', PRUNE_DEPTH=100, COMPACT_DEPTH=5000,
+                ARCHIVE_PATH=self.path):
+            self.assertEqual(
+                retention.step('bitcoin_main'),
+                {'stale': 1, 'floating': 2, 'archived': 3, 'vacuumed': 4})
+        mock_stale.assert_called_once_with(100)
+        mock_compact.assert_called_once_with(
+            self.path, 'bitcoin_main', 5000)
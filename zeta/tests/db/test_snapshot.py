@@ -0,0 +1,232 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from zeta.db import connection, headers, index, snapshot
+from zeta.tests.helpers import make_chain
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'headers.snap')
+        self.chain = make_chain(50)
+        self.base = headers.parse_header(self.chain[0].hex())
+        self.base['height'] = 100
+        self.conn = None
+        self._fresh_db()
+
+    def tearDown(self):
+        connection.CONN.close()
+        self.tmp.cleanup()
+
+    def _fresh_db(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.row_factory = sqlite3.Row
+        connection.CONN = self.conn
+        connection.ensure_tables()
+
+    def _store_chain(self):
+        headers.store_header(self.base)
+        headers.batch_store_header(
+            [headers.parse_header(h.hex()) for h in self.chain[1:]])
+
+    def _corrupt(self, offset, data):
+        with open(self.path, 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+
+    def test_round_trip(self):
+        self._store_chain()
+        expected = [headers.find_by_height(h)[0] for h in range(100, 150)]
+
+        self.assertEqual(
+            snapshot.export_snapshot(self.path, 'bitcoin_test'),
+            50)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        self.assertEqual(
+            snapshot.read_trailer(self.path),
+            ('bitcoin_test', 100, 50, 0, expected[-1]['accumulated_work']))
+
+        self._fresh_db()
+        self.assertEqual(
+            snapshot.import_snapshot(self.path, 'bitcoin_test', self.base),
+            149)
+        self.assertEqual(
+            [headers.find_by_height(h)[0] for h in range(100, 150)],
+            expected)
+        self.assertEqual(
+            headers.find_heaviest()[0]['hash'],
+            expected[-1]['hash'])
+        self.assertEqual(index.size(), 50)
+
+    def test_export_tip(self):
+        self._store_chain()
+        tip = headers.find_by_height(120)[0]['hash']
+        self.assertEqual(
+            snapshot.export_snapshot(self.path, 'bitcoin_test', tip),
+            21)
+
+    def test_append(self):
+        self._store_chain()
+        nodes = [index.get(bytes.fromhex(headers.find_by_height(h)[0]['hash']))
+                 for h in range(100, 150)]
+
+        self.assertEqual(
+            snapshot.append_snapshot(
+                self.path, 'bitcoin_test', self.chain[:20], 100,
+                nodes[0].work, nodes[19].work),
+            20)
+        self.assertEqual(
+            snapshot.append_snapshot(
+                self.path, 'bitcoin_test', self.chain[20:], 120,
+                nodes[20].work, nodes[49].work),
+            50)
+        self.assertEqual(
+            snapshot.read_trailer(self.path),
+            ('bitcoin_test', 100, 50, 0, nodes[49].work))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(50 * 80), b''.join(self.chain))
+
+        self._fresh_db()
+        self.assertEqual(
+            snapshot.import_snapshot(self.path, 'bitcoin_test', self.base),
+            149)
+
+    def test_append_errors(self):
+        snapshot.append_snapshot(
+            self.path, 'bitcoin_test', self.chain[:20], 100, 0, 0)
+        with self.assertRaises(ValueError) as context:
+            snapshot.append_snapshot(
+                self.path, 'bitcoin_main', self.chain[20:], 120, 0, 0)
+        self.assertIn('network', str(context.exception))
+        with self.assertRaises(ValueError) as context:
+            snapshot.append_snapshot(
+                self.path, 'bitcoin_test', self.chain[21:], 121, 0, 0)
+        self.assertIn('does not end', str(context.exception))
+        with self.assertRaises(ValueError) as context:
+            snapshot.append_snapshot(
+                self.path, 'bitcoin_test', self.chain[21:], 120, 0, 0)
+        self.assertIn('broken link', str(context.exception))
+        self.assertEqual(snapshot.read_trailer(self.path)[2], 20)
+
+    def test_export_empty(self):
+        with self.assertRaises(ValueError):
+            snapshot.export_snapshot(self.path, 'bitcoin_test')
+
+    def test_import_errors(self):
+        self._store_chain()
+        snapshot.export_snapshot(self.path, 'bitcoin_test')
+        with open(self.path, 'rb') as f:
+            original = f.read()
+        self._fresh_db()
+
+        with self.assertRaisesRegex(ValueError, 'network'):
+            snapshot.import_snapshot(self.path, 'bitcoin_main', self.base)
+
+        # break the link to header 10
+        self._corrupt(10 * 80 + 4, b'\x01')
+        with self.assertRaisesRegex(ValueError, 'broken link'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test', self.base)
+
+        # raise the difficulty of the last header
+        self._corrupt(0, original)
+        self._corrupt(49 * 80 + 72, b'\xff\xff\x00\x1d')
+        with self.assertRaisesRegex(ValueError, 'insufficient work'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test', self.base)
+
+        # claim more work than the headers have
+        self._corrupt(0, original)
+        self._corrupt(len(original) - 1, b'\xff')
+        with self.assertRaisesRegex(ValueError, 'chainwork'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test', self.base)
+
+        self._corrupt(0, original)
+        self._corrupt(50 * 80, b'NOTASNAP')
+        with self.assertRaisesRegex(ValueError, 'format'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test', self.base)
+
+        with open(self.path, 'wb') as f:
+            f.write(original[80:])
+        with self.assertRaisesRegex(ValueError, 'length'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test', self.base)
+
+        # nothing was written
+        self.assertEqual(headers.find_by_height(100), [])
+        index.ensure(connection.CONN)
+        self.assertEqual(index.size(), 0)
+
+    def test_import_checkpoint_mismatch(self):
+        self._store_chain()
+        snapshot.export_snapshot(self.path, 'bitcoin_test')
+        self._fresh_db()
+        headers.store_header(self.base)
+
+        other = headers.parse_header(make_chain(1, b'\x01' * 32)[0].hex())
+        other['height'] = 110
+        with self.assertRaisesRegex(ValueError, 'checkpoint'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test', other)
+
+        # checkpoints outside the snapshot are ignored
+        other['height'] = 99
+        self.assertEqual(
+            snapshot.import_snapshot(self.path, 'bitcoin_test', other),
+            149)
+
+    def test_import_unknown_parent(self):
+        self._store_chain()
+        snapshot.export_snapshot(self.path, 'bitcoin_test')
+        self._fresh_db()
+
+        with self.assertRaisesRegex(ValueError, 'parent of height 100'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test')
+
+        # a checkpoint at another height doesn't anchor it
+        other = dict(self.base, height=101)
+        with self.assertRaisesRegex(ValueError, 'parent of height 100'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test', other)
+        index.ensure(connection.CONN)
+        self.assertEqual(index.size(), 0)
+
+    def test_import_forged_start_work(self):
+        self._store_chain()
+        start_work = index.get(bytes.fromhex(self.base['hash'])).work
+        tip_work = index.get(
+            bytes.fromhex(headers.find_by_height(149)[0]['hash'])).work
+        snapshot.append_snapshot(
+            self.path, 'bitcoin_test', self.chain, 100,
+            start_work + 2 ** 80, tip_work + 2 ** 80)
+        self._fresh_db()
+
+        with self.assertRaisesRegex(ValueError, 'chainwork'):
+            snapshot.import_snapshot(self.path, 'bitcoin_test', self.base)
+        self.assertEqual(headers.find_by_height(100), [])
+
+    def test_import_extends_stored(self):
+        self._store_chain()
+        nodes = [index.get(bytes.fromhex(headers.find_by_height(h)[0]['hash']))
+                 for h in range(100, 150)]
+        snapshot.append_snapshot(
+            self.path, 'bitcoin_test', self.chain[20:], 120,
+            nodes[20].work, nodes[49].work)
+        self._fresh_db()
+        headers.store_header(self.base)
+        headers.batch_store_header(
+            [headers.parse_header(h.hex()) for h in self.chain[1:20]])
+        self.assertFalse(snapshot.is_loaded(self.path))
+
+        self.assertEqual(
+            snapshot.import_snapshot(self.path, 'bitcoin_test'), 149)
+        self.assertEqual(
+            index.get(bytes.fromhex(headers.find_by_height(149)[0]['hash'])),
+            index.get(nodes[49].hash))
+        self.assertEqual(
+            headers.find_heaviest()[0]['accumulated_work'], nodes[49].work)
+        self.assertTrue(snapshot.is_loaded(self.path))
+        self.assertEqual(
+            snapshot.read_tip(self.path),
+            (149, nodes[49].hash.hex()))
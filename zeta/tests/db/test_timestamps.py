@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+from zeta.db import index, timestamps
+from zeta.tests.helpers import make_nodes
+
+
+class TestTimestamps(unittest.TestCase):
+
+    def setUp(self):
+        timestamps._WINDOWS.clear()
+
+    def tearDown(self):
+        timestamps._WINDOWS.clear()
+
+    def test_time_window(self):
+        nodes = make_nodes(range(100, 120))
+        self.assertEqual(
+            timestamps.time_window(nodes[3]), (100, 101, 102, 103))
+        self.assertEqual(len(timestamps._WINDOWS), 0)
+
+        self.assertEqual(
+            timestamps.time_window(nodes[15]),
+            tuple(range(105, 116)))
+        self.assertIn(nodes[15].hash, timestamps._WINDOWS)
+
+        # extending a cached window doesn't walk back
+        nodes[15].parent = None
+        self.assertEqual(
+            timestamps.time_window(nodes[16]),
+            tuple(range(106, 117)))
+
+    def test_time_window_lru(self):
+        nodes = make_nodes(range(100, 114))
+        with mock.patch.object(
+                timestamps, '_WINDOWS_CACHE_SIZE', 2):
+            timestamps.time_window(nodes[10])
+            timestamps.time_window(nodes[11])
+            # a hit keeps the oldest window from being evicted
+            timestamps.time_window(nodes[10])
+            timestamps.time_window(nodes[13])
+        self.assertEqual(
+            list(timestamps._WINDOWS),
+            [nodes[10].hash, nodes[13].hash])
+
+    def test_median_time_past(self):
+        # NB: out of order timestamps are allowed, the median smooths them
+        nodes = make_nodes([5, 1, 9, 3, 7, 2, 8, 4, 6, 10, 0])
+        self.assertEqual(timestamps.median_time_past(nodes[-1]), 5)
+        self.assertEqual(timestamps.median_time_past(nodes[1]), 5)
+        self.assertEqual(timestamps.median_time_past(nodes[2]), 5)
+        self.assertIsNone(timestamps.median_time_past(
+            index.Node(b'\x00' * 32, 1, 0)))
+
+    def test_check_timestamp(self):
+        parent = make_nodes(range(100, 111))[-1]
+        self.assertFalse(timestamps.check_timestamp(105, parent, now=200))
+        self.assertTrue(timestamps.check_timestamp(106, parent, now=200))
+
+        # too far in the future
+        self.assertTrue(timestamps.check_timestamp(7400, parent, now=200))
+        self.assertFalse(timestamps.check_timestamp(7401, parent, now=200))
+
+        # without 11 ancestors only the future limit applies
+        short = make_nodes(range(100, 110))[-1]
+        self.assertTrue(timestamps.check_timestamp(0, short, now=200))
@@ -0,0 +1,56 @@
+from riemann import utils as rutils
+
+from zeta import work
+from zeta.db import index
+
+# NB: regtest's minimum difficulty, so mining takes ~2 tries per header
+EASY_NBITS = bytes.fromhex('ffff7f20')
+
+
+def make_hash(i):
+    return i.to_bytes(32, 'big')
+
+
+def make_chain(count, prev=b'\x00' * 32, salt=b'\x00',
+               start_time=1500000000):
+    '''
+    Makes linked 80 byte headers that pass their own PoW check
+    Different salts give different chains from the same parent
+    '''
+    res = []
+    target = work.make_target(EASY_NBITS)
+    for i in range(count):
+        prefix = (b'\x00\x00\x00\x20' + prev + salt * 32
+                  + (start_time + i * 600).to_bytes(4, 'little')
+                  + EASY_NBITS)
+        nonce = 0
+        while True:
+            header = prefix + nonce.to_bytes(4, 'little')
+            if int.from_bytes(rutils.hash256(header), 'little') <= target:
+                break
+            nonce += 1
+        res.append(header)
+        prev = rutils.hash256(header)
+    return res
+
+
+def spaced(start_time, count, spacing=600):
+    '''
+    Returns count timestamps, spacing seconds apart
+    '''
+    return range(start_time, start_time + count * spacing, spacing)
+
+
+def make_nodes(times, start_height=1000, bits=None):
+    '''
+    Makes a chain of unsaved index nodes with these timestamps
+    Returns:
+        (list(index.Node)): the nodes, lowest first
+    '''
+    nodes = []
+    parent = None
+    for i, t in enumerate(times):
+        parent = index.Node(
+            make_hash(start_height + i), start_height + i, 0, parent, bits, t)
+        nodes.append(parent)
+    return nodes
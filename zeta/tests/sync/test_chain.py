@@ -1,13 +1,357 @@
+import asyncio
+import sqlite3
 import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+from zeta.db import connection, index, mainchain
+from zeta.sync import chain
+from zeta.tests.helpers import make_chain, make_hash
 
 
 class TestChain(unittest.TestCase):
 
     def setUp(self):
-        ...
+        c = sqlite3.connect(':memory:')
+        c.row_factory = sqlite3.Row
+        connection.CONN = c
+        connection.ensure_tables()
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.chain = make_chain(3 * chain.CHUNK_SIZE + 5)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.stored = []
 
     def tearDown(self):
-        ...
+        self.loop.close()
+        connection.CONN.close()
+
+    async def fake_get_headers(self, start_height, count):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # NB: later chunks come back first
+        await asyncio.sleep(0.01 * (10 - start_height // count))
+        self.in_flight -= 1
+        chunk = self.chain[start_height:start_height + count]
+        return {
+            'count': len(chunk),
+            'hex': b''.join(chunk).hex(),
+            'max': 2016}
+
+    def fake_batch_store(self, batch):
+        self.stored.append(batch)
+        return True
 
     def test_initial_setup(self):
         ...
+
+    @mock.patch('zeta.sync.chain.os.path.exists')
+    @mock.patch('zeta.sync.chain.snapshot.is_loaded')
+    @mock.patch('zeta.sync.chain.snapshot.import_snapshot')
+    @mock.patch('zeta.sync.chain.headers')
+    def test_initial_setup_snapshot(self, mock_headers, mock_import,
+                                    mock_loaded, mock_exists):
+        mock_headers.find_highest.return_value = [{'height': 600000}]
+        latest = max(chain.checkpoint.CHECKPOINTS['bitcoin_main'],
+                     key=lambda k: k['height'])
+
+        mock_exists.return_value = False
+        self.assertEqual(
+            chain._initial_setup('bitcoin_main', 'headers.snap'),
+            600000)
+        mock_import.assert_not_called()
+        mock_headers.store_header.assert_called_once_with(latest)
+
+        # an already loaded snapshot isn't imported again
+        mock_exists.return_value = True
+        mock_loaded.return_value = True
+        chain._initial_setup('bitcoin_main', 'headers.snap')
+        mock_import.assert_not_called()
+
+        mock_loaded.return_value = False
+        chain._initial_setup('bitcoin_main', 'headers.snap')
+        mock_import.assert_called_once_with(
+            'headers.snap', 'bitcoin_main', latest)
+
+        # a bad snapshot doesn't stop startup
+        mock_import.side_effect = ValueError('Invalid snapshot')
+        self.assertEqual(
+            chain._initial_setup('bitcoin_main', 'headers.snap'),
+            600000)
+
+    @mock.patch('zeta.sync.chain.headers')
+    def test_initial_setup_compacted(self, mock_headers):
+        mock_headers.find_highest.return_value = [{'height': 700000}]
+        latest = max(chain.checkpoint.CHECKPOINTS['bitcoin_main'],
+                     key=lambda k: k['height'])
+
+        # compact pruned the DB past the checkpoint
+        index.ensure(connection.CONN)
+        index.add(make_hash(1), make_hash(0), latest['height'] + 10, 10)
+        chain._initial_setup('bitcoin_main', 'headers.snap')
+        mock_headers.store_header.assert_not_called()
+
+    def test_update_main_chain(self):
+        self.assertIsNone(chain._update_main_chain())
+        self.assertIsNone(mainchain.find_tip())
+
+        # a chain of 10 nodes starting at height 100
+        index.ensure(connection.CONN)
+        for i in range(10):
+            index.add(make_hash(i + 1), make_hash(i), 100 + i, i * 10)
+
+        # the first update records the whole chain, without an event
+        self.assertIsNone(chain._update_main_chain())
+        self.assertEqual(mainchain.find_tip(), (109, make_hash(10)))
+        self.assertEqual(mainchain.find_hash(100), make_hash(1).hex())
+
+        # extending the tip is not a reorg
+        index.add(make_hash(11), make_hash(10), 110, 100)
+        self.assertIsNone(chain._update_main_chain())
+        self.assertEqual(mainchain.find_tip(), (110, make_hash(11)))
+
+        # an equal-work competitor doesn't move the main chain
+        index.add(make_hash(1011), make_hash(10), 110, 100)
+        self.assertIsNone(chain._update_main_chain())
+        self.assertEqual(mainchain.find_tip(), (110, make_hash(11)))
+
+        # a heavier fork off height 105
+        index.add(make_hash(1007), make_hash(6), 106, 1000)
+        index.add(make_hash(1008), make_hash(1007), 107, 2000)
+        event = chain._update_main_chain()
+        self.assertEqual(event, {
+            'type': 'reorg',
+            'fork_height': 105,
+            'fork_hash': make_hash(6).hex(),
+            'disconnected': [make_hash(i).hex() for i in range(11, 6, -1)],
+            'connected': [make_hash(1007).hex(), make_hash(1008).hex()]})
+        self.assertEqual(mainchain.find_tip(), (107, make_hash(1008)))
+        self.assertIsNone(mainchain.find_hash(108))
+        self.assertTrue(mainchain.on_main_chain(make_hash(6).hex()))
+        self.assertFalse(mainchain.on_main_chain(make_hash(7).hex()))
+
+        # nothing changed since
+        self.assertIsNone(chain._update_main_chain())
+
+    def test_find_fork(self):
+        index.ensure(connection.CONN)
+        for i in range(1000):
+            index.add(make_hash(i + 1), make_hash(i), 1 + i, i)
+        index.add(make_hash(5000), make_hash(300), 301, 0)
+
+        a = index.get(make_hash(1000))
+        b = index.get(make_hash(5000))
+        self.assertIs(chain._find_fork(a, b), index.get(make_hash(300)))
+        self.assertIs(chain._find_fork(a, a), a)
+        self.assertIsNone(chain._find_fork(None, a))
+        self.assertEqual(
+            chain._path_from(a, index.get(make_hash(998))),
+            [index.get(make_hash(999)), a])
+
+    @mock.patch('zeta.sync.chain._update_main_chain')
+    def test_emit_reorg(self, mock_update):
+        q = asyncio.Queue()
+        mock_update.return_value = None
+        self.loop.run_until_complete(chain._emit_reorg(q))
+        self.assertTrue(q.empty())
+
+        mock_update.return_value = {'type': 'reorg'}
+        self.loop.run_until_complete(chain._emit_reorg(q))
+        self.loop.run_until_complete(chain._emit_reorg())
+        self.assertEqual(q.get_nowait(), {'type': 'reorg'})
+        self.assertTrue(q.empty())
+
+    def test_check_linkage(self):
+        batch = chain._parse_header_chunk(
+            b''.join(self.chain[:10]).hex())
+        self.assertTrue(chain._check_linkage(batch, None))
+        self.assertTrue(chain._check_linkage(batch[1:], batch[0]['hash']))
+        self.assertFalse(chain._check_linkage(batch[2:], batch[0]['hash']))
+        self.assertFalse(chain._check_linkage(batch[::-1], None))
+        self.assertTrue(chain._check_linkage([], None))
+
+    def test_parse_header_chunk(self):
+        batch = chain._parse_header_chunk(b''.join(self.chain[:3]).hex())
+        self.assertEqual(
+            [h['hex'] for h in batch],
+            [h.hex() for h in self.chain[:3]])
+
+    @mock.patch('zeta.sync.chain.PARSE_WORKERS', 0)
+    def test_parse_header_chunk_async_inline(self):
+        blob = b''.join(self.chain)
+        self.assertIsNone(chain._get_parse_pool())
+        self.assertEqual(
+            self.loop.run_until_complete(
+                chain._parse_header_chunk_async(blob.hex())),
+            chain._parse_header_chunk(blob.hex()))
+
+    @mock.patch('zeta.sync.chain.PARSE_WORKERS', 3)
+    @mock.patch('zeta.sync.chain._get_parse_pool')
+    def test_parse_header_chunk_async_pool(self, mock_pool):
+        pool = ThreadPoolExecutor(max_workers=3)
+        mock_pool.return_value = mock.Mock(wraps=pool)
+        blob = b''.join(self.chain)
+
+        # small batches stay inline
+        small = blob[:80 * (chain.PARSE_POOL_THRESHOLD - 1)]
+        self.loop.run_until_complete(
+            chain._parse_header_chunk_async(small.hex()))
+        mock_pool.return_value.submit.assert_not_called()
+
+        # large batches are split across the workers
+        self.assertEqual(
+            self.loop.run_until_complete(
+                chain._parse_header_chunk_async(blob.hex())),
+            chain._parse_header_chunk(blob.hex()))
+        self.assertEqual(mock_pool.return_value.submit.call_count, 3)
+        pool.shutdown()
+
+    def test_get_parse_pool(self):
+        pool = chain._get_parse_pool()
+        self.assertIs(pool, chain._get_parse_pool())
+        self.assertNotEqual(
+            pool._mp_context.get_start_method(), 'fork')
+        batch = pool.submit(
+            chain.headers.parse_header_blob,
+            b''.join(self.chain[:2])).result()
+        self.assertEqual(batch[1]['prev_block'], batch[0]['hash'])
+
+    @mock.patch('zeta.sync.chain.headers.batch_store_header')
+    @mock.patch('zeta.sync.chain.electrum.get_headers')
+    def test_catch_up(self, mock_get, mock_store):
+        mock_get.side_effect = self.fake_get_headers
+        mock_store.side_effect = self.fake_batch_store
+
+        height = self.loop.run_until_complete(chain._catch_up(0, window=3))
+
+        self.assertEqual(height, len(self.chain))
+        self.assertEqual(self.max_in_flight, 3)
+        # stored in order, despite arriving out of order
+        self.assertEqual(
+            [h['hex'] for batch in self.stored for h in batch],
+            [h.hex() for h in self.chain])
+
+    @mock.patch('zeta.sync.chain._resume_catch_up')
+    @mock.patch('zeta.sync.chain.headers.batch_store_header')
+    @mock.patch('zeta.sync.chain.electrum.get_headers')
+    def test_catch_up_bad_chunk(self, mock_get, mock_store, mock_resume):
+        mock_get.side_effect = self.fake_get_headers
+        mock_store.side_effect = self.fake_batch_store
+
+        # break the link between chunk 1 and chunk 2
+        self.chain[chain.CHUNK_SIZE] = make_chain(1)[0]
+
+        height = self.loop.run_until_complete(chain._catch_up(0, window=2))
+        self.assertEqual(height, chain.CHUNK_SIZE)
+        self.assertEqual(len(self.stored), 1)
+        # the bad chunk was retried once
+        self.assertEqual(
+            [c[0][0] for c in mock_get.call_args_list].count(
+                chain.CHUNK_SIZE),
+            2)
+        # and catch up starts again from there later
+        mock_resume.assert_called_once_with(chain.CHUNK_SIZE, 2, None)
+
+    @mock.patch('zeta.sync.chain._resume_catch_up')
+    @mock.patch('zeta.sync.chain.headers.batch_store_header')
+    @mock.patch('zeta.sync.chain.electrum.get_headers')
+    def test_catch_up_store_fails(self, mock_get, mock_store, mock_resume):
+        mock_get.side_effect = self.fake_get_headers
+
+        # the second chunk is rejected twice
+        def store(batch):
+            if batch[0]['hex'] == self.chain[chain.CHUNK_SIZE].hex():
+                return False
+            return self.fake_batch_store(batch)
+        mock_store.side_effect = store
+
+        height = self.loop.run_until_complete(chain._catch_up(0, window=2))
+        self.assertEqual(height, chain.CHUNK_SIZE)
+        self.assertEqual(len(self.stored), 1)
+        self.assertEqual(mock_store.call_count, 3)
+        mock_resume.assert_called_once_with(chain.CHUNK_SIZE, 2, None)
+
+        # a chunk that stores on the retry continues
+        self.stored = []
+        failures = [self.chain[chain.CHUNK_SIZE].hex()]
+
+        def flaky(batch):
+            if batch[0]['hex'] in failures:
+                failures.remove(batch[0]['hex'])
+                return False
+            return self.fake_batch_store(batch)
+        mock_store.side_effect = flaky
+
+        height = self.loop.run_until_complete(chain._catch_up(0, window=2))
+        self.assertEqual(height, len(self.chain))
+        self.assertEqual(mock_resume.call_count, 1)
+
+    @mock.patch('zeta.sync.chain._resume_catch_up')
+    @mock.patch('zeta.sync.chain.headers.batch_store_header')
+    @mock.patch('zeta.sync.chain.electrum.get_headers')
+    def test_catch_up_error_response(self, mock_get, mock_store,
+                                     mock_resume):
+        async def fail(*args):
+            raise ValueError()
+        mock_get.side_effect = fail
+        height = self.loop.run_until_complete(chain._catch_up(7))
+        self.assertEqual(height, 7)
+        mock_store.assert_not_called()
+        mock_resume.assert_called_once_with(7, chain.CATCH_UP_WINDOW, None)
+
+    @mock.patch('zeta.sync.chain.CATCH_UP_RETRY', 0)
+    @mock.patch('zeta.sync.chain.headers.batch_store_header')
+    @mock.patch('zeta.sync.chain.electrum.get_headers')
+    def test_catch_up_resumes(self, mock_get, mock_store):
+        mock_store.side_effect = self.fake_batch_store
+
+        # the server sends a bad chunk twice, then recovers
+        bad = [chain.CHUNK_SIZE, chain.CHUNK_SIZE]
+        good = self.fake_get_headers
+
+        async def flaky(height, count):
+            if height in bad:
+                bad.remove(height)
+                raise ValueError()
+            return await good(height, count)
+        mock_get.side_effect = flaky
+
+        async def run():
+            height = await chain._catch_up(0, window=2)
+            while sum(len(b) for b in self.stored) < len(self.chain):
+                await asyncio.sleep(0.01)
+            return height
+
+        self.assertEqual(
+            self.loop.run_until_complete(run()), chain.CHUNK_SIZE)
+        self.assertEqual(
+            [h['hex'] for batch in self.stored for h in batch],
+            [h.hex() for h in self.chain])
+
+    @mock.patch('zeta.sync.chain.time')
+    def test_catch_up_progress(self, mock_time):
+        mock_time.monotonic.return_value = 100
+        mock_time.time.return_value = 1500000000 + 6000
+        progress = chain._CatchUpProgress(500)
+
+        mock_time.monotonic.return_value = 110
+        self.assertEqual(
+            progress.update(600, 1500000000),
+            'catch up: height 600 (10 heights/sec, ETA 1s)')
+
+        mock_time.monotonic.return_value = 100
+        self.assertEqual(
+            chain._CatchUpProgress(500).update(500, 1500000000),
+            'catch up: height 500 (0 heights/sec, ETA unknown)')
+
+    @mock.patch('zeta.sync.chain.time')
+    def test_catch_up_progress_due(self, mock_time):
+        mock_time.monotonic.return_value = 100
+        progress = chain._CatchUpProgress(500)
+        self.assertFalse(progress.due())
+
+        mock_time.monotonic.return_value = 100 + chain.PROGRESS_INTERVAL
+        self.assertTrue(progress.due())
+        self.assertFalse(progress.due())
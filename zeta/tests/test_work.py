@@ -0,0 +1,100 @@
+import unittest
+
+from zeta import work
+from zeta.db import checkpoint
+
+
+class TestWork(unittest.TestCase):
+
+    def test_make_target(self):
+        self.assertEqual(
+            work.make_target(bytes.fromhex('01003456')[::-1]),
+            0x00)
+        self.assertEqual(
+            work.make_target(bytes.fromhex('01123456')[::-1]),
+            0x12)
+        self.assertEqual(
+            work.make_target(bytes.fromhex('02008000')[::-1]),
+            0x80)
+        self.assertEqual(
+            work.make_target(bytes.fromhex('05009234')[::-1]),
+            0x92340000)
+        self.assertEqual(
+            work.make_target(b'\xff\xff\x00\x1d'),
+            0xffff << 208)
+        self.assertIsInstance(
+            work.make_target(bytes.fromhex('01003456')[::-1]),
+            int)
+
+    def test_parse_difficulty(self):
+        for header in (checkpoint.CHECKPOINTS['bitcoin_test']
+                       + checkpoint.CHECKPOINTS['bitcoin_main']):
+            self.assertEqual(
+                work.parse_difficulty(bytes.fromhex(header['nbits'])),
+                header['difficulty'])
+
+    def test_work_from_nbits(self):
+        # genesis block chainwork is 0x100010001
+        self.assertEqual(
+            work.work_from_nbits(b'\xff\xff\x00\x1d'),
+            0x100010001)
+        # regtest minimum difficulty
+        self.assertEqual(
+            work.work_from_nbits(bytes.fromhex('ffff7f20')),
+            2)
+        # zero target has no work
+        self.assertEqual(
+            work.work_from_nbits(bytes.fromhex('01003456')[::-1]),
+            0)
+
+    def test_work_is_cached(self):
+        work.work_from_nbits.cache_clear()
+        nbits = bytes.fromhex(checkpoint.CHECKPOINTS['bitcoin_test'][0]['nbits'])
+        for _ in range(10):
+            work.work_from_nbits(nbits)
+        info = work.work_from_nbits.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 9)
+
+    def test_header_work(self):
+        header = checkpoint.CHECKPOINTS['bitcoin_main'][0]
+        self.assertEqual(
+            work.header_work(header),
+            work.work_from_nbits(bytes.fromhex(header['nbits'])))
+        # work is roughly difficulty * 2**32
+        self.assertAlmostEqual(
+            work.header_work(header) / (header['difficulty'] * 2 ** 32),
+            1,
+            places=3)
+
+    def test_accumulate(self):
+        header = checkpoint.CHECKPOINTS['bitcoin_main'][0]
+        self.assertEqual(
+            work.accumulate(7, header),
+            7 + work.header_work(header))
+
+    def test_target_to_nbits(self):
+        for nbits in ['1d00ffff', '1c05a3f4', '1b0404cb', '17053894',
+                      '207fffff']:
+            as_bytes = bytes.fromhex(nbits)[::-1]
+            self.assertEqual(
+                work.target_to_nbits(work.make_target(as_bytes)),
+                as_bytes)
+        # high bit of the mantissa is never set
+        self.assertEqual(
+            work.target_to_nbits(0x80),
+            bytes.fromhex('02008000')[::-1])
+        self.assertEqual(work.target_to_nbits(0), b'\x00' * 4)
+
+    def test_retarget(self):
+        # NB: vectors from Bitcoin Core's pow_tests.cpp
+        vectors = [
+            # (last nbits, first time, last time, expected)
+            ('1d00ffff', 1261130161, 1262152739, '1d00d86a'),
+            ('1d00ffff', 1231006505, 1233061996, '1d00ffff'),  # pow limit
+            ('1c05a3f4', 1279008237, 1279297671, '1c0168fd'),  # 4x harder
+            ('1c387f6f', 1263163443, 1269211443, '1d00e1fd')]  # 4x easier
+        for nbits, first, last, expected in vectors:
+            self.assertEqual(
+                work.retarget(bytes.fromhex(nbits)[::-1], last - first),
+                bytes.fromhex(expected)[::-1])
@@ -0,0 +1,122 @@
+from functools import lru_cache
+
+from zeta.zeta_types import Header
+
+# NB: nbits only changes every 2016 blocks on mainnet, so a small cache
+#     covers the whole chain since any checkpoint
+CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def make_target(nbits: bytes) -> int:
+    '''
+    converts an nbits from a header into the target
+    Args:
+        nbits (bytes): the 4-byte nbits bytestring
+    Returns:
+        (int): the target threshold
+    '''
+    exponent = nbits[-1]
+    mantissa = int.from_bytes(nbits[:-1], 'little')
+    if exponent <= 3:
+        return mantissa >> (8 * (3 - exponent))
+    return mantissa << (8 * (exponent - 3))
+
+
+DIFF_1_TARGET = make_target(b'\xff\xff\x00\x1d')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_difficulty(nbits: bytes) -> int:
+    '''
+    converts an nbits from a header into the difficulty
+    Args:
+        nbits (bytes): the 4-byte nbits bytestring
+    Returns:
+        (int): the difficulty (no decimals)
+    '''
+    return DIFF_1_TARGET // make_target(nbits)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def work_from_nbits(nbits: bytes) -> int:
+    '''
+    Calculates the expected number of hashes to meet a target
+    This is Bitcoin's definition of block proof: 2**256 / (target + 1)
+    Args:
+        nbits (bytes): the 4-byte nbits bytestring
+    Returns:
+        (int): the work
+    '''
+    target = make_target(nbits)
+    if target == 0 or target >= 1 << 256:
+        return 0
+    return (1 << 256) // (target + 1)
+
+
+def header_work(header: Header) -> int:
+    '''
+    Calculates the work in a single header
+    Args:
+        header (dict): the parsed header
+    Returns:
+        (int): the work
+    '''
+    return work_from_nbits(bytes.fromhex(header['nbits']))
+
+
+def accumulate(parent_work: int, header: Header) -> int:
+    '''
+    Calculates a header's accumulated work from its parent's
+    Args:
+        parent_work  (int): the parent's accumulated work
+        header      (dict): the parsed header
+    Returns:
+        (int): the header's accumulated work
+    '''
+    return parent_work + header_work(header)
+
+
+# NB: Bitcoin's difficulty adjustment parameters
+RETARGET_INTERVAL = 2016
+TARGET_SPACING = 10 * 60
+TARGET_TIMESPAN = RETARGET_INTERVAL * TARGET_SPACING
+POW_LIMIT = DIFF_1_TARGET
+
+
+def target_to_nbits(target: int) -> bytes:
+    '''
+    converts a target into the compact nbits format
+    The inverse of make_target, rounding the target down
+    Args:
+        target (int): the target threshold
+    Returns:
+        (bytes): the 4-byte nbits bytestring
+    '''
+    size = (target.bit_length() + 7) // 8
+    if size <= 3:
+        compact = target << (8 * (3 - size))
+    else:
+        compact = target >> (8 * (size - 3))
+    # NB: the mantissa is signed, so avoid setting its high bit
+    if compact & 0x00800000:
+        compact >>= 8
+        size += 1
+    return (compact | size << 24).to_bytes(4, 'little')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def retarget(nbits: bytes, timespan: int) -> bytes:
+    '''
+    Calculates the nbits of a new difficulty period
+    Same as Bitcoin Core's CalculateNextWorkRequired
+    Args:
+        nbits (bytes): the nbits of the last header of the previous period
+        timespan (int): seconds between the first and last header of the
+                        previous period
+    Returns:
+        (bytes): the 4-byte nbits the new period must use
+    '''
+    timespan = min(max(timespan, TARGET_TIMESPAN // 4), TARGET_TIMESPAN * 4)
+    target = make_target(nbits) * timespan // TARGET_TIMESPAN
+    return target_to_nbits(min(target, POW_LIMIT))
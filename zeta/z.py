@@ -4,7 +4,8 @@ import riemann
 
 from zeta import crypto, electrum, utils
 from zeta.sync import chain, coins
-from zeta.db import connection, headers
+from zeta.db import connection
+from zeta.db.aio import headers, runner
 
 from typing import Any, Optional, Tuple
 
@@ -15,7 +16,7 @@ async def _status_updater() -> None:
     '''
     best = None
     while True:
-        heaviest = headers.find_heaviest()
+        heaviest = await headers.find_heaviest()
 
         # it'd be very strange if this failed
         # but I put in the check, which implies that it happened in testing
@@ -36,6 +37,11 @@ async def _status_updater() -> None:
 async def _report_new_headers(header_q) -> None:
     # print header hashes as they come in
     def make_block_hash(h) -> str:
+        if h.get('type') == 'reorg':
+            return('reorg: {} blocks replaced by {} after height {}'.format(
+                len(h['disconnected']),
+                len(h['connected']),
+                h['fork_height']))
         # print the header hash in a human-readable format
         return('new header: {}'.format(
             crypto.hash256(bytes.fromhex(h['hex']))[::-1].hex()))
@@ -74,6 +80,8 @@ async def zeta(
     chain_name = os.environ.get('ZETA_NETWORK', network)
     riemann.select_network(chain_name)
     connection.init_conn(chain_name=chain_name)
+    # NB: from here on, DB calls from coroutines go through zeta.db.aio
+    runner.start()
     await electrum.electrum._make_client(chain_name)
 
     chain_task = asyncio.ensure_future(chain.sync(header_q, chain_name))
@@ -100,4 +108,8 @@ if __name__ == '__main__':
     asyncio.ensure_future(_report_new_headers(header_q))
     asyncio.ensure_future(_report_new_prevouts(prevout_q))
 
-    asyncio.get_event_loop().run_forever()
+    try:
+        asyncio.get_event_loop().run_forever()
+    finally:
+        runner.stop()
+        connection.flush()
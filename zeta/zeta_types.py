@@ -1,6 +1,6 @@
 from mypy_extensions import TypedDict
 
-from typing import List
+from typing import List, Optional
 
 Header = TypedDict(
     'Header',
@@ -47,16 +47,21 @@ Prevout = TypedDict(
     }
 )
 
-PrevoutEntry = TypedDict(  # the DB formatted prevout
-    'PrevoutEntry',
+PrevoutPage = TypedDict(  # one page of a keyset paginated prevout query
+    'PrevoutPage',
     {
-        'outpoint': str,  # tx serialization format
-        'tx_id': str,  # block explorers
-        'idx': int,
-        'value': int,  # in sat
-        'spent_at': int,  # block height
-        'spent_by': str,  # txid
-        'address': str
+        'prevouts': List[Prevout],
+        'next': Optional[str]  # opaque token for the next page. None if last
+    }
+)
+
+Balance = TypedDict(  # an address's prevouts, or the wallet's, summed
+    'Balance',
+    {
+        'confirmed': int,  # in sat. Not spent in a block
+        'mempool_spent': int,  # in sat. Spent by a mempool tx
+        'unspent_count': int,  # prevouts not spent at all
+        'total_value': int  # in sat. Every prevout, spent or not
     }
 )
 
@@ -79,3 +84,14 @@ ElectrumGetHeadersResponse = TypedDict(
         'max': int
     }
 )
+
+ReorgEvent = TypedDict(  # put on the header queue when the main chain moves
+    'ReorgEvent',
+    {
+        'type': str,  # always 'reorg'
+        'fork_height': int,  # last height shared by both chains
+        'fork_hash': str,  # 0000-first
+        'disconnected': List[str],  # 0000-first hashes, old tip first
+        'connected': List[str]  # 0000-first hashes, lowest first
+    }
+)